@@ -1,3 +1,9 @@
+import json
+import os
+
+# Written by texel_tuner.py; the engines load it in place of the tables below when it exists
+TUNED_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tuned_eval.json')
+
 
 
 class AI():
@@ -59,8 +65,30 @@ class AI():
             20, 50, 10, 0, 0, 40, 50, 20]
         }
 
+        # Weights of the evaluation terms in algorithm1.evaluation
+        self.weights = {'activity': 0.1, 'mobility': 0.1, 'center': 0.4, 'pawns': 0.2, 'king_safety': 0.6}
+
     def getTable(self):
         return self.piece_square_table
 
     def setTable(self, table):
-        self.piece_square_table = table
\ No newline at end of file
+        self.piece_square_table = table
+
+    def getWeights(self):
+        return self.weights
+
+    def setWeights(self, weights):
+        self.weights = dict(self.weights, **weights)
+
+    def saveTable(self, path=TUNED_PATH):
+        with open(path, 'w') as handle:
+            json.dump({'piece_square_table': self.piece_square_table, 'weights': self.weights}, handle)
+
+    def loadTable(self, path=TUNED_PATH):
+        if not os.path.exists(path):
+            return False
+        with open(path) as handle:
+            tuned = json.load(handle)
+        self.setTable(tuned['piece_square_table'])
+        self.setWeights(tuned.get('weights', {}))
+        return True
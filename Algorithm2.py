@@ -1,88 +1,79 @@
 import chess
-# Minimax function with alpha-beta pruning.
-def minimax(board, depth, alpha, beta, maximizing_player):
-    if depth == 0 or board.is_game_over() or board.is_repetition(3):
-        if board.is_repetition(3):
-            return 0, None  # return 0 score indicating a draw
-        else:
-            return evaluation(board, depth), None
-
-    board_hash = hash(str(board))
-    if board_hash in transposition_table:
-        return transposition_table[board_hash], None
-
-    if maximizing_player:
-        max_value = float('-inf')
-        best_move = None
-        for move in board.legal_moves:
-            board.push(move)
-            eval_child, _ = minimax(board, depth - 1, alpha, beta, False)
-            board.pop()
-            if eval_child > max_value:
-                max_value = eval_child
-                best_move = move
-            alpha = max(alpha, eval_child)
-            if beta <= alpha:
-                break
-        transposition_table[board_hash] = max_value
-        return max_value, best_move
+from evaluator import (HAND_SET_TABLES, material_balance, evaluate_mobility, evaluate_center_control,
+                       evaluate_pawn_structure)
+from search import Search, principal_variation
+from search_stats import Profiler, SearchStats
+from transposition import DEFAULT_SIZE_MB, TranspositionTable
+
+
+# Tuning only changes algorithm1's tables, so Algorithm2 always plays with the hand-set ones
+TABLES, MIRRORED_TABLES = HAND_SET_TABLES
+
+
+def leaf_evaluation(board, evaluator):
+    return evaluation(board, 0, evaluator)
+
+
+# Kept across iterations and across moves of a game; entries from older searches age out
+transposition_table = TranspositionTable()
+searcher = Search(leaf_evaluation, transposition_table, tables=HAND_SET_TABLES)
+
+
+def new_searcher(hash_mb=DEFAULT_SIZE_MB, evaluate=leaf_evaluation):
+    # A searcher with tables of its own, for a second Algorithm2 playing in the same process or
+    # for another leaf evaluation such as neural_eval.NeuralEvaluator
+    return Search(evaluate, TranspositionTable(hash_mb), tables=HAND_SET_TABLES)
+
+
+# Function to get the best move for the current player, and the SearchStats of the search.
+# on_iteration(stats) is called after every completed iteration; with profile_dir set the
+# search dumps a cProfile there. search defaults to the module's searcher.
+def best_move(board, max_depth, options=None, time_manager=None, on_iteration=None, profile_dir=None,
+              search=None):
+    search = search or searcher
+    search.transposition_table.new_search()
+    search.new_search()
+    search.configure(**(options or {}))
+    stats = SearchStats()
+
+    def report(depth, score, move, nodes):
+        stats.nodes = nodes
+        stats.record_iteration(depth, score, principal_variation(board, move, search.transposition_table, depth))
+        if on_iteration is not None:
+            on_iteration(stats)
+
+    if profile_dir is None:
+        best_move, best_value, depth = search.iterative_deepening(board, max_depth, time_manager=time_manager,
+                                                                  on_iteration=report)
     else:
-        min_value = float('inf')
-        best_move = None
-        for move in board.legal_moves:
-            board.push(move)
-            eval_child, _ = minimax(board, depth - 1, alpha, beta, True)
-            board.pop()
-            if eval_child < min_value:
-                min_value = eval_child
-                best_move = move
-            beta = min(beta, eval_child)
-            if beta <= alpha:
-                break
-        transposition_table[board_hash] = min_value
-        return min_value, best_move
-
-
-# Function to get the best move for the current player.
-transposition_table = {}
-
-def best_move(board, max_depth):
-    global transposition_table
-    transposition_table = {}  # Clear the transposition table
-
-    best_move = None
-    best_value = float('-inf') if board.turn else float('inf')
-
-    for depth in range(1, max_depth + 1):
-        value, move = minimax(board, depth, float('-inf'), float('inf'), board.turn)
-        if board.turn and value > best_value:
-            best_value = value
-            best_move = move
-        elif not board.turn and value < best_value:
-            best_value = value
-            best_move = move
-
-    print(best_move, best_value)
-    return best_move
-
-
-def evaluation(board, depth):
+        with Profiler(profile_dir, f'{board.ply()}-algorithm2') as profiler:
+            best_move, best_value, depth = search.iterative_deepening(board, max_depth, time_manager=time_manager,
+                                                                      on_iteration=report)
+        stats.profile = profiler.summary()
 
-    depth_score = (depth) * 10
+    stats.nodes = 0
+    stats.add(search.counters())
+    stats.finish(best_move, best_value, depth)
+    print(stats.summary())
+    return best_move, stats
 
-    if board.is_checkmate():
-        return -10000000 if board.turn else 10000000
 
-    material = total_material(board)
+def evaluation(board, depth, evaluator=None):
+
+    depth_score = (depth) * 10
 
     # Piece activity and mobility
-    piece_map = board.piece_map()
-    activity = sum(piece_position_score(piece, pos) for pos, piece in piece_map.items())
-    mobility = sum(len(list(board.legal_moves)) for piece in piece_map.values())
+    if evaluator is None:
+        material = total_material(board)
+        piece_map = board.piece_map()
+        activity = sum(piece_position_score(piece, pos) for pos, piece in piece_map.items())
+    else:
+        material = evaluator.material_balance()
+        activity = evaluator.activity(chess.WHITE)
+    mobility = evaluate_mobility(board)
 
     # Control of the center
-    center_squares = chess.SquareSet([chess.D4, chess.D5, chess.E4, chess.E5])
-    center_control = sum(1 for square in board.piece_map() if square in center_squares)
+    center_control = evaluate_center_control(board)
 
     # Pawn structure
     pawn_structure = evaluate_pawn_structure(board)
@@ -91,6 +82,7 @@ def evaluation(board, depth):
     king_safety = evaluate_king_safety(board, board.turn)
 
     if not (board.turn):
+        material = -material
         activity = -activity
         mobility = -mobility
         pawn_structure = -pawn_structure
@@ -111,21 +103,7 @@ def evaluation(board, depth):
     return score
 
 def total_material(board):
-    piece_values = {chess.PAWN: 100, chess.KNIGHT: 280, chess.BISHOP: 320, chess.ROOK: 500, chess.QUEEN: 900}
-
-    white_score = 0
-    black_score = 0
-
-    for square in chess.SQUARES:
-        piece = board.piece_at(square)
-        if piece:
-            piece_value = piece_values.get(piece.piece_type, 0)
-            if piece.color == chess.WHITE:
-                white_score += piece_value
-            else:
-                black_score += piece_value
-
-    return white_score - black_score
+    return material_balance(board)
 
 def is_endgame(board):
     total_materials = total_material(board)
@@ -136,92 +114,8 @@ def is_endgame(board):
     return total_materials <= endgame_threshold
 
 def piece_position_score(piece, position):
-    # Piece-square tables
-    piece_square_tables = {
-        'P': [  # Pawn
-            0, 0, 0, 0, 0, 0, 0, 0,
-            5, 10, 10, -20, -20, 10, 10, 5,
-            5, -5, -10, 0, 0, -10, -5, 5,
-            1, 1, 1, 40, 40, 1, 1, 1,
-            5, 5, 10, 55, 55, 10, 5, 5,
-            10, 10, 20, 30, 30, 20, 10, 10,
-            50, 50, 50, 30, 30, 50, 50, 50,
-            0, 0, 0, 0, 0, 0, 0, 0],
-        'N': [  # Knight
-            -50, -40, -30, -30, -30, -30, -40, -50,
-            -40, -20, 0, 0, 0, 0, -20, -40,
-            -30, 0, 10, 15, 15, 10, 0, -30,
-            -30, 5, 15, 20, 20, 15, 5, -30,
-            -30, 0, 15, 20, 20, 15, 0, -30,
-            -30, 5, 30, 15, 15, 30, 5, -30,
-            -40, -20, 0, 5, 5, 0, -20, -40,
-            -50, -40, -30, -30, -30, -30, -40, -50],
-        'B': [  # Bishop
-            -20, -10, -10, -10, -10, -10, -10, -20,
-            -10, 0, 0, 0, 0, 0, 0, -10,
-            -10, 0, 5, 10, 10, 5, 0, -10,
-            -10, 5, 5, 10, 10, 5, 5, -10,
-            -10, 0, 10, 10, 10, 10, 0, -10,
-            -10, 10, 10, 10, 10, 10, 10, -10,
-            -10, 5, 0, 0, 0, 0, 5, -10,
-            -20, -10, -10, -10, -10, -10, -10, -20],
-        'R': [  # Rook
-            0, 0, 0, 0, 0, 0, 0, 0,
-            5, 10, 10, 10, 10, 10, 10, 5,
-            -5, 1, 1, 1, 1, 1, 1, -5,
-            -5, 1, 1, 1, 1, 1, 1, -5,
-            -5, 1, 1, 1, 1, 1, 1, -5,
-            -5, 1, 1, 1, 1, 1, 1, -5,
-            -5, 1, 1, 1, 1, 1, 1, -5,
-            1, 1, 10, 10, 10, 10, 1, 1],
-        'Q': [  # Queen
-            -20, -10, -10, -5, -5, -10, -10, -20,
-            -10, 0, 0, 0, 0, 0, 0, -10,
-            -10, 0, 5, 5, 5, 5, 0, -10,
-            -5, 0, 5, 5, 5, 5, 0, -5,
-            0, 0, 5, 5, 5, 5, 0, -5,
-            -10, 5, 5, 5, 5, 5, 0, -10,
-            -10, 0, 5, 0, 0, 0, 0, -10,
-            -20, -10, -10, -5, -5, -10, -10, -20],
-        'K': [  # King
-            -30, -40, -40, -50, -50, -40, -40, -30,
-            -30, -40, -40, -50, -50, -40, -40, -30,
-            -30, -40, -40, -50, -50, -40, -40, -30,
-            -30, -40, -40, -50, -50, -40, -40, -30,
-            -20, -30, -30, -40, -40, -30, -30, -20,
-            -10, -20, -20, -20, -20, -20, -20, -10,
-            20, 20, 0, 0, 0, 0, 20, 20,
-            20, 50, 10, 0, 0, 40, 50, 20]
-    }
-
-    return piece_square_tables[piece.symbol().upper()][position]
-
-
-def file_of(square):
-    return square % 8
-
-def rank_of(square):
-    return square // 8
-
-
-def evaluate_pawn_structure(board):
-    score = 0
-    for square in chess.SQUARES:
-        piece = board.piece_at(square)
-        if piece is not None and piece.piece_type == chess.PAWN:
-            # Check for isolated pawns
-            isolated = not any(board.piece_at(chess.square(file, rank_of(square))).piece_type == chess.PAWN
-                               for file in [max(0, file_of(square) - 1), min(7, file_of(square) + 1)]
-                               if board.piece_at(chess.square(file, rank_of(square))) is not None)
-            if isolated:
-                score -= 30
-            # Check for doubled pawns
-            doubled = any(board.piece_at(chess.square(file_of(square), rank)).piece_type == chess.PAWN
-                          for rank in range(rank_of(square))
-                          if board.piece_at(chess.square(file_of(square), rank)) is not None)
-            if doubled:
-                score -= 40
-    return score
+    return TABLES[piece.piece_type][position]
+
 
 def evaluate_king_safety(board, color):
     if color==chess.WHITE:
@@ -1,29 +1,63 @@
-import csv
-import uuid
 import chess
 import algorithm1 as algor
-import Algorithm2 as algor2
 import chess.polyglot
 import time
-def main():
+from game_store import GameStore, result_of
+from opening_book import OpeningBook
+from ponder import Ponderer
+from position_index import PositionIndex
+from search_pool import SearchPool
+from time_manager import TimeManager
+
+# Time control for each side: starting clock and increment per move, in seconds
+BASE_TIME = 300.0
+INCREMENT = 5.0
+
+
+def main(base_time=BASE_TIME, increment=INCREMENT, ponder=True):
     learning = 0
+    book = OpeningBook()  # Built by opening_book.py; without the file every move is searched
+    index = PositionIndex()  # Built by `position_index.py build`; without it there are no opening names or stats
     while learning <= 100:
         board = chess.Board()
         initial_board = board.copy()  # Copy the initial board state here
         move_list = []
+        clocks = {chess.WHITE: base_time, chess.BLACK: base_time}
+        result = None  # Only set here when a side loses on time
         check_evaluation_polarities()
+        pool = SearchPool()  # One set of search processes for the whole game
+        ponderer = Ponderer(pool, max_depth=20)
         while not board.is_checkmate() and not board.is_stalemate():
+            move_start = time.time()
             if board.turn:
-                move2 = algor.iterative_deepening_best_move(board, time.time(), max_depth=20)  # Adjust the depth as needed
+                print_opening_stats(index, board)
+                move2 = None if ponderer.is_pondering() else book.probe(board)
+                if move2 is not None:
+                    print(f"Book move: {move2}")
+                elif ponderer.is_pondering():
+                    # Ponder hit: the search started on black's time only needs what is left
+                    time_manager = TimeManager.from_clock(clocks[chess.WHITE], increment, start_time=move_start)
+                    move2, stats = ponderer.hit(time_manager.budget, move_start)
+                    print(f"Ponder hit: {move2}")
+                else:
+                    time_manager = TimeManager.from_clock(clocks[chess.WHITE], increment, start_time=move_start)
+                    move2, stats = algor.iterative_deepening_best_move(board, move_start, max_depth=20, pool=pool,
+                                                                       time_manager=time_manager)  # Adjust the depth as needed
                 if move2 is None:
                     break
+                if not tick_clock(clocks, chess.WHITE, move_start, increment):
+                    result = '0-1'
+                    break
                 move_list.append(board.san(move2))
                 board.push(move2)
                 print(f"White Move: {move2}")
+                print_opening(index, board)
                 print(board)
                 if board.is_repetition(3):
                     print("Draw due to threefold repetition!")
                     break
+                if ponder and not board.is_game_over():
+                    ponderer.start(board)
             else:
                 while True:
                     move1_san = input("Enter your move: ")  # Ask for user input
@@ -35,33 +69,64 @@ def main():
                         break
                     except:
                         print("Invalid input, try again.")
+                if ponderer.is_pondering() and not ponderer.is_hit(move1):
+                    ponderer.miss()
+                if not tick_clock(clocks, chess.BLACK, move_start, increment):
+                    result = '1-0'
+                    break
                 move_list.append(move1_san)
                 board.push(move1)
 
                 print(f"Black move: {move1_san}")
+                print_opening(index, board)
                 print(board)
                 if board.is_repetition(3):
                     print("Draw due to threefold repetition!")
                     break
 
                 print(move_list)
+        if ponderer.is_pondering():
+            ponderer.miss()
+        pool.close()
         if board.is_checkmate():
             if board.turn:
                 print("Black wins by checkmate!")
             else:
                 print("White wins by checkmate!")
 
-        filename = f"/Users/benfunk/PycharmProjects/pythonProject/pastGames/{uuid.uuid4()}.csv"
-        with open(filename, 'w', newline='') as csvfile:
-            writer = csv.writer(csvfile)
-            # Writing each move on a new row
-            for move in move_list:
-                writer.writerow([move])
-
-        print(f"Saved move list to {filename}")
+        with GameStore() as store:
+            game_id = store.append(board.move_stack, result=result or result_of(board), white='algorithm1',
+                                   black='human', base_time=base_time, increment=increment,
+                                   clocks={'white': clocks[chess.WHITE], 'black': clocks[chess.BLACK]})
+        print(f"Saved game {game_id} to {store.directory}")
+        if index.built():
+            print(f"Indexed {index.update()} new games")
         learning = 101
 
 
+def print_opening(index, board):
+    name = index.eco_name(board)
+    if name is not None:
+        print(f"Opening: {name}")
+
+
+def print_opening_stats(index, board):
+    # How the archived games went from here, most played move first
+    stats = sorted(index.opening_stats(board).items(), key=lambda item: -item[1][0])
+    for move, (games, white, draws, black) in stats[:3]:
+        print(f"Archive: {board.san(move)} in {games} games (+{white} ={draws} -{black})")
+
+
+def tick_clock(clocks, color, move_start, increment):
+    clocks[color] -= time.time() - move_start
+    if clocks[color] <= 0:
+        print(f"{'White' if color else 'Black'} loses on time!")
+        return False
+    clocks[color] += increment
+    print(f"Clock: White {clocks[chess.WHITE]:.1f}s, Black {clocks[chess.BLACK]:.1f}s")
+    return True
+
+
 def check_evaluation_polarities():
     # Let's use a start position for our board
     board = chess.Board()
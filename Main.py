@@ -1,5 +1,3 @@
-import tensorflow as tf
-
 def main():
     print("hello world")
 if __name__ == "__main__":
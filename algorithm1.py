@@ -1,123 +1,179 @@
 
 
 
+import os
 import chess
-import numpy as np
-import tensorflow as tf
-import time
-from concurrent.futures import ProcessPoolExecutor
-
-
-def iterative_deepening_best_move(board, start_time, max_depth):
-    best_move = None
-    best_score = float('-inf')  # Initialize best_score to negative infinity
-    finalDepth=0
-    for depth in range(1, max_depth + 1):
-        if time.time() - start_time < 40.0:
-
-            # Calculate the current board score here
-            current_board_score = evaluation(board)/100
-            best_move_at_current_depth = best_move_at_depth(board, start_time, depth, current_board_score)
-
-            if best_move_at_current_depth:  # Check if a valid move was returned
-                # Re-calculate the score for this specific best move
-                temp_board = board.copy()
-                temp_board.push(best_move_at_current_depth)
-                new_score = evaluation(temp_board)/100
-
-                if new_score > best_score:  # Update best_move and best_score if a better move is found
-                    best_move = best_move_at_current_depth
-                    best_score = new_score
-                    finalDepth = depth
-
-    print(f"Depth: {finalDepth}, Best Move: {best_move}, Score: {best_score: .3f}")
-
-    return best_move
-
-
-def best_move_at_depth(board, start_time, depth, current_board_score):
-    moves = list(board.legal_moves)
-    boards = [board.copy() for _ in moves]
-    for move, b in zip(moves, boards):
-        b.push(move)
-
-    alpha = float('-inf')
-    beta = float('inf')
-    maximizingPlayer = True
-
-    with ProcessPoolExecutor() as executor:
-        scores = list(
-            executor.map(
-                perform_minimax,
-                boards,
-                [alpha] * len(boards),
-                [beta] * len(boards),
-                [maximizingPlayer] * len(boards),
-                [depth] * len(boards),
-                [start_time] * len(boards),
-                [current_board_score] * len(boards)
-            )
-        )
-
-    valid_moves_and_scores = [pair for pair in zip(moves, scores) if pair[1] is not None]
-    if not valid_moves_and_scores:
-        return None  # Fallback logic can be added here
-
-    best_score = max(valid_moves_and_scores, key=lambda x: x[1])[1]
-    best_move = [m for m, s in valid_moves_and_scores if s == best_score][0]
-    return best_move
-
-
-def perform_minimax(board, alpha, beta, maximizingPlayer, depth, start_time, current_board_score):
-    return minimax(board, alpha, beta, maximizingPlayer, depth, start_time, current_board_score)
-
-def minimax(board, alpha, beta, maximizingPlayer, depth, start_time, current_board_score):
-    if time.time() - start_time >= 40.0 or depth == 0:
-        score = evaluation(board)
-        return score/100.0 if score >= current_board_score - 1 else None
-
-    if maximizingPlayer:
-        maxEval = float('-inf')
-        for move in board.legal_moves:
-            board.push(move)
-            eval = minimax(board, alpha, beta, False, depth-1, start_time, current_board_score)
-            board.pop()
-            if eval is None:
-                continue
-            maxEval = max(maxEval, eval)
-            alpha = max(alpha, eval)
-            if beta <= alpha:
-                break
-        return maxEval if maxEval != float('-inf') else float('-inf')
+import search_pool
+from concurrent.futures import wait
+from evaluator import (Evaluator, EVAL_WEIGHTS, history_keys, TABLES, MIRRORED_TABLES, material_balance, evaluate_mobility,
+                       evaluate_center_control, evaluate_pawn_structure)
+from search import Search, INFINITY, principal_variation
+from search_board import SearchBoard
+from search_stats import Profiler, SearchStats, counter_delta
+from time_manager import SearchAborted, TimeManager
+from transposition import decode_move, encode_move
+
+# Each search process keeps its own searcher, with its own killers and history, on top of
+# the pool's transposition table
+searcher = None
+searcher_age = None
+
+# Profile of this process's share of the current move, when profiling is on
+profiler = None
+
+# Serial pool for callers that do not bring their own, kept so its table lasts from move to move
+default_pool = None
+
+ACTIVITY_WEIGHT = EVAL_WEIGHTS['activity']
+MOBILITY_WEIGHT = EVAL_WEIGHTS['mobility']
+CENTER_WEIGHT = EVAL_WEIGHTS['center']
+PAWNS_WEIGHT = EVAL_WEIGHTS['pawns']
+KING_SAFETY_WEIGHT = EVAL_WEIGHTS['king_safety']
+
+
+def get_searcher(options=None):
+    global searcher, searcher_age
+    table = search_pool.transposition_table
+    if searcher is None or searcher.transposition_table is not table:
+        searcher = Search(evaluation, table)
+    if searcher_age != table.age:
+        # First search of a new move in this process
+        searcher.new_search()
+        searcher_age = table.age
+    searcher.configure(**(options or {}))
+    return searcher
+
+
+def iterative_deepening_best_move(board, start_time, max_depth, pool=None, options=None, time_manager=None,
+                                  on_iteration=None, profile_dir=None):
+    # Returns the best move and the SearchStats of the search. on_iteration(stats) is called
+    # after every completed iteration; with profile_dir set every process that searches
+    # dumps a cProfile of its part of the move there.
+    global default_pool
+    if pool is None:
+        if default_pool is None:
+            default_pool = search_pool.SearchPool(workers=0)
+        pool = default_pool
+        pool.activate()
+    if time_manager is None:
+        time_manager = TimeManager(start_time=start_time)
+    pool.new_search()
+
+    root_searcher = get_searcher(options)
+    root_searcher.stop_event = pool.stop_event
+    stats = SearchStats()  # Counters of every root move task, summed over all workers
+    # A serial pool searches inside this process's own profile
+    worker_profile_dir = profile_dir if pool.executor is not None else None
+
+    def search_root(board, depth, alpha, beta, hash_move):
+        return best_move_at_depth(board, time_manager.deadline, depth, alpha, beta, pool, hash_move, options,
+                                  stats, time_manager.max_nodes, worker_profile_dir)
+
+    def report(depth, score, move, nodes):
+        stats.record_iteration(depth, score, principal_variation(board, move, pool.transposition_table, depth))
+        if on_iteration is not None:
+            on_iteration(stats)
+
+    if profile_dir is None:
+        best_move, best_score, finalDepth = root_searcher.iterative_deepening(board, max_depth, search_root,
+                                                                              time_manager, report)
     else:
-        minEval = float('inf')
-        for move in board.legal_moves:
-            board.push(move)
-            eval = minimax(board, alpha, beta, True, depth-1, start_time, current_board_score)
-            board.pop()
-            if eval is None:
-                continue
-            minEval = min(minEval, eval)
-            beta = min(beta, eval)
-            if beta <= alpha:
-                break
-        return minEval if minEval != float('inf') else float('inf')
-
-def evaluation(board):
-
-    if board.is_checkmate():
-        return -10000000 if board.turn else 10000000
-
-    material = total_material(board)
+        with Profiler(profile_dir, f'{board.ply()}-main') as profiler:
+            best_move, best_score, finalDepth = root_searcher.iterative_deepening(board, max_depth, search_root,
+                                                                                  time_manager, report)
+        stats.profile = profiler.summary()
+
+    stats.finish(best_move, best_score, finalDepth)
+    print(stats.summary())
+
+    return best_move, stats
+
+
+def best_move_at_depth(board, deadline, depth, alpha, beta, pool, hash_move=None, options=None, stats=None,
+                       max_nodes=None, profile_dir=None):
+    # The previous iteration's best move goes first so it is the one that sets the bound
+    moves = searcher.move_orderer.order(SearchBoard(board), 0, encode_move(hash_move))
+    if not moves:
+        return -INFINITY, None
+
+    # Root tasks only carry the FEN and the encoded move, not a copy of the board and its move stack;
+    # the keys since the last irreversible move are all the repetition checks need of it.
+    # A node limit applies to each search process on its own, and so to the whole search only
+    # when the pool runs serially.
+    fen = board.fen()
+    keys = history_keys(board)
+    tasks = [(fen, move, keys, depth, alpha, beta, deadline, max_nodes, options, profile_dir)
+             for move in moves]
+
+    # Young brothers wait: the eldest move is searched alone with the full window to set the
+    # shared bound, then its siblings are searched in parallel against it
+    pool.reset_best_score(alpha)
+    results = [pool.submit(search_root_move, *tasks[0], True).result()]
+    futures = [pool.submit(search_root_move, *task, False) for task in tasks[1:]]
+    try:
+        results += [future.result() for future in futures]
+    except SearchAborted:
+        # Nothing of this iteration is used, but no task may outlive it. The work the
+        # finished tasks did still counts.
+        for future in futures:
+            future.cancel()
+        wait(futures)
+        if stats is not None:
+            for result in results + [future.result() for future in futures
+                                     if not future.cancelled() and future.exception() is None]:
+                stats.add(result[2])
+        raise
+
+    if stats is not None:
+        for _, _, counters in results:
+            stats.add(counters)
+
+    # Moves that failed low only proved an upper bound, so they cannot be the best move
+    best_score, best_move = max(((score, move) for move, (score, exact, _) in zip(moves, results) if exact),
+                                default=(results[0][0], moves[0]), key=lambda pair: pair[0])
+    return best_score, decode_move(best_move)
+
+
+def search_root_move(fen, move, keys, depth, alpha, beta, deadline, max_nodes, options, profile_dir, first):
+    global profiler
+    position = chess.Board(fen)
+    board = SearchBoard(position)
+    root_searcher = get_searcher(options)
+    root_searcher.deadline = deadline
+    root_searcher.max_nodes = max_nodes
+    root_searcher.stop_event = search_pool.stop_event
+    root_searcher.check_abort()
+    root_searcher.evaluator = Evaluator(board, keys=keys)
+    counters = root_searcher.counters()
+
+    # Siblings search against the best score found so far by any process
+    alpha = max(alpha, search_pool.best_score.value)
+    if profile_dir is None:
+        score = root_searcher.search_move(board, move, depth, alpha, beta, first)
+    else:
+        name = f'{position.ply()}-worker-{os.getpid()}'
+        if profiler is None or profiler.name != name:
+            profiler = Profiler(profile_dir, name)
+        with profiler:
+            score = root_searcher.search_move(board, move, depth, alpha, beta, first)
+    search_pool.raise_best_score(score)
+    return score, score > alpha, counter_delta(root_searcher.counters(), counters)
+
+
+def evaluation(board, evaluator=None):
 
     # Piece activity and mobility
-    piece_map = board.piece_map()
-    activity = sum(piece_position_score(piece, pos, board.turn) for pos, piece in piece_map.items())
-    mobility = sum(len(list(board.legal_moves)) for piece in piece_map.values())
+    if evaluator is None:
+        material = total_material(board)
+        piece_map = board.piece_map()
+        activity = sum(piece_position_score(piece, pos, board.turn) for pos, piece in piece_map.items())
+    else:
+        material = evaluator.material_balance()
+        activity = evaluator.activity(board.turn)
+    mobility = evaluate_mobility(board)
 
     # Control of the center
-    center_squares = chess.SquareSet([chess.D4, chess.D5, chess.E4, chess.E5])
-    center_control = sum(1 for square in board.piece_map() if square in center_squares)
+    center_control = evaluate_center_control(board)
 
     # Pawn structure
     pawn_structure = evaluate_pawn_structure(board)
@@ -131,34 +187,21 @@ def evaluation(board):
         mobility = -mobility
         pawn_structure = -pawn_structure
         center_control = -center_control
+        king_safety = -king_safety
 
     score = (
             material
-            + 0.1 * activity
-            + 0.1 * mobility
-            + 0.4 * center_control
-            + 0.2 * pawn_structure
-            + 0.6 * king_safety
+            + ACTIVITY_WEIGHT * activity
+            + MOBILITY_WEIGHT * mobility
+            + CENTER_WEIGHT * center_control
+            + PAWNS_WEIGHT * pawn_structure
+            + KING_SAFETY_WEIGHT * king_safety
     )
 
     return score
 
 def total_material(board):
-    piece_values = {chess.PAWN: 100, chess.KNIGHT: 280, chess.BISHOP: 320, chess.ROOK: 500, chess.QUEEN: 900}
-
-    white_score = 0
-    black_score = 0
-
-    for square in chess.SQUARES:
-        piece = board.piece_at(square)
-        if piece:
-            piece_value = piece_values.get(piece.piece_type, 0)
-            if piece.color == chess.WHITE:
-                white_score += piece_value
-            else:
-                black_score += piece_value
-
-    return white_score - black_score
+    return material_balance(board)
 
 def is_endgame(board):
     total_materials = total_material(board)
@@ -169,97 +212,12 @@ def is_endgame(board):
     return total_materials <= endgame_threshold
 
 def piece_position_score(piece, position, is_white_turn):
-    # Piece-square tables
-    piece_square_tables = {
-        'P': [  # Pawn
-            100, 100, 100, 100, 100, 100, 100, 100,
-            5, 10, 10, -20, -20, 10, 10, 5,
-            5, -5, -10, 0, 0, -10, -5, 5,
-            1, 1, 1, 40, 40, 1, 1, 1,
-            5, 5, 10, 55, 55, 10, 5, 5,
-            10, 10, 20, 30, 30, 20, 10, 10,
-            50, 50, 50, 30, 30, 50, 50, 50,
-            0, 0, 0, 0, 0, 0, 0, 0],
-        'N': [  # Knight
-            -50, -40, -30, -30, -30, -30, -40, -50,
-            -40, -20, 0, 0, 0, 0, -20, -40,
-            -30, 0, 10, 15, 15, 10, 0, -30,
-            -30, 5, 15, 20, 20, 15, 5, -30,
-            -30, 0, 15, 20, 20, 15, 0, -30,
-            -30, 5, 30, 15, 15, 30, 5, -30,
-            -40, -20, 0, 5, 5, 0, -20, -40,
-            -50, -40, -30, -30, -30, -30, -40, -50],
-        'B': [  # Bishop
-            -20, -10, -10, -10, -10, -10, -10, -20,
-            -10, 0, 0, 0, 0, 0, 0, -10,
-            -10, 0, 5, 10, 10, 5, 0, -10,
-            -10, 5, 5, 10, 10, 5, 5, -10,
-            -10, 0, 10, 10, 10, 10, 0, -10,
-            -10, 10, 10, 10, 10, 10, 10, -10,
-            -10, 5, 0, 0, 0, 0, 5, -10,
-            -20, -10, -10, -10, -10, -10, -10, -20],
-        'R': [  # Rook
-            0, 0, 0, 0, 0, 0, 0, 0,
-            5, 10, 10, 10, 10, 10, 10, 5,
-            -5, 1, 1, 1, 1, 1, 1, -5,
-            -5, 1, 1, 1, 1, 1, 1, -5,
-            -5, 1, 1, 1, 1, 1, 1, -5,
-            -5, 1, 1, 1, 1, 1, 1, -5,
-            -5, 1, 1, 1, 1, 1, 1, -5,
-            1, 1, 10, 10, 10, 10, 1, 1],
-        'Q': [  # Queen
-            -20, -10, -10, -5, -5, -10, -10, -20,
-            -10, 0, 0, 0, 0, 0, 0, -10,
-            -10, 0, 5, 5, 5, 5, 0, -10,
-            -5, 0, 5, 5, 5, 5, 0, -5,
-            0, 0, 5, 5, 5, 5, 0, -5,
-            -10, 5, 5, 5, 5, 5, 0, -10,
-            -10, 0, 5, 0, 0, 0, 0, -10,
-            -20, -10, -10, -5, -5, -10, -10, -20],
-        'K': [  # King
-            -30, -40, -40, -50, -50, -40, -40, -30,
-            -30, -40, -40, -50, -50, -40, -40, -30,
-            -30, -40, -40, -50, -50, -40, -40, -30,
-            -30, -40, -40, -50, -50, -40, -40, -30,
-            -20, -30, -30, -40, -40, -30, -30, -20,
-            -10, -20, -20, -20, -20, -20, -20, -10,
-            20, 20, 0, 0, 0, 0, 20, 20,
-            20, 50, 10, 0, 0, 40, 50, 20]
-    }
-
     if is_white_turn:
-        return piece_square_tables[piece.symbol().upper()][position]
+        return TABLES[piece.piece_type][position]
     else:
         # Flip the board for black
-        flipped_position = 63 - position
-        return -piece_square_tables[piece.symbol().upper()][flipped_position]
-
-
-def file_of(square):
-    return square % 8
-
-def rank_of(square):
-    return square // 8
-
-
-def evaluate_pawn_structure(board):
-    score = 0
-    for square in chess.SQUARES:
-        piece = board.piece_at(square)
-        if piece is not None and piece.piece_type == chess.PAWN:
-            # Check for isolated pawns
-            isolated = not any(board.piece_at(chess.square(file, rank_of(square))).piece_type == chess.PAWN
-                               for file in [max(0, file_of(square) - 1), min(7, file_of(square) + 1)]
-                               if board.piece_at(chess.square(file, rank_of(square))) is not None)
-            if isolated:
-                score -= 30
-            # Check for doubled pawns
-            doubled = any(board.piece_at(chess.square(file_of(square), rank)).piece_type == chess.PAWN
-                          for rank in range(rank_of(square))
-                          if board.piece_at(chess.square(file_of(square), rank)) is not None)
-            if doubled:
-                score -= 40
-    return score
+        return -MIRRORED_TABLES[piece.piece_type][position]
+
 
 def evaluate_king_safety(board, color):
     if color==chess.WHITE:
@@ -0,0 +1,372 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import chess
+import algorithm1 as algor
+import Algorithm2 as algor2
+from game_store import STORE_DIR, GameStore
+from search_pool import SearchPool
+from time_manager import TimeManager
+
+ENGINES = ('algorithm1', 'Algorithm2')
+HOST = '127.0.0.1'
+PORT = 8765
+MAX_DEPTH = 64
+
+# A job with no depth, time or node limit gets this many seconds per position
+DEFAULT_MOVE_TIME = 1.0
+
+# Positions waiting over all jobs; a batch that would go past it is turned away with 503
+MAX_QUEUED = 100000
+
+# A job stops being scheduled while this many of its results per worker wait for its client
+MAX_UNSENT_PER_WORKER = 2
+
+MAX_BODY_BYTES = 64 * 1024 * 1024
+
+# Ids of recently cancelled jobs, shared with the analysis processes, which stop searching a
+# position of one of them within CANCEL_POLL_INTERVAL seconds
+CANCELLED_SLOTS = 64
+CANCEL_POLL_INTERVAL = 0.05
+
+# Each analysis process searches one position at a time on tables of its own, kept across positions
+worker_pool = None
+worker_search = None
+cancelled_jobs = None
+
+
+def init_worker(cancelled):
+    global cancelled_jobs
+    cancelled_jobs = cancelled
+
+
+def watch_cancel(job_id, stop, done):
+    # Stops are repeated until the search ends, as a new search clears the pool's stop flag
+    while not done.wait(CANCEL_POLL_INTERVAL):
+        if job_id in cancelled_jobs[:]:
+            stop()
+
+
+def analyse_position(fen, engine, depth, move_time, nodes, job_id=None):
+    global worker_pool, worker_search
+    board = chess.Board(fen)
+    time_manager = TimeManager(budget=move_time, max_nodes=nodes)
+    if engine == 'algorithm1':
+        if worker_pool is None:
+            worker_pool = SearchPool(workers=0)
+        stop = worker_pool.stop
+    else:
+        if worker_search is None:
+            worker_search = algor2.new_searcher()
+            worker_search.stop_event = threading.Event()
+        worker_search.stop_event.clear()
+        stop = worker_search.stop_event.set
+    done = threading.Event()
+    watcher = threading.Thread(target=watch_cancel, args=(job_id, stop, done), daemon=True)
+    if cancelled_jobs is not None:
+        watcher.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            if engine == 'algorithm1':
+                worker_pool.activate()
+                move, stats = algor.iterative_deepening_best_move(board, time_manager.start_time, depth,
+                                                                  pool=worker_pool, time_manager=time_manager)
+            else:
+                move, stats = algor2.best_move(board, depth, time_manager=time_manager, search=worker_search)
+    finally:
+        done.set()
+        if watcher.is_alive():
+            watcher.join()
+    return {
+        'best_move': move.uci() if move else None,
+        'score': stats.score,
+        'depth': stats.depth,
+        'pv': stats.iterations[-1]['pv'] if stats.iterations else [],
+        'nodes': stats.nodes,
+        'time': stats.elapsed,
+    }
+
+
+def game_positions(game_ids, directory=STORE_DIR):
+    # Every position of the archived games in which a move was chosen
+    positions = []
+    with GameStore(directory) as store:
+        for game_id in game_ids:
+            board = chess.Board()
+            for ply, move in enumerate(store.get(game_id).moves):
+                positions.append({'fen': board.fen(), 'game_id': game_id, 'ply': ply})
+                board.push(move)
+    return positions
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Job():
+    def __init__(self, job_id, positions, limits):
+        self.id = job_id
+        self.positions = positions
+        self.limits = limits
+        self.pending = deque(range(len(positions)))
+        self.running = 0
+        self.results = asyncio.Queue()
+        self.cancelled = False
+
+    def done(self):
+        return not self.pending and not self.running
+
+
+class Scheduler():
+    # Hands positions to a fixed set of analysis processes, one position per process at a time
+    # so nothing queues inside the executor. Jobs take turns, one position each, so a small
+    # batch is never stuck behind a large one. A cancelled job loses its waiting positions;
+    # the ones already being searched are told to stop and their results are dropped.
+    def __init__(self, workers=None, max_queued=MAX_QUEUED, store_dir=STORE_DIR):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queued = max_queued
+        self.store_dir = store_dir
+        self.cancelled = multiprocessing.Array('q', CANCELLED_SLOTS, lock=False)
+        self.cancelled_count = 0
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker,
+                                            initargs=(self.cancelled,))
+        self.free = self.workers
+        self.queued = 0
+        self.jobs = {}
+        self.turns = deque()
+        self.job_ids = itertools.count(1)
+        self.wakeup = asyncio.Event()
+
+    def submit(self, positions, limits):
+        if self.queued + len(positions) > self.max_queued:
+            raise QueueFull(f"{self.queued} positions already queued")
+        job = Job(next(self.job_ids), positions, limits)
+        self.jobs[job.id] = job
+        self.turns.append(job)
+        self.queued += len(positions)
+        self.wakeup.set()
+        return job
+
+    def cancel(self, job):
+        if job.cancelled:
+            return
+        job.cancelled = True
+        if job.running:
+            self.cancelled[self.cancelled_count % CANCELLED_SLOTS] = job.id
+            self.cancelled_count += 1
+        self.queued -= len(job.pending)
+        job.pending.clear()
+        self.jobs.pop(job.id, None)
+        job.results.put_nowait(None)
+
+    def ready(self, job):
+        return job.results.qsize() < MAX_UNSENT_PER_WORKER * self.workers
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self.wakeup.clear()
+            # Jobs whose clients are not keeping up sit out, but keep their turn
+            skipped = 0
+            while self.free and self.turns and skipped < len(self.turns):
+                job = self.turns.popleft()
+                if not job.pending:
+                    continue
+                self.turns.append(job)
+                if not self.ready(job):
+                    skipped += 1
+                    continue
+                skipped = 0
+                index = job.pending.popleft()
+                self.queued -= 1
+                self.free -= 1
+                job.running += 1
+                limits = job.limits
+                future = loop.run_in_executor(self.executor, analyse_position, job.positions[index]['fen'],
+                                              limits['engine'], limits['depth'], limits['movetime'], limits['nodes'],
+                                              job.id)
+                future.add_done_callback(lambda future, job=job, index=index: self.finished(job, index, future))
+            await self.wakeup.wait()
+
+    def finished(self, job, index, future):
+        self.free += 1
+        job.running -= 1
+        if not job.cancelled:
+            if future.cancelled():
+                result = {'error': 'cancelled'}
+            elif future.exception() is not None:
+                result = {'error': str(future.exception())}
+            else:
+                result = future.result()
+            job.results.put_nowait(dict(job.positions[index], index=index, **result))
+            if job.done():
+                self.jobs.pop(job.id, None)
+                job.results.put_nowait(None)
+        self.wakeup.set()
+
+    def status(self):
+        return {'workers': self.workers, 'busy': self.workers - self.free, 'queued': self.queued,
+                'jobs': {job_id: {'pending': len(job.pending), 'running': job.running}
+                         for job_id, job in self.jobs.items()}}
+
+    def close(self):
+        for job in list(self.jobs.values()):
+            self.cancel(job)
+        self.executor.shutdown(cancel_futures=True)
+
+
+def parse_limits(request):
+    engine = request.get('engine', 'algorithm1')
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine {engine!r}, expected one of {', '.join(ENGINES)}")
+    depth = request.get('depth')
+    move_time = request.get('movetime')
+    nodes = request.get('nodes')
+    if depth is None and move_time is None and nodes is None:
+        move_time = DEFAULT_MOVE_TIME
+    return {'engine': engine, 'depth': int(depth or MAX_DEPTH),
+            'movetime': float(move_time) if move_time is not None else None,
+            'nodes': int(nodes) if nodes is not None else None}
+
+
+class AnalysisServer():
+    # POST /analyze takes {"fens": [...]} and/or {"games": [ids]} with optional engine, depth,
+    # movetime (seconds) and nodes, and streams one JSON line per position as it finishes.
+    # DELETE /jobs/<id> cancels a job, as does closing the connection; GET /status reports load.
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+
+    async def handle(self, reader, writer):
+        try:
+            method, path, body = await self.read_request(reader)
+            if method == 'POST' and path == '/analyze':
+                await self.analyze(body, reader, writer)
+            elif method == 'DELETE' and path.startswith('/jobs/'):
+                job = self.scheduler.jobs.get(int(path.rsplit('/', 1)[1]))
+                if job is None:
+                    await self.respond(writer, 404, {'error': 'no such job'})
+                else:
+                    self.scheduler.cancel(job)
+                    await self.respond(writer, 200, {'cancelled': job.id})
+            elif method == 'GET' and path == '/status':
+                await self.respond(writer, 200, self.scheduler.status())
+            else:
+                await self.respond(writer, 404, {'error': f'no route for {method} {path}'})
+        except (ValueError, KeyError, IndexError) as error:
+            await self.respond(writer, 400, {'error': str(error)})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def read_request(self, reader):
+        method, path, _ = (await reader.readline()).decode('latin-1').split(' ', 2)
+        length = 0
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            if name.lower() == 'content-length':
+                length = int(value)
+        if length > MAX_BODY_BYTES:
+            raise ValueError("Request body too large")
+        body = await reader.readexactly(length) if length else b''
+        return method, path, body
+
+    async def respond(self, writer, status, payload):
+        body = json.dumps(payload).encode()
+        writer.write(f'HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: application/json\r\n'
+                     f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body)
+        await writer.drain()
+
+    async def analyze(self, body, reader, writer):
+        request = json.loads(body or b'{}')
+        limits = parse_limits(request)
+        positions = [{'fen': chess.Board(fen).fen()} for fen in request.get('fens', [])]
+        if request.get('games'):
+            positions += await asyncio.to_thread(game_positions, request['games'], self.scheduler.store_dir)
+        try:
+            job = self.scheduler.submit(positions, limits)
+        except QueueFull as error:
+            await self.respond(writer, 503, {'error': str(error)})
+            return
+
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n'
+                     b'Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n')
+        # The client sends nothing more, so the end of its stream means it has gone, and the
+        # job is cancelled then rather than on the next write
+        disconnect = asyncio.create_task(reader.read())
+        disconnect.add_done_callback(lambda _: self.scheduler.cancel(job))
+        try:
+            await self.send_chunk(writer, {'job': job.id, 'positions': len(positions)})
+            while not job.done() or not job.results.empty():
+                result = await job.results.get()
+                if result is None:
+                    break
+                await self.send_chunk(writer, result)
+                # Room for more results may let the job be scheduled again
+                self.scheduler.wakeup.set()
+            await self.send_chunk(writer, {'job': job.id, 'done': not job.cancelled})
+            writer.write(b'0\r\n\r\n')
+            await writer.drain()
+        finally:
+            disconnect.cancel()
+            self.scheduler.cancel(job)
+
+    async def send_chunk(self, writer, payload):
+        line = json.dumps(payload).encode() + b'\n'
+        writer.write(f'{len(line):x}\r\n'.encode() + line + b'\r\n')
+        # Waits while the client's socket buffer is full, which in turn holds the job back
+        await writer.drain()
+
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 503: 'Service Unavailable'}
+
+
+async def serve(host=HOST, port=PORT, socket_path=None, workers=None, max_queued=MAX_QUEUED, store_dir=STORE_DIR):
+    scheduler = Scheduler(workers, max_queued, store_dir)
+    server = AnalysisServer(scheduler)
+    if socket_path:
+        listener = await asyncio.start_unix_server(server.handle, path=socket_path)
+    else:
+        listener = await asyncio.start_server(server.handle, host, port)
+    print(f"Analysing with {scheduler.workers} processes on {socket_path or f'http://{host}:{port}'}",
+          file=sys.stderr)
+    scheduling = asyncio.create_task(scheduler.run())
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        scheduling.cancel()
+        scheduler.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local service that analyses batches of positions")
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--socket', default=None, help="listen on a Unix socket instead of TCP")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--max-queued', type=int, default=MAX_QUEUED)
+    parser.add_argument('--store-dir', default=STORE_DIR)
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, args.socket, args.workers, args.max_queued, args.store_dir))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
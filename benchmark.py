@@ -0,0 +1,310 @@
+import argparse
+import contextlib
+import glob
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import chess
+import algorithm1 as algor
+import Algorithm2 as algor2
+from move_ordering import MoveOrderer
+from game_store import LEGACY_GAMES_DIR, iter_csv_games
+from opening_book import iter_pgn_games
+from paths import ROOT
+from search_board import SearchBoard
+from search_pool import SearchPool
+from time_manager import TimeManager
+
+PGN_DIR = os.path.join(ROOT, 'pgn-extract', 'test', 'infiles')
+
+# Fixed positions, with their known perft counts from depth 1 up
+PERFT_POSITIONS = {
+    chess.STARTING_FEN: [20, 400, 8902, 197281, 4865609],
+    'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1': [48, 2039, 97862, 4085603],
+    '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1': [14, 191, 2812, 43238, 674624],
+    'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1': [6, 264, 9467, 422333],
+    'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8': [44, 1486, 62379, 2103487],
+}
+
+# Positions taken from every replayed game, and how many games each source contributes
+SAMPLE_PLIES = (10, 20, 30)
+MAX_GAMES_PER_SOURCE = 4
+
+DEFAULT_DEPTH = 3
+DEFAULT_NODES = 5000
+DEFAULT_PERFT_DEPTH = 3
+DEFAULT_THRESHOLD = 0.1
+
+ENGINES = ('algorithm1', 'Algorithm2')
+
+# Run in a fresh interpreter so imports, process start-up and the first move are timed the way
+# a user meets them. Timestamps are wall-clock so they compare with the launch time.
+STARTUP_SCRIPT = '''
+import json, sys, time
+start = time.time()
+import chess
+import algorithm1
+from search_pool import SearchPool
+from time_manager import TimeManager
+imported = time.time()
+pool = SearchPool(workers=None if sys.argv[2] == 'None' else int(sys.argv[2]))
+ready = time.time()
+algorithm1.iterative_deepening_best_move(chess.Board(), ready, int(sys.argv[1]), pool=pool,
+                                         time_manager=TimeManager(budget=None))
+moved = time.time()
+pool.close()
+print(json.dumps({'start': start, 'imported': imported, 'ready': ready, 'moved': moved}))
+'''
+DEFAULT_STARTUP_DEPTH = 3
+
+
+def replayed_positions(games, plies=SAMPLE_PLIES, max_games=MAX_GAMES_PER_SOURCE):
+    positions = []
+    for count, moves in enumerate(games):
+        if count >= max_games:
+            break
+        board = chess.Board()
+        for ply, move in enumerate(moves, 1):
+            board.push(move)
+            if ply in plies and not board.is_game_over():
+                positions.append(board.fen())
+    return positions
+
+
+def load_positions(pgn_dir=PGN_DIR, games_dir=LEGACY_GAMES_DIR):
+    # Sources are read in sorted order so every run benchmarks the same positions
+    positions = list(PERFT_POSITIONS)
+    for path in sorted(glob.glob(os.path.join(pgn_dir, '*.pgn'))):
+        positions += replayed_positions(iter_pgn_games(path))
+    if os.path.isdir(games_dir):
+        positions += replayed_positions(iter_csv_games(games_dir), max_games=len(os.listdir(games_dir)))
+    return list(dict.fromkeys(positions))
+
+
+def perft(board, depth):
+    if depth == 0:
+        return 1
+    if depth == 1:
+        return board.legal_moves.count()
+    nodes = 0
+    for move in board.legal_moves:
+        board.push(move)
+        nodes += perft(board, depth - 1)
+        board.pop()
+    return nodes
+
+
+def peak_rss_kb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def isolated(function, *args, **kwargs):
+    # Runs one benchmark in a fresh interpreter, so the peak RSS it reports is its own rather
+    # than the highest of every run before it in the same process
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(function, *args, **kwargs).result()
+
+
+def run_perft(fen, depth, search_board=False):
+    # python-chess push/pop, or the search's own SearchBoard make/unmake
+    start = time.perf_counter()
+    if search_board:
+        nodes = SearchBoard(chess.Board(fen)).perft(depth)
+    else:
+        nodes = perft(chess.Board(fen), depth)
+    elapsed = time.perf_counter() - start
+    expected = PERFT_POSITIONS.get(fen, [])
+    run = {
+        'kind': 'perft',
+        'position': fen,
+        'limit': {'depth': depth},
+        'nodes': nodes,
+        'expected': expected[depth - 1] if depth <= len(expected) else None,
+        'time': elapsed,
+        'nps': nodes / elapsed if elapsed else 0.0,
+        'peak_rss_kb': peak_rss_kb(),
+    }
+    if search_board:
+        run['board'] = 'search_board'
+    return run
+
+
+def effective_branching_factor(iterations):
+    # Geometric mean growth in nodes from one completed iteration to the next
+    if len(iterations) < 2 or not iterations[0]['nodes']:
+        return None
+    first, last = iterations[0], iterations[-1]
+    return (last['nodes'] / first['nodes']) ** (1 / (last['depth'] - first['depth']))
+
+
+def run_search(engine, fen, depth=None, nodes=None):
+    # Every run starts from empty tables, killers and history so runs do not depend on order
+    board = chess.Board(fen)
+    max_depth = depth or 64
+    time_manager = TimeManager(budget=None, max_nodes=nodes)
+    with contextlib.redirect_stdout(io.StringIO()):
+        if engine == 'algorithm1':
+            with SearchPool(workers=0) as pool:
+                move, stats = algor.iterative_deepening_best_move(board, time.time(), max_depth, pool=pool,
+                                                                  time_manager=time_manager)
+        else:
+            algor2.transposition_table.clear()
+            algor2.searcher.move_orderer = MoveOrderer()
+            move, stats = algor2.best_move(board, max_depth, time_manager=time_manager)
+
+    return {
+        'kind': 'search',
+        'engine': engine,
+        'position': fen,
+        'limit': {'depth': depth} if depth else {'nodes': nodes},
+        'move': move.uci() if move else None,
+        'depth': stats.depth,
+        'nodes': stats.nodes,
+        'time': stats.elapsed,
+        'nps': stats.nps(),
+        'time_to_depth': {str(iteration['depth']): iteration['time'] for iteration in stats.iterations},
+        'ebf': effective_branching_factor(stats.iterations),
+        'stats': stats.as_dict(),
+        'peak_rss_kb': peak_rss_kb(),
+    }
+
+
+def measure_startup(depth=DEFAULT_STARTUP_DEPTH, workers=None):
+    launch = time.time()
+    output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT, str(depth), str(workers)], cwd=ROOT,
+                            capture_output=True, text=True, check=True).stdout
+    times = json.loads(output.strip().splitlines()[-1])
+    return {
+        'depth': depth,
+        'interpreter': times['start'] - launch,
+        'imports': times['imported'] - times['start'],
+        'pool_start': times['ready'] - times['imported'],
+        'first_move': times['moved'] - times['ready'],
+        'launch_to_first_move': times['moved'] - launch,
+    }
+
+
+def run_benchmark(positions, engines=ENGINES, depth=DEFAULT_DEPTH, nodes=DEFAULT_NODES,
+                  perft_depth=DEFAULT_PERFT_DEPTH, startup_depth=DEFAULT_STARTUP_DEPTH):
+    startup = measure_startup(startup_depth) if startup_depth else None
+    runs = []
+    for fen in PERFT_POSITIONS:
+        runs.append(isolated(run_perft, fen, perft_depth))
+        runs.append(isolated(run_perft, fen, perft_depth, search_board=True))
+    for engine in engines:
+        for fen in positions:
+            if depth:
+                runs.append(isolated(run_search, engine, fen, depth=depth))
+            if nodes:
+                runs.append(isolated(run_search, engine, fen, nodes=nodes))
+    searches = [run for run in runs if run['kind'] == 'search']
+    total_nodes = sum(run['nodes'] for run in searches)
+    total_time = sum(run['time'] for run in searches)
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'positions': len(positions),
+        'total_nodes': total_nodes,
+        'total_time': total_time,
+        'nps': total_nodes / total_time if total_time else 0.0,
+        'peak_rss_kb': max(run['peak_rss_kb'] for run in runs),
+        'startup': startup,
+        'runs': runs,
+    }
+
+
+def run_key(run):
+    return (run['kind'], run.get('engine') or run.get('board'), run['position'],
+            json.dumps(run['limit'], sort_keys=True))
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+    # Lower speed, more nodes for the same limit, slower time to depth or more memory than the
+    # baseline by more than the threshold are regressions, and so is any wrong perft count
+    previous = {run_key(run): run for run in baseline['runs']}
+    regressions = []
+    if baseline.get('startup') and current.get('startup'):
+        for metric in ('imports', 'pool_start', 'launch_to_first_move'):
+            before, after = baseline['startup'][metric], current['startup'][metric]
+            if before and (after - before) / before > threshold:
+                regressions.append({'run': ('startup',), 'metric': metric, 'baseline': before, 'current': after,
+                                    'change': (after - before) / before})
+    for run in current['runs']:
+        if run['kind'] == 'perft' and run['expected'] is not None and run['nodes'] != run['expected']:
+            regressions.append({'run': run_key(run), 'metric': 'perft', 'baseline': run['expected'],
+                                'current': run['nodes']})
+        old = previous.get(run_key(run))
+        if old is None:
+            continue
+        checks = [('nps', old['nps'], run['nps'], False), ('peak_rss_kb', old['peak_rss_kb'], run['peak_rss_kb'], True)]
+        if run['kind'] == 'search':
+            checks.append(('nodes', old['nodes'], run['nodes'], True))
+            depth = str(min(old['depth'], run['depth']))
+            if depth in old['time_to_depth'] and depth in run['time_to_depth']:
+                checks.append((f'time_to_depth_{depth}', old['time_to_depth'][depth], run['time_to_depth'][depth], True))
+        for metric, before, after, higher_is_worse in checks:
+            if not before:
+                continue
+            change = (after - before) / before
+            if change > threshold if higher_is_worse else change < -threshold:
+                regressions.append({'run': run_key(run), 'metric': metric, 'baseline': before, 'current': after,
+                                    'change': change})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search benchmark: perft, nodes, NPS and time-to-depth")
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run')
+    run.add_argument('--depth', type=int, default=DEFAULT_DEPTH)
+    run.add_argument('--nodes', type=int, default=DEFAULT_NODES)
+    run.add_argument('--perft-depth', type=int, default=DEFAULT_PERFT_DEPTH)
+    run.add_argument('--engine', choices=ENGINES, action='append')
+    run.add_argument('--startup-depth', type=int, default=DEFAULT_STARTUP_DEPTH,
+                     help="depth of the timed first move from a fresh interpreter; 0 skips it")
+    run.add_argument('--output', default='-')
+    startup = commands.add_parser('startup')
+    startup.add_argument('--depth', type=int, default=DEFAULT_STARTUP_DEPTH)
+    startup.add_argument('--workers', type=int, default=None)
+    diff = commands.add_parser('compare')
+    diff.add_argument('baseline')
+    diff.add_argument('current')
+    diff.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        result = run_benchmark(load_positions(), args.engine or ENGINES, args.depth, args.nodes, args.perft_depth,
+                               args.startup_depth)
+        if args.output == '-':
+            json.dump(result, sys.stdout, indent=2)
+        else:
+            with open(args.output, 'w') as handle:
+                json.dump(result, handle, indent=2)
+        return 0
+
+    if args.command == 'startup':
+        json.dump(measure_startup(args.depth, args.workers), sys.stdout, indent=2)
+        return 0
+
+    with open(args.baseline) as handle:
+        baseline = json.load(handle)
+    with open(args.current) as handle:
+        current = json.load(handle)
+    regressions = compare(baseline, current, args.threshold)
+    json.dump({'regressions': regressions}, sys.stdout, indent=2)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,225 @@
+import os
+from collections import deque
+
+import chess
+from paths import ROOT
+
+BITBASE_DIR = os.path.join(ROOT, 'bitbases')
+
+# Scores for won positions sit far above any evaluation but below mate scores, so a real
+# mate found by the search still wins over a bitbase win
+KNOWN_WIN_SCORE = 1000000
+
+# Every table is stored from the side with the extra piece, normalized to white. The index is
+# ((side_to_move * 64 + strong_king) * 64 + weak_king) * 64 + piece, side_to_move 0 for the
+# strong side, and one bit per index is set when the strong side wins.
+STRONG, WEAK = 0, 1
+SIZE = 2 * 64 * 64 * 64
+
+TABLE_PIECES = {'kqk': chess.QUEEN, 'krk': chess.ROOK, 'kpk': chess.PAWN}
+TABLE_NAMES = {piece_type: name for name, piece_type in TABLE_PIECES.items()}
+
+_tables = {}
+
+
+def index(side_to_move, strong_king, weak_king, piece):
+    return ((side_to_move * 64 + strong_king) * 64 + weak_king) * 64 + piece
+
+
+def piece_attacks(piece_type, square, occupied):
+    if piece_type == chess.PAWN:
+        return chess.BB_PAWN_ATTACKS[chess.WHITE][square]
+    attacks = (chess.BB_RANK_ATTACKS[square][chess.BB_RANK_MASKS[square] & occupied]
+               | chess.BB_FILE_ATTACKS[square][chess.BB_FILE_MASKS[square] & occupied])
+    if piece_type == chess.QUEEN:
+        attacks |= chess.BB_DIAG_ATTACKS[square][chess.BB_DIAG_MASKS[square] & occupied]
+    return attacks
+
+
+def is_valid(piece_type, side_to_move, strong_king, weak_king, piece):
+    if strong_king == weak_king or piece == strong_king or piece == weak_king:
+        return False
+    if chess.BB_KING_ATTACKS[strong_king] & chess.BB_SQUARES[weak_king]:
+        return False
+    if piece_type == chess.PAWN and chess.BB_SQUARES[piece] & (chess.BB_RANK_1 | chess.BB_RANK_8):
+        return False
+    if side_to_move == STRONG:
+        # The weak king cannot be in check with the strong side to move
+        occupied = chess.BB_SQUARES[strong_king] | chess.BB_SQUARES[weak_king]
+        if piece_attacks(piece_type, piece, occupied) & chess.BB_SQUARES[weak_king]:
+            return False
+    return True
+
+
+def weak_moves(piece_type, strong_king, weak_king, piece):
+    # Legal weak king moves as (target, captures_piece), and whether the weak king is in check
+    occupied = chess.BB_SQUARES[strong_king]
+    attacked = chess.BB_KING_ATTACKS[strong_king] | piece_attacks(piece_type, piece, occupied)
+    moves = []
+    for target in chess.SquareSet(chess.BB_KING_ATTACKS[weak_king] & ~attacked):
+        moves.append((target, target == piece))
+    return moves, bool(attacked & chess.BB_SQUARES[weak_king])
+
+
+def strong_predecessors(piece_type, strong_king, weak_king, piece):
+    # Strong-to-move positions that reach (WEAK, strong_king, weak_king, piece) in one move
+    occupied = chess.BB_SQUARES[strong_king] | chess.BB_SQUARES[weak_king] | chess.BB_SQUARES[piece]
+    for origin in chess.SquareSet(chess.BB_KING_ATTACKS[strong_king] & ~occupied):
+        yield origin, piece
+    if piece_type == chess.PAWN:
+        rank = chess.square_rank(piece)
+        if rank >= 2 and not occupied & chess.BB_SQUARES[piece - 8]:
+            yield strong_king, piece - 8
+            if rank == 3 and not occupied & chess.BB_SQUARES[piece - 16]:
+                yield strong_king, piece - 16
+    else:
+        for origin in chess.SquareSet(piece_attacks(piece_type, piece, occupied) & ~occupied):
+            yield strong_king, origin
+
+
+def generate(piece_type, promotion_tables=()):
+    # Retrograde analysis. Weak-to-move positions count their moves that do not escape into a
+    # draw; each time a successor turns out to be won the count drops, and at zero the
+    # position is won. Strong-to-move positions are won as soon as one successor is.
+    win = bytearray(SIZE)
+    remaining = [0] * (64 * 64 * 64)
+    queue = deque()
+
+    for strong_king in chess.SQUARES:
+        for weak_king in chess.SQUARES:
+            for piece in chess.SQUARES:
+                if not is_valid(piece_type, WEAK, strong_king, weak_king, piece):
+                    continue
+                moves, in_check = weak_moves(piece_type, strong_king, weak_king, piece)
+                position = index(WEAK, strong_king, weak_king, piece)
+                if not moves:
+                    if in_check:
+                        win[position] = 1
+                        queue.append(position)
+                elif not any(captures for _, captures in moves):
+                    remaining[position - SIZE // 2] = len(moves)
+
+    if piece_type == chess.PAWN:
+        # Promotions are decided by the queen and rook tables
+        for strong_king in chess.SQUARES:
+            for weak_king in chess.SQUARES:
+                for piece in chess.SquareSet(chess.BB_RANK_7):
+                    target = piece + 8
+                    if target in (strong_king, weak_king):
+                        continue
+                    if not is_valid(piece_type, STRONG, strong_king, weak_king, piece):
+                        continue
+                    if any(probe_index(table, WEAK, strong_king, weak_king, target) for table in promotion_tables):
+                        position = index(STRONG, strong_king, weak_king, piece)
+                        win[position] = 1
+                        queue.append(position)
+
+    while queue:
+        position = queue.popleft()
+        side_to_move, rest = divmod(position, 64 * 64 * 64)
+        strong_king, rest = divmod(rest, 64 * 64)
+        weak_king, piece = divmod(rest, 64)
+
+        if side_to_move == WEAK:
+            for origin_king, origin_piece in strong_predecessors(piece_type, strong_king, weak_king, piece):
+                if not is_valid(piece_type, STRONG, origin_king, weak_king, origin_piece):
+                    continue
+                predecessor = index(STRONG, origin_king, weak_king, origin_piece)
+                if not win[predecessor]:
+                    win[predecessor] = 1
+                    queue.append(predecessor)
+        else:
+            occupied = chess.BB_SQUARES[strong_king] | chess.BB_SQUARES[piece]
+            for origin in chess.SquareSet(chess.BB_KING_ATTACKS[weak_king] & ~occupied):
+                if not is_valid(piece_type, WEAK, strong_king, origin, piece):
+                    continue
+                predecessor = index(WEAK, strong_king, origin, piece)
+                slot = predecessor - SIZE // 2
+                if remaining[slot]:
+                    remaining[slot] -= 1
+                    if not remaining[slot]:
+                        win[predecessor] = 1
+                        queue.append(predecessor)
+
+    return pack(win)
+
+
+def pack(win):
+    packed = bytearray(SIZE // 8)
+    for position in range(SIZE):
+        if win[position]:
+            packed[position >> 3] |= 1 << (position & 7)
+    return bytes(packed)
+
+
+def probe_index(table, side_to_move, strong_king, weak_king, piece):
+    position = index(side_to_move, strong_king, weak_king, piece)
+    return table[position >> 3] >> (position & 7) & 1
+
+
+def build(directory=BITBASE_DIR):
+    os.makedirs(directory, exist_ok=True)
+    kqk = generate(chess.QUEEN)
+    krk = generate(chess.ROOK)
+    kpk = generate(chess.PAWN, (kqk, krk))
+    for name, table in (('kqk', kqk), ('krk', krk), ('kpk', kpk)):
+        with open(os.path.join(directory, f'{name}.bin'), 'wb') as handle:
+            handle.write(table)
+
+
+def load(name, directory=BITBASE_DIR):
+    if name not in _tables:
+        path = os.path.join(directory, f'{name}.bin')
+        if os.path.exists(path):
+            with open(path, 'rb') as handle:
+                _tables[name] = handle.read()
+        else:
+            _tables[name] = None
+    return _tables[name]
+
+
+def probe(board):
+    # Score from the side to move's view of a SearchBoard with king and pawn, rook or queen
+    # against a lone king, or None when the position is not covered
+    colors = board.colors
+    occupied = colors[0] | colors[1]
+    if occupied.bit_count() != 3:
+        return None
+    piece = (occupied & ~board.pieces[chess.KING]).bit_length() - 1
+    code = board.mailbox[piece]
+    piece_type = code & 7
+    name = TABLE_NAMES.get(piece_type)
+    if name is None:
+        return None
+    table = load(name)
+    if table is None:
+        return None
+
+    strong = bool(code >> 3)
+    kings = board.pieces[chess.KING]
+    strong_king = (kings & colors[strong]).bit_length() - 1
+    weak_king = (kings & colors[not strong]).bit_length() - 1
+    if strong == chess.BLACK:
+        # Tables are built with the strong side as white
+        strong_king, weak_king, piece = strong_king ^ 56, weak_king ^ 56, piece ^ 56
+    side_to_move = STRONG if board.turn == strong else WEAK
+
+    if not probe_index(table, side_to_move, strong_king, weak_king, piece):
+        return 0
+    score = KNOWN_WIN_SCORE + progress(piece_type, strong_king, weak_king, piece)
+    return score if side_to_move == STRONG else -score
+
+
+def progress(piece_type, strong_king, weak_king, piece):
+    # Won positions all score the same to the tables, so steer the search towards promotion
+    # or towards the weak king on the edge with the strong king close by
+    if piece_type == chess.PAWN:
+        return 100 * chess.square_rank(piece)
+    edge = 3 - min(chess.square_file(weak_king), 7 - chess.square_file(weak_king),
+                   chess.square_rank(weak_king), 7 - chess.square_rank(weak_king))
+    return 100 * edge - 10 * chess.square_distance(strong_king, weak_king)
+
+
+if __name__ == "__main__":
+    build()
+    print(f"Wrote kqk, krk and kpk bitbases to {BITBASE_DIR}")
@@ -0,0 +1,265 @@
+from collections import OrderedDict
+
+import chess
+import chess.polyglot
+from AI import AI
+from search_board import CASTLING_ROOKS, PROMOTION_SHIFT
+
+PIECE_VALUES = {chess.PAWN: 100, chess.KNIGHT: 280, chess.BISHOP: 320, chess.ROOK: 500, chess.QUEEN: 900}
+PIECE_VALUE_LIST = [PIECE_VALUES.get(piece_type, 0) for piece_type in range(7)]
+
+
+def build_tables(piece_square_table):
+    # Flat tables indexed [piece_type][square], plus the same tables seen from black's side
+    tables = [[0] * 64 for _ in range(7)]
+    mirrored = [[0] * 64 for _ in range(7)]
+    for symbol, values in piece_square_table.items():
+        piece_type = chess.PIECE_SYMBOLS.index(symbol.lower())
+        tables[piece_type] = list(values)
+        mirrored[piece_type] = [values[63 - square] for square in chess.SQUARES]
+    return tables, mirrored
+
+
+def history_keys(board):
+    # Keys of the positions since the last irreversible move, oldest first and board's last
+    board = board.copy()
+    keys = [chess.polyglot.zobrist_hash(board)]
+    for _ in range(min(board.halfmove_clock, len(board.move_stack))):
+        board.pop()
+        keys.append(chess.polyglot.zobrist_hash(board))
+    keys.reverse()
+    return keys
+
+
+# The hand-set tables of AI.py, which Algorithm2 always plays with
+HAND_SET_TABLES = build_tables(AI().getTable())
+
+# Tables and weights tuned by texel_tuner.py replace the hand-set ones for algorithm1 when they exist
+ai = AI()
+ai.loadTable()
+TABLES, MIRRORED_TABLES = build_tables(ai.getTable())
+EVAL_WEIGHTS = ai.getWeights()
+
+
+class Evaluator():
+    # Keeps material and piece-square totals for both colors up to date while the search makes
+    # and unmakes moves on a SearchBoard, so a leaf reads them in O(1) instead of walking the
+    # board. It also keeps the Zobrist key of every position since the last irreversible move,
+    # which is all a repetition check needs; the root passes the keys of the game so far in.
+    # tables is a pair from build_tables and defaults to algorithm1's.
+    def __init__(self, board, piece_square_table=None, keys=None, tables=None):
+        if tables is not None:
+            self.tables, self.mirrored = tables
+        elif piece_square_table is None:
+            self.tables, self.mirrored = TABLES, MIRRORED_TABLES
+        else:
+            self.tables, self.mirrored = build_tables(piece_square_table)
+        self.reset(board, keys)
+
+    def reset(self, board, keys=None):
+        # Totals are indexed by color (chess.BLACK == 0, chess.WHITE == 1)
+        self.material = [0, 0]
+        self.psqt = [0, 0]
+        self.mirrored_psqt = [0, 0]
+        self.stack = []
+        for square, code in enumerate(board.mailbox):
+            if code:
+                self.update(code & 7, code >> 3, square, 1)
+        self.keys = list(keys) if keys is not None else [board.key]
+
+    def update(self, piece_type, color, square, sign):
+        self.material[color] += sign * PIECE_VALUE_LIST[piece_type]
+        self.psqt[color] += sign * self.tables[piece_type][square]
+        self.mirrored_psqt[color] += sign * self.mirrored[piece_type][square]
+
+    def changes(self, board, move):
+        # (piece type, color, square, sign) of every piece the move lifts or puts down
+        mailbox = board.mailbox
+        from_square = move & 63
+        to_square = (move >> 6) & 63
+        code = mailbox[from_square]
+        piece_type = code & 7
+        color = code >> 3
+        changes = [(piece_type, color, from_square, -1)]
+
+        captured = mailbox[to_square]
+        if captured:
+            changes.append((captured & 7, captured >> 3, to_square, -1))
+        elif piece_type == chess.PAWN and to_square == board.ep_square:
+            changes.append((chess.PAWN, color ^ 1, to_square ^ 8, -1))
+
+        changes.append((move >> PROMOTION_SHIFT or piece_type, color, to_square, 1))
+
+        if piece_type == chess.KING and abs(to_square - from_square) == 2:
+            rook_from, rook_to = CASTLING_ROOKS[to_square]
+            changes.append((chess.ROOK, color, rook_from, -1))
+            changes.append((chess.ROOK, color, rook_to, 1))
+
+        return changes
+
+    def push(self, board, move):
+        # move 0 is the null move
+        if move:
+            changes = self.changes(board, move)
+            for piece_type, color, square, sign in changes:
+                self.update(piece_type, color, square, sign)
+            board.make(move)
+        else:
+            changes = ()
+            board.make_null()
+        self.stack.append(changes)
+        self.keys.append(board.key)
+
+    def pop(self, board):
+        changes = self.stack.pop()
+        if changes:
+            board.unmake()
+            for piece_type, color, square, sign in reversed(changes):
+                self.update(piece_type, color, square, -sign)
+        else:
+            board.unmake_null()
+        self.keys.pop()
+
+    def is_repetition(self, halfmove_clock):
+        # Whether the current position already occurred since the last irreversible move. Only
+        # positions with the same side to move can match, so every other key is compared.
+        keys = self.keys
+        key = keys[-1]
+        for index in range(len(keys) - 3, max(len(keys) - 2 - halfmove_clock, -1), -2):
+            if keys[index] == key:
+                return True
+        return False
+
+    def material_balance(self):
+        return self.material[chess.WHITE] - self.material[chess.BLACK]
+
+    def activity(self, turn):
+        # Same orientation as algorithm1.piece_position_score: every piece is read from the
+        # side-to-move's view of the table
+        if turn:
+            return self.psqt[chess.WHITE] + self.psqt[chess.BLACK]
+        return -(self.mirrored_psqt[chess.WHITE] + self.mirrored_psqt[chess.BLACK])
+
+
+CENTER_MASK = chess.BB_D4 | chess.BB_D5 | chess.BB_E4 | chess.BB_E5
+EDGE_FILES_MASK = chess.BB_FILE_A | chess.BB_FILE_H
+
+
+def material_balance(board):
+    score = 0
+    for piece_type, value in PIECE_VALUES.items():
+        mask = board.pieces_mask(piece_type, chess.WHITE)
+        score += value * mask.bit_count()
+        mask = board.pieces_mask(piece_type, chess.BLACK)
+        score -= value * mask.bit_count()
+    return score
+
+
+def evaluate_mobility(board):
+    # Pseudo-legal move count of the side to move from attack masks, times the number of
+    # pieces on the board (the original term summed the legal move count once per piece)
+    us = board.occupied_co[board.turn]
+    them = board.occupied_co[not board.turn]
+    count = 0
+
+    pieces = us & ~board.pawns
+    while pieces:
+        square = (pieces & -pieces).bit_length() - 1
+        count += (board.attacks_mask(square) & ~us).bit_count()
+        pieces &= pieces - 1
+
+    pawns = us & board.pawns
+    empty = ~board.occupied & chess.BB_ALL
+    targets = them
+    if board.ep_square is not None:
+        targets |= chess.BB_SQUARES[board.ep_square]
+    if board.turn:
+        single = (pawns << 8) & empty
+        double = ((single & chess.BB_RANK_3) << 8) & empty
+        west = ((pawns & ~chess.BB_FILE_A) << 7) & targets
+        east = ((pawns & ~chess.BB_FILE_H) << 9) & targets
+    else:
+        single = (pawns >> 8) & empty
+        double = ((single & chess.BB_RANK_6) >> 8) & empty
+        west = ((pawns & ~chess.BB_FILE_A) >> 9) & targets
+        east = ((pawns & ~chess.BB_FILE_H) >> 7) & targets
+    count += single.bit_count() + double.bit_count() + west.bit_count() + east.bit_count()
+
+    return count * board.occupied.bit_count()
+
+
+def evaluate_center_control(board):
+    return (board.occupied & CENTER_MASK).bit_count()
+
+
+# Entries kept in each process's pawn hash table
+PAWN_TABLE_SIZE = 1 << 16
+
+
+def pawn_fill_south(mask):
+    mask |= mask >> 8
+    mask |= mask >> 16
+    return mask | mask >> 32
+
+
+def pawn_fill_north(mask):
+    mask |= (mask << 8) & chess.BB_ALL
+    mask |= (mask << 16) & chess.BB_ALL
+    return mask | (mask << 32) & chess.BB_ALL
+
+
+def with_adjacent_files(mask):
+    return mask | (mask & ~chess.BB_FILE_A) >> 1 | (mask & ~chess.BB_FILE_H) << 1
+
+
+def pawn_structure_entry(white_pawns, black_pawns):
+    # (score, isolated, white passed, black passed) for a pawn skeleton. Pawns of either color:
+    # a pawn off the edge files with no pawn beside it on its rank is isolated, and every pawn
+    # above the lowest one on its file is doubled. A pawn is passed when no enemy pawn is in
+    # front of it on its own or an adjacent file.
+    pawns = white_pawns | black_pawns
+    isolated = pawns & ~EDGE_FILES_MASK & ~(pawns >> 1) & ~(pawns << 1)
+    files = sum(1 for file_mask in chess.BB_FILES if pawns & file_mask)
+    doubled = pawns.bit_count() - files
+    white_passed = white_pawns & ~with_adjacent_files(pawn_fill_south(black_pawns) >> 8)
+    black_passed = black_pawns & ~with_adjacent_files(pawn_fill_north(white_pawns) << 8 & chess.BB_ALL)
+    return -30 * isolated.bit_count() - 40 * doubled, isolated, white_passed, black_passed
+
+
+class PawnTable():
+    # Bounded cache of pawn structure entries keyed by both colors' pawn bitboards, dropping
+    # the least recently used entry when full. The pawn skeleton changes on few moves, so most
+    # leaves find their entry already here. One table per process serves both engines.
+    def __init__(self, size=PAWN_TABLE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+        self.probes = 0
+        self.hits = 0
+
+    def probe(self, white_pawns, black_pawns):
+        key = (white_pawns, black_pawns)
+        self.probes += 1
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry
+        if len(self.entries) >= self.size:
+            self.entries.popitem(last=False)
+        entry = self.entries[key] = pawn_structure_entry(white_pawns, black_pawns)
+        return entry
+
+    def hit_rate(self):
+        return self.hits / self.probes if self.probes else 0.0
+
+
+pawn_table = PawnTable()
+
+
+def pawn_structure(board):
+    pawns = board.pawns
+    return pawn_table.probe(pawns & board.occupied_co[chess.WHITE], pawns & board.occupied_co[chess.BLACK])
+
+
+def evaluate_pawn_structure(board):
+    return pawn_structure(board)[0]
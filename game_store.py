@@ -0,0 +1,184 @@
+import csv
+import glob
+import json
+import os
+import struct
+import sys
+import time
+from collections import namedtuple
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory locks on Windows, where only one process may write to a store at a time
+    fcntl = None
+
+import chess
+from paths import ROOT
+from transposition import decode_move, encode_move
+
+STORE_DIR = os.path.join(ROOT, 'games')
+
+# Games saved before the store existed, one CSV file of SAN moves per game
+LEGACY_GAMES_DIR = os.path.join(ROOT, 'pastGames')
+
+DATA_FILE = 'games.bin'
+INDEX_FILE = 'games.idx'
+
+# A record is its header, the metadata as JSON, then one 16-bit move per ply from the start
+# position. The index holds the offset and length of every record, so a game's id is its
+# position in the index.
+RECORD_HEADER = struct.Struct('<IH')
+INDEX_ENTRY = struct.Struct('<QI')
+
+Game = namedtuple('Game', ['game_id', 'metadata', 'moves'])
+
+
+def encode_record(moves, metadata):
+    meta = json.dumps(metadata, separators=(',', ':')).encode()
+    codes = [encode_move(move) for move in moves]
+    return RECORD_HEADER.pack(len(meta), len(codes)) + meta + struct.pack(f'<{len(codes)}H', *codes)
+
+
+def decode_record(game_id, data):
+    meta_length, move_count = RECORD_HEADER.unpack_from(data)
+    start = RECORD_HEADER.size
+    metadata = json.loads(data[start:start + meta_length])
+    codes = struct.unpack_from(f'<{move_count}H', data, start + meta_length)
+    return Game(game_id, metadata, [decode_move(code) for code in codes])
+
+
+class GameStore():
+    # Append-only archive of games. Appends write the record before its index entry, so a
+    # crash can only leave an unindexed tail that later appends skip over. Every append holds
+    # an exclusive lock on the index, so several processes can save games to one store.
+    def __init__(self, directory=STORE_DIR):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.data = open(os.path.join(directory, DATA_FILE), 'a+b')
+        self.index = open(os.path.join(directory, INDEX_FILE), 'a+b')
+
+    def __len__(self):
+        self.index.seek(0, os.SEEK_END)
+        return self.index.tell() // INDEX_ENTRY.size
+
+    def append(self, moves, **metadata):
+        metadata.setdefault('saved', time.time())
+        record = encode_record(moves, metadata)
+        if fcntl is not None:
+            fcntl.flock(self.index, fcntl.LOCK_EX)
+        try:
+            self.data.seek(0, os.SEEK_END)
+            offset = self.data.tell()
+            self.data.write(record)
+            self.data.flush()
+            game_id = len(self)
+            self.index.write(INDEX_ENTRY.pack(offset, len(record)))
+            self.index.flush()
+        finally:
+            if fcntl is not None:
+                fcntl.flock(self.index, fcntl.LOCK_UN)
+        return game_id
+
+    def locate(self, game_id):
+        if not 0 <= game_id < len(self):
+            raise IndexError(f"No game {game_id} in {self.directory}")
+        self.index.seek(game_id * INDEX_ENTRY.size)
+        return INDEX_ENTRY.unpack(self.index.read(INDEX_ENTRY.size))
+
+    def get(self, game_id):
+        offset, length = self.locate(game_id)
+        self.data.seek(offset)
+        return decode_record(game_id, self.data.read(length))
+
+    def __getitem__(self, game_id):
+        return self.get(game_id)
+
+    def games(self, start=0):
+        # Streams games in the order they were saved with one sequential pass over each file
+        count = len(self)
+        if start >= count:
+            return
+        self.index.seek(start * INDEX_ENTRY.size)
+        entries = self.index.read((count - start) * INDEX_ENTRY.size)
+        with open(os.path.join(self.directory, DATA_FILE), 'rb', buffering=1 << 20) as data:
+            data.seek(INDEX_ENTRY.unpack_from(entries)[0])
+            for position, (offset, length) in enumerate(INDEX_ENTRY.iter_unpack(entries), start):
+                if data.tell() != offset:
+                    data.seek(offset)
+                yield decode_record(position, data.read(length))
+
+    def __iter__(self):
+        return self.games()
+
+    def close(self):
+        self.data.close()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def result_of(board):
+    outcome = board.outcome(claim_draw=True)
+    return outcome.result() if outcome else '*'
+
+
+def iter_store_games(directory=STORE_DIR):
+    # Move lists only, for readers such as the book builder
+    if not os.path.exists(os.path.join(directory, INDEX_FILE)):
+        return
+    with GameStore(directory) as store:
+        for game in store.games():
+            yield game.moves
+
+
+def iter_csv_games(directory=LEGACY_GAMES_DIR):
+    # Archived games are one SAN move per row
+    for filename in sorted(glob.glob(os.path.join(directory, '*.csv'))):
+        yield read_csv_game(filename)
+
+
+def read_csv_game(filename):
+    board = chess.Board()
+    moves = []
+    with open(filename, newline='') as csvfile:
+        for row in csv.reader(csvfile):
+            if not row:
+                continue
+            try:
+                move = board.parse_san(row[0])
+            except ValueError:
+                break
+            moves.append(move)
+            board.push(move)
+    return moves
+
+
+def import_csv_games(store, directory=LEGACY_GAMES_DIR):
+    # One-time import of the old per-game CSV files; files already imported are skipped, so
+    # running it again is harmless
+    imported = {game.metadata.get('source') for game in store.games()}
+    count = 0
+    for filename in sorted(glob.glob(os.path.join(directory, '*.csv'))):
+        source = os.path.basename(filename)
+        if source in imported:
+            continue
+        moves = read_csv_game(filename)
+        board = chess.Board()
+        for move in moves:
+            board.push(move)
+        store.append(moves, source=source, result=result_of(board), white='algorithm1', black='human',
+                     saved=os.path.getmtime(filename))
+        count += 1
+    return count
+
+
+if __name__ == "__main__":
+    with GameStore() as game_store:
+        if sys.argv[1:] == ['import']:
+            print(f"Imported {import_csv_games(game_store)} games from {LEGACY_GAMES_DIR}")
+        print(f"{len(game_store)} games in {STORE_DIR}")
@@ -0,0 +1,73 @@
+import chess
+from evaluator import PIECE_VALUES
+
+# Kings only ever capture as the attacker, so they rank below every other piece for LVA
+ATTACKER_VALUES = {**PIECE_VALUES, chess.KING: 1000}
+
+HASH_MOVE_SCORE = 3000000
+CAPTURE_SCORE = 2000000
+KILLER_SCORE = 1000000
+HISTORY_LIMIT = KILLER_SCORE - 1
+
+
+class MoveOrderer():
+    # Hash move first, then captures by MVV-LVA, then the killer moves of the ply, then quiet
+    # moves by their history score. Moves are a SearchBoard's ints, 0 standing for none.
+    def __init__(self, max_ply=64):
+        self.killers = [[0, 0] for _ in range(max_ply)]
+        self.history = [0] * 4096
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+
+    def new_search(self):
+        for killers in self.killers:
+            killers[0] = killers[1] = 0
+        # Old history still hints at good quiet moves, but should not outweigh new cutoffs
+        self.history = [value // 2 for value in self.history]
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+
+    def killers_at(self, ply):
+        while ply >= len(self.killers):
+            self.killers.append([0, 0])
+        return self.killers[ply]
+
+    def score(self, board, move, hash_move, killers):
+        if move == hash_move:
+            return HASH_MOVE_SCORE
+        mailbox = board.mailbox
+        to_square = (move >> 6) & 63
+        attacker = mailbox[move & 63] & 7
+        victim = mailbox[to_square] & 7
+        if not victim and attacker == chess.PAWN and to_square == board.ep_square:
+            victim = chess.PAWN
+        if victim:
+            return CAPTURE_SCORE + 10 * PIECE_VALUES[victim] - ATTACKER_VALUES[attacker]
+        promotion = move >> 12
+        if promotion:
+            return CAPTURE_SCORE + PIECE_VALUES[promotion]
+        if move == killers[0] or move == killers[1]:
+            return KILLER_SCORE - (move == killers[1])
+        return self.history[move & 4095]
+
+    def order(self, board, ply, hash_move=0):
+        killers = self.killers_at(ply)
+        return sorted(board.generate_legal([]), key=lambda move: self.score(board, move, hash_move, killers),
+                      reverse=True)
+
+    def record_cutoff(self, board, move, ply, depth, index):
+        self.cutoffs += 1
+        if index == 0:
+            self.first_move_cutoffs += 1
+        if move >> 12 or board.is_capture(move):
+            return
+
+        killers = self.killers_at(ply)
+        if move != killers[0]:
+            killers[1] = killers[0]
+            killers[0] = move
+        slot = move & 4095
+        self.history[slot] = min(HISTORY_LIMIT, self.history[slot] + depth * depth)
+
+    def first_move_cutoff_rate(self):
+        return self.first_move_cutoffs / self.cutoffs if self.cutoffs else 0.0
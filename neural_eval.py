@@ -0,0 +1,205 @@
+import math
+import os
+import sys
+import time
+from collections import OrderedDict
+
+import chess
+import chess.polyglot
+import numpy as np
+from paths import ROOT
+from training_data import board_from_record
+
+MODEL_PATH = os.path.join(ROOT, 'value_net.keras')
+
+# Twelve piece planes (white pawn to king, then black) and one plane set when white is to move
+PLANES = 13
+CACHE_SIZE = 1 << 18
+BATCH_SIZES = (1, 8, 32, 128, 512)
+
+# The network predicts a value in (-1, 1) for the side to move; it is turned into centipawns
+# like a win probability, and capped below the bitbase and mate scores
+VALUE_LIMIT = 0.999
+SCORE_SCALE = 400
+
+_tensorflow = None
+
+
+def load_tensorflow():
+    # Imported on first use, so engines that never use the network never pay for it. The
+    # evaluator runs on the CPU, next to the search processes.
+    global _tensorflow
+    if _tensorflow is None:
+        os.environ.setdefault('CUDA_VISIBLE_DEVICES', '-1')
+        os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+        import tensorflow
+        tensorflow.config.set_visible_devices([], 'GPU')
+        _tensorflow = tensorflow
+    return _tensorflow
+
+
+def board_masks(board):
+    # The bitboard behind each plane, for a python-chess board or a SearchBoard
+    masks = [board.pieces_mask(piece_type, color) for color in (chess.WHITE, chess.BLACK)
+             for piece_type in chess.PIECE_TYPES]
+    masks.append(chess.BB_ALL if board.turn == chess.WHITE else 0)
+    return masks
+
+
+def encode_masks(masks):
+    # (batch, 8, 8, PLANES) float32 planes from board_masks rows, square a1 at [0, 0]
+    masks = np.array(masks, dtype='<u8').reshape(-1, PLANES)
+    bits = np.unpackbits(masks.view(np.uint8).reshape(len(masks), PLANES, 8), axis=2, bitorder='little')
+    return bits.reshape(len(masks), PLANES, 8, 8).transpose(0, 2, 3, 1).astype(np.float32)
+
+
+def encode_boards(boards):
+    return encode_masks([board_masks(board) for board in boards])
+
+
+def build_model():
+    tf = load_tensorflow()
+    inputs = tf.keras.Input(shape=(8, 8, PLANES))
+    x = tf.keras.layers.Conv2D(32, 3, padding='same', activation='relu')(inputs)
+    x = tf.keras.layers.Conv2D(32, 3, padding='same', activation='relu')(x)
+    x = tf.keras.layers.Flatten()(x)
+    x = tf.keras.layers.Dense(64, activation='relu')(x)
+    outputs = tf.keras.layers.Dense(1, activation='tanh')(x)
+    model = tf.keras.Model(inputs, outputs)
+    model.compile(optimizer='adam', loss='mse')
+    return model
+
+
+def load_model(path=MODEL_PATH):
+    # An untrained network when there is no saved one, which still measures throughput
+    tf = load_tensorflow()
+    if os.path.exists(path):
+        return tf.keras.models.load_model(path)
+    return build_model()
+
+
+def value_to_score(values):
+    values = np.clip(values, -VALUE_LIMIT, VALUE_LIMIT)
+    return SCORE_SCALE * np.log10((1 + values) / (1 - values))
+
+
+class NeuralEvaluator():
+    # Drop-in for evaluation(board, evaluator) on the search's SearchBoard: scores from the side
+    # to move's view, cached by Zobrist key. Search calls prefetch() with the moves of a node that lead to the horizon, so
+    # those leaves are scored in one model call before the search visits them one by one.
+    def __init__(self, model=None, cache_size=CACHE_SIZE):
+        self.model = model if model is not None else load_model()
+        self.predict = load_tensorflow().function(lambda batch: self.model(batch, training=False),
+                                                  reduce_retracing=True)
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self.batches = 0
+        self.batched_positions = 0
+
+    def __call__(self, board, evaluator=None):
+        key = board.key
+        score = self.lookup(key)
+        if score is None:
+            score = self.evaluate_masks([board_masks(board)], [key])[0]
+        return score
+
+    def lookup(self, key):
+        score = self.cache.get(key)
+        if score is None:
+            self.misses += 1
+            return None
+        self.cache.move_to_end(key)
+        self.hits += 1
+        return score
+
+    def store(self, key, score):
+        self.cache[key] = score
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def evaluate_batch(self, boards, keys=None):
+        # Python-chess boards, as the throughput measurement passes them
+        if keys is None:
+            keys = [chess.polyglot.zobrist_hash(board) for board in boards]
+        return self.evaluate_masks([board_masks(board) for board in boards], keys)
+
+    def evaluate_masks(self, masks, keys):
+        values = self.predict(encode_masks(masks)).numpy().reshape(-1)
+        scores = value_to_score(values).tolist()
+        for key, score in zip(keys, scores):
+            self.store(key, score)
+        self.batches += 1
+        self.batched_positions += len(masks)
+        return scores
+
+    def prefetch(self, board, moves):
+        # Leaves that are not cached yet, evaluated together; moves are the SearchBoard's ints
+        masks = []
+        keys = []
+        for move in moves:
+            board.make(move)
+            key = board.key
+            if key not in self.cache:
+                masks.append(board_masks(board))
+                keys.append(key)
+            board.unmake()
+        if masks:
+            self.evaluate_masks(masks, keys)
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def mean_batch_size(self):
+        return self.batched_positions / self.batches if self.batches else 0.0
+
+
+def train(model, shards, epochs=1, batch_size=512):
+    # Fits the network to game results from training_data shards, from the side to move's view
+    for shard in shards:
+        for start in range(0, len(shard), 65536):
+            records = np.asarray(shard[start:start + 65536])
+            boards = [board_from_record(record) for record in records]
+            white_value = 2 * records['result'].astype(np.float32) - 1
+            targets = np.where(records['turn'].astype(bool), white_value, -white_value)
+            model.fit(encode_boards(boards), targets, epochs=epochs, batch_size=batch_size, verbose=0)
+    return model
+
+
+def measure_throughput(evaluator, boards, batch_sizes=BATCH_SIZES, repeats=3):
+    # Positions per second of uncached model calls at each batch size
+    rates = {}
+    for batch_size in batch_sizes:
+        batches = [boards[start:start + batch_size] for start in range(0, len(boards), batch_size)]
+        evaluator.evaluate_batch(batches[0])  # Traces the model for this batch shape
+        best = math.inf
+        for _ in range(repeats):
+            start = time.perf_counter()
+            for batch in batches:
+                evaluator.evaluate_batch(batch)
+            best = min(best, time.perf_counter() - start)
+        rates[batch_size] = sum(len(batch) for batch in batches) / best
+    return rates
+
+
+def sample_boards(count=2048, seed=1):
+    # Random playouts from the start position, the same ones every run
+    generator = np.random.default_rng(seed)
+    boards = []
+    board = chess.Board()
+    while len(boards) < count:
+        moves = list(board.legal_moves)
+        if not moves or board.ply() > 120:
+            board = chess.Board()
+            continue
+        board.push(moves[generator.integers(len(moves))])
+        boards.append(board.copy(stack=False))
+    return boards
+
+
+if __name__ == "__main__":
+    neural = NeuralEvaluator()
+    for size, rate in measure_throughput(neural, sample_boards()).items():
+        print(f"Batch {size}: {rate:.0f} positions/s", file=sys.stderr)
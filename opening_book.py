@@ -0,0 +1,100 @@
+import os
+import struct
+from collections import defaultdict
+
+import chess
+import chess.pgn
+import chess.polyglot
+from game_store import LEGACY_GAMES_DIR, STORE_DIR, GameStore, import_csv_games, iter_store_games
+from paths import ROOT
+
+BOOK_PATH = os.path.join(ROOT, 'openingBook.bin')
+ECO_PATH = os.path.join(ROOT, 'pgn-extract', 'eco.pgn')
+
+# Only the opening phase of each game goes into the book
+MAX_BOOK_PLY = 20
+
+ENTRY = struct.Struct('>QHHI')
+
+
+def polyglot_move(board, move):
+    # Polyglot writes castling as the king capturing its own rook
+    to_square = move.to_square
+    if board.is_castling(move):
+        rook_file = 7 if chess.square_file(move.to_square) == 6 else 0
+        to_square = chess.square(rook_file, chess.square_rank(move.from_square))
+    promotion = move.promotion - 1 if move.promotion else 0
+    return (chess.square_file(to_square) | chess.square_rank(to_square) << 3
+            | chess.square_file(move.from_square) << 6 | chess.square_rank(move.from_square) << 9
+            | promotion << 12)
+
+
+def iter_pgn_games(path):
+    # One game in memory at a time
+    with open(path, encoding='utf-8', errors='replace') as handle:
+        while True:
+            game = chess.pgn.read_game(handle)
+            if game is None:
+                break
+            yield list(game.mainline_moves())
+
+
+def build_book(output=BOOK_PATH, pgn_paths=(ECO_PATH,), store_dir=STORE_DIR, max_ply=MAX_BOOK_PLY,
+               legacy_dir=LEGACY_GAMES_DIR):
+    weights = defaultdict(int)
+    sources = [iter_pgn_games(path) for path in pgn_paths]
+    if store_dir:
+        # Games still only in the old pastGames CSV files are imported into the store first, as
+        # position_index does
+        with GameStore(store_dir) as store:
+            import_csv_games(store, legacy_dir)
+        sources.append(iter_store_games(store_dir))
+
+    for source in sources:
+        for moves in source:
+            board = chess.Board()
+            for move in moves[:max_ply]:
+                weights[(chess.polyglot.zobrist_hash(board), polyglot_move(board, move))] += 1
+                board.push(move)
+
+    # Polyglot readers binary search on the key, so entries are sorted by key, and by
+    # descending weight within a key. Weights are scaled into 16 bits.
+    top = max(weights.values(), default=1)
+    scale = min(1.0, 65535 / top)
+    entries = sorted(weights.items(), key=lambda item: (item[0][0], -item[1]))
+    with open(output, 'wb') as book:
+        for (key, raw_move), weight in entries:
+            book.write(ENTRY.pack(key, raw_move, max(1, int(weight * scale)), 0))
+    return len(entries)
+
+
+class OpeningBook():
+    # Memory-mapped Polyglot book: lookups binary search the mapped file, and every process
+    # that opens it shares the same pages instead of loading a copy
+    def __init__(self, path=BOOK_PATH):
+        self.reader = chess.polyglot.open_reader(path) if os.path.exists(path) else None
+
+    def probe(self, board, weighted=True):
+        if self.reader is None:
+            return None
+        try:
+            entry = self.reader.weighted_choice(board) if weighted else self.reader.find(board)
+        except IndexError:
+            return None
+        return entry.move
+
+    def close(self):
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+if __name__ == "__main__":
+    count = build_book()
+    print(f"Wrote {count} book entries to {BOOK_PATH}")
@@ -0,0 +1,4 @@
+import os
+
+# Directory of the engine's modules; data files, caches and models live beside them
+ROOT = os.path.dirname(os.path.abspath(__file__))
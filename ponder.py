@@ -0,0 +1,84 @@
+import threading
+import time
+
+import chess.polyglot
+import algorithm1 as algor
+from time_manager import TimeManager
+from transposition import decode_move
+
+
+class Ponderer():
+    # Searches the position after the opponent's expected reply while the opponent thinks.
+    # The search runs in a background thread on the game's pool, so everything it finds
+    # lands in the shared transposition table either way. On a ponder hit the same search
+    # carries on under the move's real budget; on a miss it is stopped and its table entries
+    # only help the next search.
+    def __init__(self, pool, max_depth=20, options=None):
+        self.pool = pool
+        self.max_depth = max_depth
+        self.options = options
+        self.thread = None
+        self.timer = None
+        self.board = None
+        self.ponder_move = None
+        self.time_manager = None
+        self.result = None
+
+    def expected_reply(self, board):
+        # The reply the last search expected is the best move stored for this position
+        entry = self.pool.transposition_table.probe(chess.polyglot.zobrist_hash(board))
+        if entry is None or not entry[3]:
+            return None
+        move = decode_move(entry[3])
+        return move if board.is_legal(move) else None
+
+    def start(self, board):
+        move = self.expected_reply(board)
+        if move is None:
+            return False
+        self.ponder_move = move
+        self.board = board.copy()
+        self.board.push(move)
+        self.time_manager = TimeManager(budget=None)
+        self.result = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return True
+
+    def run(self):
+        # The best move and the stats of the search, as the engine returns them
+        self.result = algor.iterative_deepening_best_move(self.board, self.time_manager.start_time,
+                                                          self.max_depth, pool=self.pool, options=self.options,
+                                                          time_manager=self.time_manager)
+
+    def is_pondering(self):
+        return self.thread is not None
+
+    def is_hit(self, move):
+        return self.thread is not None and move == self.ponder_move
+
+    def hit(self, budget, start_time=None):
+        # The opponent played the expected move: keep the search and give it the move's budget.
+        # Root tasks already running were handed an open deadline, so a timer stops them.
+        self.time_manager.set_budget(budget, start_time)
+        if self.thread.is_alive():
+            self.timer = threading.Timer(max(0.0, self.time_manager.deadline - time.time()), self.pool.stop)
+            self.timer.start()
+        return self.finish()
+
+    def miss(self):
+        self.pool.stop()
+        self.finish()
+        return None
+
+    def finish(self):
+        self.thread.join()
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        result = self.result
+        self.thread = None
+        self.board = None
+        self.ponder_move = None
+        self.time_manager = None
+        return result
@@ -0,0 +1,229 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import chess
+import chess.pgn
+import chess.polyglot
+import numpy as np
+from game_store import INDEX_FILE, LEGACY_GAMES_DIR, STORE_DIR, GameStore, import_csv_games
+from opening_book import ECO_PATH
+from paths import ROOT
+from transposition import decode_move, encode_move
+
+INDEX_DIR = os.path.join(ROOT, 'position_index')
+BASE_FILE = 'base.npy'
+DELTA_FILE = 'delta.npy'
+META_FILE = 'meta.json'
+
+# One entry per position of every game: its Zobrist key, where it came from, the game's
+# result from white's side, the ply, the move played next (0 after the last move) and the
+# game id in its source. Entries are sorted by key.
+ENTRY_DTYPE = np.dtype([('key', '<u8'), ('source', 'u1'), ('result', 'i1'), ('ply', '<u2'), ('move', '<u2'),
+                        ('game', '<u4')])
+
+STORE_SOURCE = 0
+ECO_SOURCE = 1
+
+RESULTS = {'1-0': 1, '1/2-1/2': 0, '0-1': -1}
+UNKNOWN_RESULT = -2
+
+# New games go into a small delta beside the base, which is rewritten with the delta merged
+# in once the delta holds this fraction of its entries
+MERGE_FRACTION = 0.1
+
+
+def game_entries(moves, game, source, result=None):
+    rows = []
+    board = chess.Board()
+    result = RESULTS.get(result, UNKNOWN_RESULT)
+    for ply, move in enumerate(moves):
+        rows.append((chess.polyglot.zobrist_hash(board), source, result, ply, encode_move(move), game))
+        board.push(move)
+    rows.append((chess.polyglot.zobrist_hash(board), source, result, len(moves), 0, game))
+    return rows
+
+
+def sorted_entries(rows):
+    entries = np.array(rows, dtype=ENTRY_DTYPE)
+    return entries[np.argsort(entries['key'], kind='stable')]
+
+
+def iter_eco_lines(path=ECO_PATH):
+    # (moves, 'A00 Polish: Tuebingen variation') for every line of eco.pgn
+    with open(path, encoding='utf-8', errors='replace') as handle:
+        while True:
+            game = chess.pgn.read_game(handle)
+            if game is None:
+                break
+            headers = game.headers
+            # The file opens with a comment, which reads as a game without moves
+            if 'ECO' not in headers or game.next() is None:
+                continue
+            name = headers.get('Opening', '?')
+            if headers.get('Variation'):
+                name += f": {headers['Variation']}"
+            yield list(game.mainline_moves()), f"{headers['ECO']} {name}"
+
+
+class PositionIndex():
+    # Memory-mapped index from Zobrist key to the games that reached the position, over the game
+    # store and the ECO lines. Lookups binary search the base and the delta, so they only touch
+    # a few pages of either file. Readers see the files as they were when the index was opened.
+    def __init__(self, directory=INDEX_DIR):
+        self.directory = directory
+        self.load()
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def load(self):
+        meta_path = self.path(META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path) as handle:
+                self.meta = json.load(handle)
+        else:
+            self.meta = {'store_games': 0, 'eco_names': []}
+        self.base = self.load_entries(BASE_FILE)
+        self.delta = self.load_entries(DELTA_FILE)
+
+    def load_entries(self, name):
+        path = self.path(name)
+        if not os.path.exists(path):
+            return np.zeros(0, dtype=ENTRY_DTYPE)
+        return np.load(path, mmap_mode='r')
+
+    def built(self):
+        return os.path.exists(self.path(META_FILE))
+
+    def __len__(self):
+        return len(self.base) + len(self.delta)
+
+    def lookup(self, key):
+        # Every entry with the key, base entries first
+        found = []
+        for entries in (self.base, self.delta):
+            keys = entries['key']
+            start = np.searchsorted(keys, key, side='left')
+            end = np.searchsorted(keys, key, side='right')
+            found.append(entries[start:end])
+        return np.concatenate(found)
+
+    def opening_stats(self, board):
+        # Moves played from the position in archived games: {move: (games, white wins, draws, black wins)}
+        stats = {}
+        for entry in self.lookup(chess.polyglot.zobrist_hash(board)):
+            if entry['source'] != STORE_SOURCE or not entry['move']:
+                continue
+            move = decode_move(int(entry['move']))
+            games, white, draws, black = stats.get(move, (0, 0, 0, 0))
+            result = int(entry['result'])
+            stats[move] = (games + 1, white + (result == 1), draws + (result == 0), black + (result == -1))
+        return stats
+
+    def eco_name(self, board):
+        # Name of the ECO line that ends in this very position, if any
+        for entry in self.lookup(chess.polyglot.zobrist_hash(board)):
+            if entry['source'] == ECO_SOURCE and not entry['move']:
+                return self.meta['eco_names'][entry['game']]
+        return None
+
+    def classify(self, board):
+        # Name of the longest ECO line whose final position the game has passed through
+        board = board.copy()
+        while True:
+            name = self.eco_name(board)
+            if name is not None or not board.move_stack:
+                return name
+            board.pop()
+
+    def build(self, store_dir=STORE_DIR, eco_path=ECO_PATH, legacy_dir=LEGACY_GAMES_DIR):
+        # Full rebuild: the ECO lines go into the base, archived games through update(). Games
+        # still only in the old pastGames CSV files are imported into the store first.
+        with GameStore(store_dir) as store:
+            import_csv_games(store, legacy_dir)
+        rows = []
+        names = []
+        for game, (moves, name) in enumerate(iter_eco_lines(eco_path)):
+            rows += game_entries(moves, game, ECO_SOURCE)
+            names.append(name)
+        self.meta = {'store_games': 0, 'eco_names': names}
+        self.write(sorted_entries(rows), np.zeros(0, dtype=ENTRY_DTYPE))
+        return self.update(store_dir)
+
+    def update(self, store_dir=STORE_DIR):
+        # Adds the games saved since the last update and returns how many there were. An index
+        # that was never built is left alone; building it is a step of its own.
+        if not self.built() or not os.path.exists(os.path.join(store_dir, INDEX_FILE)):
+            return 0
+        rows = []
+        with GameStore(store_dir) as store:
+            start = self.meta['store_games']
+            for game in store.games(start):
+                rows += game_entries(game.moves, game.game_id, STORE_SOURCE, game.metadata.get('result'))
+                self.meta['store_games'] = game.game_id + 1
+        added = self.meta['store_games'] - start
+        if not rows:
+            return added
+
+        delta = np.concatenate([np.asarray(self.delta), np.array(rows, dtype=ENTRY_DTYPE)])
+        delta = delta[np.argsort(delta['key'], kind='stable')]
+        if len(delta) > MERGE_FRACTION * len(self.base):
+            base = np.concatenate([np.asarray(self.base), delta])
+            self.write(base[np.argsort(base['key'], kind='stable')], np.zeros(0, dtype=ENTRY_DTYPE))
+        else:
+            self.write(None, delta)
+        return added
+
+    def write(self, base, delta):
+        # Each file is replaced whole, so a reader never sees a partly written one
+        os.makedirs(self.directory, exist_ok=True)
+        for name, entries in ((BASE_FILE, base), (DELTA_FILE, delta)):
+            if entries is None:
+                continue
+            temporary = self.path(f'tmp-{name}')
+            np.save(temporary, entries)
+            os.replace(temporary, self.path(name))
+        temporary = self.path(f'tmp-{META_FILE}')
+        with open(temporary, 'w') as handle:
+            json.dump(self.meta, handle)
+        os.replace(temporary, self.path(META_FILE))
+        self.load()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Zobrist-keyed index of archived games and ECO lines")
+    parser.add_argument('--index-dir', default=INDEX_DIR)
+    parser.add_argument('--store-dir', default=STORE_DIR)
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('build')
+    commands.add_parser('update')
+    lookup = commands.add_parser('lookup')
+    lookup.add_argument('fen', nargs='?', default=chess.STARTING_FEN)
+    args = parser.parse_args(argv)
+
+    index = PositionIndex(args.index_dir)
+    if args.command != 'build' and not index.built():
+        print(f"No index in {args.index_dir}, run the build command first", file=sys.stderr)
+        return 1
+    start = time.perf_counter()
+    if args.command in ('build', 'update'):
+        added = index.build(args.store_dir) if args.command == 'build' else index.update(args.store_dir)
+        print(f"Indexed {added} new games, {len(index)} positions in {time.perf_counter() - start:.1f}s",
+              file=sys.stderr)
+        return 0
+
+    board = chess.Board(args.fen)
+    entries = index.lookup(chess.polyglot.zobrist_hash(board))
+    print(f"{len(entries)} entries in {(time.perf_counter() - start) * 1000:.3f}ms, "
+          f"opening: {index.classify(board) or 'unknown'}")
+    stats = sorted(index.opening_stats(board).items(), key=lambda item: -item[1][0])
+    for move, (games, white, draws, black) in stats:
+        print(f"{board.san(move)}: {games} games, +{white} ={draws} -{black}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,319 @@
+import time
+
+import chess.polyglot
+import bitbases
+from evaluator import Evaluator, history_keys, pawn_table
+from move_ordering import MoveOrderer
+from search_board import PROMOTION_SHIFT, SearchBoard
+from time_manager import CHECK_INTERVAL, SearchAborted
+from transposition import EXACT, LOWERBOUND, UPPERBOUND, decode_move, encode_move, quantize
+
+INFINITY = float('inf')
+MATE_SCORE = 10000000
+MATE_BOUND = MATE_SCORE - 1000
+
+# Scores are floats, so a null window is one evaluation unit wide
+NULL_WINDOW = 1
+
+ASPIRATION_WINDOW = 50
+ASPIRATION_LIMIT = 1000
+NULL_MOVE_REDUCTION = 2
+NULL_MOVE_MIN_DEPTH = 3
+LMR_MIN_DEPTH = 3
+LMR_MIN_MOVES = 3
+
+# Every technique can be switched off on its own to measure its node savings
+DEFAULT_OPTIONS = {'pvs': True, 'aspiration': True, 'null_move': True, 'lmr': True}
+
+
+def score_to_tt(score, ply):
+    # Mate scores are stored as distance from the node rather than from the root
+    if score >= MATE_BOUND:
+        return score + ply
+    if score <= -MATE_BOUND:
+        return score - ply
+    return score
+
+
+def score_from_tt(score, ply):
+    if score >= MATE_BOUND:
+        return score - ply
+    if score <= -MATE_BOUND:
+        return score + ply
+    return score
+
+
+def has_non_pawn_material(board, color):
+    return bool(board.occupied_co[color] & ~(board.pawns | board.kings))
+
+
+def principal_variation(board, move, transposition_table, max_length):
+    # The best move followed by the hash moves stored along the line it leads to
+    board = board.copy(stack=False)
+    pv = []
+    seen = set()
+    while move is not None and len(pv) < max_length and board.is_legal(move):
+        pv.append(move)
+        board.push(move)
+        key = chess.polyglot.zobrist_hash(board)
+        if key in seen:
+            break
+        seen.add(key)
+        entry = transposition_table.probe(key)
+        move = decode_move(entry[3]) if entry is not None else None
+    return pv
+
+
+class Search():
+    # Negamax alpha-beta with principal-variation search, aspiration windows, null-move
+    # pruning and late-move reductions. evaluate(board, evaluator) scores a leaf from the
+    # side to move's point of view; tables are the piece-square tables its Evaluator keeps.
+    # Below the root the search plays integer moves on a SearchBoard; python-chess boards and
+    # moves are converted on the way in and out of search_root.
+    def __init__(self, evaluate, transposition_table, move_orderer=None, tables=None, **options):
+        self.evaluate = evaluate
+        self.tables = tables
+        # Evaluators that score leaves in batches get the moves leading to the horizon up front
+        self.prefetch = getattr(evaluate, 'prefetch', None)
+        self.transposition_table = transposition_table
+        self.move_orderer = move_orderer or MoveOrderer()
+        self.evaluator = None
+        self.deadline = INFINITY
+        self.max_nodes = None
+        self.stop_event = None
+        self.reset_counters()
+        self.configure(**options)
+
+    def configure(self, **options):
+        options = dict(DEFAULT_OPTIONS, **options)
+        self.pvs = options['pvs']
+        self.aspiration = options['aspiration']
+        self.null_move = options['null_move']
+        self.lmr = options['lmr']
+
+    def new_search(self, deadline=INFINITY):
+        self.deadline = deadline
+        self.reset_counters()
+        self.move_orderer.new_search()
+
+    def reset_counters(self):
+        self.nodes = 0
+        self.evaluations = 0
+        self.tt_probes = 0
+        self.tt_hits = 0
+        # The pawn table is the process's, so its counts are taken relative to this point
+        self.pawn_counts = (pawn_table.probes, pawn_table.hits)
+        self.eval_time = 0.0
+        self.movegen_time = 0.0
+
+    def counters(self):
+        # In the order of search_stats.COUNTERS
+        return (self.nodes, self.evaluations, self.move_orderer.cutoffs, self.move_orderer.first_move_cutoffs,
+                self.tt_probes, self.tt_hits, pawn_table.probes - self.pawn_counts[0],
+                pawn_table.hits - self.pawn_counts[1], self.eval_time, self.movegen_time)
+
+    def check_abort(self):
+        if time.time() >= self.deadline or (self.stop_event is not None and self.stop_event.is_set()):
+            raise SearchAborted()
+        if self.max_nodes is not None and self.nodes >= self.max_nodes:
+            raise SearchAborted()
+
+    def iterative_deepening(self, board, max_depth, search_root=None, time_manager=None, on_iteration=None):
+        # search_root(board, depth, alpha, beta, hash_move) -> (score, move); the default
+        # searches the root moves in this process. An aborted iteration is thrown away and
+        # the last completed one decides the move. on_iteration(depth, score, move, nodes) is
+        # called after every completed iteration.
+        search_root = search_root or self.search_root
+        if time_manager is not None:
+            self.deadline = time_manager.deadline
+        self.max_nodes = time_manager.max_nodes if time_manager is not None else None
+        best_move = None
+        best_score = None
+        best_depth = 0
+        for depth in range(1, max_depth + 1):
+            if depth > 1 and time_manager is not None and time_manager.soft_limit_reached():
+                break
+            try:
+                score, move = self.aspiration_search(board, depth, best_score, best_move, search_root)
+            except SearchAborted:
+                break
+            if move is not None:
+                best_move, best_score, best_depth = move, score, depth
+            if on_iteration is not None:
+                on_iteration(depth, score, move, self.nodes)
+
+        if best_move is None:
+            # Aborted before the first iteration finished: any legal move beats none
+            moves = self.move_orderer.order(SearchBoard(board), 0)
+            best_move = decode_move(moves[0]) if moves else None
+        return best_move, best_score, best_depth
+
+    def aspiration_search(self, board, depth, previous_score, hash_move, search_root):
+        if not self.aspiration or previous_score is None or abs(previous_score) >= MATE_BOUND:
+            return search_root(board, depth, -INFINITY, INFINITY, hash_move)
+
+        # Start from a narrow window around the previous iteration's score and widen the side
+        # that failed, opening it completely once the window gets too wide
+        delta = ASPIRATION_WINDOW
+        alpha, beta = previous_score - delta, previous_score + delta
+        while True:
+            score, move = search_root(board, depth, alpha, beta, hash_move)
+            if alpha < score < beta:
+                return score, move
+            if move is not None:
+                hash_move = move
+            delta *= 4
+            if score <= alpha:
+                alpha = previous_score - delta if delta <= ASPIRATION_LIMIT else -INFINITY
+            else:
+                beta = previous_score + delta if delta <= ASPIRATION_LIMIT else INFINITY
+
+    def search_root(self, board, depth, alpha, beta, hash_move=None):
+        # Every call searches a fresh SearchBoard, so an abort leaves nothing to unwind
+        root = SearchBoard(board)
+        self.evaluator = Evaluator(root, keys=history_keys(board), tables=self.tables)
+        best_score = -INFINITY
+        best_move = 0
+        moves = self.move_orderer.order(root, 0, encode_move(hash_move))
+        if depth == 1 and self.prefetch is not None:
+            self.prefetch(root, moves)
+        for index, move in enumerate(moves):
+            score = self.search_move(root, move, depth, alpha, beta, index == 0)
+            if score > best_score:
+                best_score, best_move = score, move
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                break
+        return best_score, decode_move(best_move)
+
+    def search_move(self, board, move, depth, alpha, beta, first, ply=0):
+        # Score of one move from the side to move's view. With PVS every move after the
+        # first is only proven to be no better than alpha, unless it beats it.
+        self.evaluator.push(board, move)
+        if first or not self.pvs:
+            score = -self.negamax(board, depth - 1, -beta, -alpha, ply + 1)
+        else:
+            score = -self.negamax(board, depth - 1, -alpha - NULL_WINDOW, -alpha, ply + 1)
+            if alpha < score < beta:
+                score = -self.negamax(board, depth - 1, -beta, -alpha, ply + 1)
+        self.evaluator.pop(board)
+        return score
+
+    def reduction(self, quiet, index, depth, in_check):
+        # Plies a move is searched shallower by, unless it turns out to give check
+        return int(self.lmr and quiet and index >= LMR_MIN_MOVES and depth >= LMR_MIN_DEPTH and not in_check)
+
+    def prefetch_leaves(self, board, moves, depth, in_check):
+        # The moves whose child is searched at depth 0, after any reduction, are handed to the
+        # evaluator together so it can score their positions in one batch. A reduced move that
+        # gives check is searched a ply deeper after all, which only wastes its cached score.
+        if depth > 1 + int(self.lmr):
+            return
+        leaves = [move for index, move in enumerate(moves)
+                  if depth - 1 - self.reduction(not move >> PROMOTION_SHIFT and not board.is_capture(move), index,
+                                                depth, in_check) <= 0]
+        if leaves:
+            self.prefetch(board, leaves)
+
+    def negamax(self, board, depth, alpha, beta, ply, allow_null=True):
+        self.nodes += 1
+        if not self.nodes % CHECK_INTERVAL:
+            self.check_abort()
+
+        # Draws by repetition since the last irreversible move, the fifty-move rule or material.
+        # Mate and stalemate come from the node's own move generation further down.
+        halfmove_clock = board.halfmove_clock
+        if halfmove_clock >= 100 or (halfmove_clock >= 4 and self.evaluator.is_repetition(halfmove_clock)):
+            return 0
+        if (board.colors[0] | board.colors[1]).bit_count() <= 4 and board.is_insufficient_material():
+            return 0
+
+        # Decided endgames are scored from the bitbases without searching them
+        known = bitbases.probe(board)
+        if known is not None:
+            return known
+
+        in_check = board.is_check()
+        if depth <= 0:
+            # Stalemates at the horizon are left to the evaluation, but a mate is not
+            if in_check and not board.generate_legal([]):
+                return -MATE_SCORE + ply
+            start = time.perf_counter()
+            # Rounded to the steps the transposition table stores scores in
+            score = quantize(self.evaluate(board, self.evaluator))
+            self.eval_time += time.perf_counter() - start
+            self.evaluations += 1
+            return score
+
+        key = board.key
+        entry = self.transposition_table.probe(key)
+        self.tt_probes += 1
+        hash_move = 0
+        if entry is not None:
+            self.tt_hits += 1
+            entry_depth, flag, value, hash_move = entry
+            value = score_from_tt(value, ply)
+            if entry_depth >= depth:
+                if flag == EXACT:
+                    return value
+                if flag == LOWERBOUND and value >= beta:
+                    return value
+                if flag == UPPERBOUND and value <= alpha:
+                    return value
+
+        # Null move: if passing still fails high, a real move will too
+        if (self.null_move and allow_null and not in_check and depth >= NULL_MOVE_MIN_DEPTH
+                and beta < MATE_BOUND and has_non_pawn_material(board, board.turn)):
+            self.evaluator.push(board, 0)
+            score = -self.negamax(board, depth - 1 - NULL_MOVE_REDUCTION, -beta, -beta + NULL_WINDOW, ply + 1,
+                                  allow_null=False)
+            self.evaluator.pop(board)
+            if score >= beta:
+                return beta if score >= MATE_BOUND else score
+
+        alpha_orig = alpha
+        best_score = -INFINITY
+        best_move = 0
+        start = time.perf_counter()
+        moves = self.move_orderer.order(board, ply, hash_move)
+        self.movegen_time += time.perf_counter() - start
+        if not moves:
+            return -MATE_SCORE + ply if in_check else 0
+        if self.prefetch is not None:
+            self.prefetch_leaves(board, moves, depth, in_check)
+        for index, move in enumerate(moves):
+            quiet = not move >> PROMOTION_SHIFT and not board.is_capture(move)
+            self.evaluator.push(board, move)
+            if index == 0:
+                score = -self.negamax(board, depth - 1, -beta, -alpha, ply + 1)
+            else:
+                # Late quiet moves are searched shallower first and only re-searched at full
+                # depth when they beat alpha
+                reduction = self.reduction(quiet, index, depth, in_check)
+                if reduction and board.is_check():
+                    reduction = 0
+                window = alpha + NULL_WINDOW if self.pvs else beta
+                score = -self.negamax(board, depth - 1 - reduction, -window, -alpha, ply + 1)
+                if reduction and score > alpha:
+                    score = -self.negamax(board, depth - 1, -window, -alpha, ply + 1)
+                if self.pvs and alpha < score < beta:
+                    score = -self.negamax(board, depth - 1, -beta, -alpha, ply + 1)
+            self.evaluator.pop(board)
+
+            if score > best_score:
+                best_score, best_move = score, move
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                self.move_orderer.record_cutoff(board, move, ply, depth, index)
+                break
+
+        if best_score <= alpha_orig:
+            flag = UPPERBOUND
+        elif best_score >= beta:
+            flag = LOWERBOUND
+        else:
+            flag = EXACT
+        self.transposition_table.store(key, depth, flag, score_to_tt(best_score, ply), best_move)
+        return best_score
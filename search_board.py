@@ -0,0 +1,527 @@
+import chess
+import chess.polyglot
+from transposition import decode_move, encode_move
+
+# Moves are ints in transposition.encode_move's layout: from | to << 6 | promotion << 12
+PROMOTION_SHIFT = 12
+PROMOTIONS = (chess.QUEEN, chess.ROOK, chess.BISHOP, chess.KNIGHT)
+
+# Mailbox codes: piece type in the low three bits, white pieces with bit 3 set, 0 for empty
+WHITE_BIT = 8
+
+# Castling rights, in the order of their Polyglot keys
+WHITE_KINGSIDE = 1
+WHITE_QUEENSIDE = 2
+BLACK_KINGSIDE = 4
+BLACK_QUEENSIDE = 8
+
+# Deepest line a board can play out from its root
+MAX_PLY = 256
+
+_random = chess.polyglot.POLYGLOT_RANDOM_ARRAY
+
+# Polyglot keys, so SearchBoard.key equals chess.polyglot.zobrist_hash of the same position
+PIECE_KEYS = [[0] * 64 for _ in range(16)]
+for _piece_type in chess.PIECE_TYPES:
+    for _color in chess.COLORS:
+        for _square in chess.SQUARES:
+            PIECE_KEYS[_piece_type | (WHITE_BIT if _color else 0)][_square] = \
+                _random[64 * ((_piece_type - 1) * 2 + int(_color)) + _square]
+CASTLING_KEYS = [0] * 16
+for _rights in range(16):
+    for _bit in range(4):
+        if _rights & (1 << _bit):
+            CASTLING_KEYS[_rights] ^= _random[768 + _bit]
+EP_KEYS = [_random[772 + chess.square_file(square)] for square in chess.SQUARES]
+TURN_KEY = _random[780]
+
+# Rights that survive a move from or to each square
+CASTLING_MASKS = [15] * 64
+CASTLING_MASKS[chess.E1] = 15 & ~(WHITE_KINGSIDE | WHITE_QUEENSIDE)
+CASTLING_MASKS[chess.H1] = 15 & ~WHITE_KINGSIDE
+CASTLING_MASKS[chess.A1] = 15 & ~WHITE_QUEENSIDE
+CASTLING_MASKS[chess.E8] = 15 & ~(BLACK_KINGSIDE | BLACK_QUEENSIDE)
+CASTLING_MASKS[chess.H8] = 15 & ~BLACK_KINGSIDE
+CASTLING_MASKS[chess.A8] = 15 & ~BLACK_QUEENSIDE
+
+# Rook from and to squares of a castling king's destination
+CASTLING_ROOKS = {chess.G1: (chess.H1, chess.F1), chess.C1: (chess.A1, chess.D1),
+                  chess.G8: (chess.H8, chess.F8), chess.C8: (chess.A8, chess.D8)}
+
+BB_ALL = chess.BB_ALL
+BB_KNIGHT_ATTACKS = chess.BB_KNIGHT_ATTACKS
+BB_KING_ATTACKS = chess.BB_KING_ATTACKS
+BB_PAWN_ATTACKS = chess.BB_PAWN_ATTACKS
+BB_RANK_ATTACKS = chess.BB_RANK_ATTACKS
+BB_FILE_ATTACKS = chess.BB_FILE_ATTACKS
+BB_DIAG_ATTACKS = chess.BB_DIAG_ATTACKS
+BB_RANK_MASKS = chess.BB_RANK_MASKS
+BB_FILE_MASKS = chess.BB_FILE_MASKS
+BB_DIAG_MASKS = chess.BB_DIAG_MASKS
+BB_RAYS = chess.BB_RAYS
+BB_BETWEEN = [[chess.between(a, b) for b in chess.SQUARES] for a in chess.SQUARES]
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = chess.PIECE_TYPES
+
+
+def squares(mask):
+    while mask:
+        square = (mask & -mask).bit_length() - 1
+        yield square
+        mask &= mask - 1
+
+
+class SearchBoard():
+    # Lean position for the inside of a search: piece bitboards plus a mailbox, the Zobrist key
+    # kept up to date move by move, and make/unmake that restores from fixed per-ply undo
+    # slots instead of copying state. Standard chess only; python-chess boards are converted
+    # at the root with from_board and to_board. Like Polyglot, ep_square is only set when a
+    # pawn can actually capture there.
+    __slots__ = ('pieces', 'colors', 'mailbox', 'turn', 'castling', 'ep_square', 'halfmove_clock',
+                 'fullmove_number', 'key', 'ply', 'undo_move', 'undo_captured', 'undo_castling', 'undo_ep',
+                 'undo_halfmove', 'undo_key')
+
+    def __init__(self, board=None):
+        self.pieces = [0] * 7
+        self.colors = [0, 0]
+        self.mailbox = [0] * 64
+        self.ply = 0
+        self.undo_move = [0] * MAX_PLY
+        self.undo_captured = [0] * MAX_PLY
+        self.undo_castling = [0] * MAX_PLY
+        self.undo_ep = [None] * MAX_PLY
+        self.undo_halfmove = [0] * MAX_PLY
+        self.undo_key = [0] * MAX_PLY
+        self.set_board(board if board is not None else chess.Board())
+
+    @classmethod
+    def from_board(cls, board):
+        return cls(board)
+
+    def set_board(self, board):
+        if board.chess960:
+            raise ValueError("SearchBoard only plays standard chess")
+        self.pieces = [0] * 7
+        self.colors = [0, 0]
+        self.mailbox = [0] * 64
+        for square, piece in board.piece_map().items():
+            self.mailbox[square] = piece.piece_type | (WHITE_BIT if piece.color else 0)
+            self.pieces[piece.piece_type] |= 1 << square
+            self.colors[piece.color] |= 1 << square
+        self.turn = board.turn
+        rights = board.clean_castling_rights()
+        self.castling = ((WHITE_KINGSIDE if rights & chess.BB_H1 else 0) | (WHITE_QUEENSIDE if rights & chess.BB_A1 else 0)
+                         | (BLACK_KINGSIDE if rights & chess.BB_H8 else 0) | (BLACK_QUEENSIDE if rights & chess.BB_A8 else 0))
+        ep_square = board.ep_square
+        if ep_square is not None and not (BB_PAWN_ATTACKS[not board.turn][ep_square]
+                                          & board.pawns & board.occupied_co[board.turn]):
+            ep_square = None
+        self.ep_square = ep_square
+        self.halfmove_clock = board.halfmove_clock
+        self.fullmove_number = board.fullmove_number
+        self.ply = 0
+        self.key = chess.polyglot.zobrist_hash(board)
+
+    def to_board(self):
+        board = chess.Board.empty()
+        for square, code in enumerate(self.mailbox):
+            if code:
+                board.set_piece_at(square, chess.Piece(code & 7, bool(code & WHITE_BIT)))
+        board.turn = self.turn
+        board.castling_rights = ((chess.BB_H1 if self.castling & WHITE_KINGSIDE else 0)
+                                 | (chess.BB_A1 if self.castling & WHITE_QUEENSIDE else 0)
+                                 | (chess.BB_H8 if self.castling & BLACK_KINGSIDE else 0)
+                                 | (chess.BB_A8 if self.castling & BLACK_QUEENSIDE else 0))
+        board.ep_square = self.ep_square
+        board.halfmove_clock = self.halfmove_clock
+        board.fullmove_number = self.fullmove_number
+        return board
+
+    # The python-chess names the evaluation functions read, so they score either kind of board
+    @property
+    def occupied_co(self):
+        return self.colors
+
+    @property
+    def occupied(self):
+        return self.colors[0] | self.colors[1]
+
+    @property
+    def pawns(self):
+        return self.pieces[PAWN]
+
+    @property
+    def knights(self):
+        return self.pieces[KNIGHT]
+
+    @property
+    def bishops(self):
+        return self.pieces[BISHOP]
+
+    @property
+    def rooks(self):
+        return self.pieces[ROOK]
+
+    @property
+    def queens(self):
+        return self.pieces[QUEEN]
+
+    @property
+    def kings(self):
+        return self.pieces[KING]
+
+    def pieces_mask(self, piece_type, color):
+        return self.pieces[piece_type] & self.colors[color]
+
+    def attacks_mask(self, square):
+        code = self.mailbox[square]
+        piece_type = code & 7
+        if piece_type == PAWN:
+            return BB_PAWN_ATTACKS[code >> 3][square]
+        if piece_type == KNIGHT:
+            return BB_KNIGHT_ATTACKS[square]
+        if piece_type == KING:
+            return BB_KING_ATTACKS[square]
+        occupied = self.colors[0] | self.colors[1]
+        attacks = 0
+        if piece_type != ROOK:
+            attacks = BB_DIAG_ATTACKS[square][BB_DIAG_MASKS[square] & occupied]
+        if piece_type != BISHOP:
+            attacks |= (BB_RANK_ATTACKS[square][BB_RANK_MASKS[square] & occupied]
+                        | BB_FILE_ATTACKS[square][BB_FILE_MASKS[square] & occupied])
+        return attacks
+
+    def is_capture(self, move):
+        to_square = (move >> 6) & 63
+        return bool(self.mailbox[to_square]) or (to_square == self.ep_square
+                                                 and self.mailbox[move & 63] & 7 == PAWN)
+
+    def is_insufficient_material(self):
+        # Neither side can mate, by python-chess's rules
+        pieces = self.pieces
+        if pieces[PAWN] | pieces[ROOK] | pieces[QUEEN]:
+            return False
+        for color in (True, False):
+            ours = self.colors[color]
+            if ours & pieces[KNIGHT]:
+                if ours.bit_count() > 2 or self.colors[not color] & ~pieces[KING] & ~pieces[QUEEN]:
+                    return False
+            elif ours & pieces[BISHOP]:
+                bishops = pieces[BISHOP]
+                if (bishops & chess.BB_DARK_SQUARES and bishops & chess.BB_LIGHT_SQUARES) or pieces[KNIGHT]:
+                    return False
+        return True
+
+    def attacked_by(self, color, square, occupied=None):
+        # With occupied given, sliders see through the squares left out of it
+        pieces = self.pieces
+        them = self.colors[color]
+        if BB_KNIGHT_ATTACKS[square] & pieces[KNIGHT] & them:
+            return True
+        if BB_KING_ATTACKS[square] & pieces[KING] & them:
+            return True
+        if BB_PAWN_ATTACKS[not color][square] & pieces[PAWN] & them:
+            return True
+        if occupied is None:
+            occupied = self.colors[0] | self.colors[1]
+        queens = pieces[QUEEN]
+        if (BB_RANK_ATTACKS[square][BB_RANK_MASKS[square] & occupied]
+                | BB_FILE_ATTACKS[square][BB_FILE_MASKS[square] & occupied]) & (pieces[ROOK] | queens) & them:
+            return True
+        return bool(BB_DIAG_ATTACKS[square][BB_DIAG_MASKS[square] & occupied] & (pieces[BISHOP] | queens) & them)
+
+    def king_square(self, color):
+        return (self.pieces[KING] & self.colors[color]).bit_length() - 1
+
+    def is_check(self):
+        return self.attacked_by(not self.turn, self.king_square(self.turn))
+
+    def pinned(self, color, king):
+        # Pieces of color that are the only blocker between their king and an enemy slider
+        pieces = self.pieces
+        them = self.colors[not color]
+        occupied = self.colors[0] | self.colors[1]
+        snipers = ((BB_RANK_ATTACKS[king][0] | BB_FILE_ATTACKS[king][0]) & (pieces[ROOK] | pieces[QUEEN]) & them
+                   | BB_DIAG_ATTACKS[king][0] & (pieces[BISHOP] | pieces[QUEEN]) & them)
+        pinned = 0
+        for sniper in squares(snipers):
+            blockers = BB_BETWEEN[king][sniper] & occupied
+            if blockers and not blockers & (blockers - 1):
+                pinned |= blockers
+        return pinned & self.colors[color]
+
+    def generate_pseudo_legal(self, moves):
+        # Appends every pseudo-legal move of the side to move; castling already avoids check
+        pieces = self.pieces
+        turn = self.turn
+        us = self.colors[turn]
+        them = self.colors[not turn]
+        occupied = us | them
+        empty = ~occupied & BB_ALL
+        append = moves.append
+
+        for from_square in squares(pieces[KNIGHT] & us):
+            for to_square in squares(BB_KNIGHT_ATTACKS[from_square] & ~us):
+                append(from_square | to_square << 6)
+        for from_square in squares((pieces[BISHOP] | pieces[QUEEN]) & us):
+            for to_square in squares(BB_DIAG_ATTACKS[from_square][BB_DIAG_MASKS[from_square] & occupied] & ~us):
+                append(from_square | to_square << 6)
+        for from_square in squares((pieces[ROOK] | pieces[QUEEN]) & us):
+            targets = (BB_RANK_ATTACKS[from_square][BB_RANK_MASKS[from_square] & occupied]
+                       | BB_FILE_ATTACKS[from_square][BB_FILE_MASKS[from_square] & occupied])
+            for to_square in squares(targets & ~us):
+                append(from_square | to_square << 6)
+        king = (pieces[KING] & us).bit_length() - 1
+        for to_square in squares(BB_KING_ATTACKS[king] & ~us):
+            append(king | to_square << 6)
+
+        if turn:
+            rights = self.castling
+            if (rights & WHITE_KINGSIDE and not occupied & (chess.BB_F1 | chess.BB_G1)
+                    and not self.attacked_by(False, chess.E1) and not self.attacked_by(False, chess.F1)
+                    and not self.attacked_by(False, chess.G1)):
+                append(chess.E1 | chess.G1 << 6)
+            if (rights & WHITE_QUEENSIDE and not occupied & (chess.BB_B1 | chess.BB_C1 | chess.BB_D1)
+                    and not self.attacked_by(False, chess.E1) and not self.attacked_by(False, chess.D1)
+                    and not self.attacked_by(False, chess.C1)):
+                append(chess.E1 | chess.C1 << 6)
+        else:
+            rights = self.castling
+            if (rights & BLACK_KINGSIDE and not occupied & (chess.BB_F8 | chess.BB_G8)
+                    and not self.attacked_by(True, chess.E8) and not self.attacked_by(True, chess.F8)
+                    and not self.attacked_by(True, chess.G8)):
+                append(chess.E8 | chess.G8 << 6)
+            if (rights & BLACK_QUEENSIDE and not occupied & (chess.BB_B8 | chess.BB_C8 | chess.BB_D8)
+                    and not self.attacked_by(True, chess.E8) and not self.attacked_by(True, chess.D8)
+                    and not self.attacked_by(True, chess.C8)):
+                append(chess.E8 | chess.C8 << 6)
+
+        # Pawns by target set: step is the distance a pawn moves forward
+        pawns = pieces[PAWN] & us
+        if turn:
+            step = 8
+            single = (pawns << 8) & empty
+            double = ((single & chess.BB_RANK_3) << 8) & empty
+            last_rank = chess.BB_RANK_8
+        else:
+            step = -8
+            single = (pawns >> 8) & empty
+            double = ((single & chess.BB_RANK_6) >> 8) & empty
+            last_rank = chess.BB_RANK_1
+        targets = them
+        if self.ep_square is not None:
+            targets |= 1 << self.ep_square
+        for to_square in squares(single):
+            self.append_pawn_move(append, to_square - step, to_square, last_rank)
+        for to_square in squares(double):
+            append(to_square - 2 * step | to_square << 6)
+        for from_square in squares(pawns):
+            for to_square in squares(BB_PAWN_ATTACKS[turn][from_square] & targets):
+                self.append_pawn_move(append, from_square, to_square, last_rank)
+
+    @staticmethod
+    def append_pawn_move(append, from_square, to_square, last_rank):
+        if last_rank >> to_square & 1:
+            for promotion in PROMOTIONS:
+                append(from_square | to_square << 6 | promotion << PROMOTION_SHIFT)
+        else:
+            append(from_square | to_square << 6)
+
+    def generate_legal(self, moves):
+        # Filters the pseudo-legal moves in place. Out of check only king moves, en passant and
+        # pinned pieces need a closer look; in check every move is tried on the board.
+        start = len(moves)
+        self.generate_pseudo_legal(moves)
+        turn = self.turn
+        king = self.king_square(turn)
+        write = start
+        if self.attacked_by(not turn, king):
+            for index in range(start, len(moves)):
+                move = moves[index]
+                if self.is_safe(move):
+                    moves[write] = move
+                    write += 1
+        else:
+            pinned = self.pinned(turn, king)
+            without_king = (self.colors[0] | self.colors[1]) & ~(1 << king)
+            ep_square = self.ep_square
+            mailbox = self.mailbox
+            for index in range(start, len(moves)):
+                move = moves[index]
+                from_square = move & 63
+                to_square = (move >> 6) & 63
+                if from_square == king:
+                    legal = not self.attacked_by(not turn, to_square, without_king)
+                elif to_square == ep_square and mailbox[from_square] & 7 == PAWN:
+                    legal = self.is_safe(move)
+                elif pinned >> from_square & 1:
+                    legal = BB_RAYS[king][from_square] >> to_square & 1
+                else:
+                    legal = True
+                if legal:
+                    moves[write] = move
+                    write += 1
+        del moves[write:]
+        return moves
+
+    def is_safe(self, move):
+        # Whether the mover's king is out of check after the move
+        mover = self.turn
+        self.make(move)
+        safe = not self.attacked_by(not mover, self.king_square(mover))
+        self.unmake()
+        return safe
+
+    def legal_moves(self):
+        return [decode_move(move) for move in self.generate_legal([])]
+
+    def remove(self, square):
+        code = self.mailbox[square]
+        bit = 1 << square
+        self.pieces[code & 7] ^= bit
+        self.colors[code >> 3] ^= bit
+        self.mailbox[square] = 0
+        self.key ^= PIECE_KEYS[code][square]
+        return code
+
+    def put(self, square, code):
+        bit = 1 << square
+        self.pieces[code & 7] |= bit
+        self.colors[code >> 3] |= bit
+        self.mailbox[square] = code
+        self.key ^= PIECE_KEYS[code][square]
+
+    def make(self, move):
+        ply = self.ply
+        self.undo_move[ply] = move
+        self.undo_castling[ply] = self.castling
+        self.undo_ep[ply] = self.ep_square
+        self.undo_halfmove[ply] = self.halfmove_clock
+        self.undo_key[ply] = self.key
+        self.ply = ply + 1
+
+        from_square = move & 63
+        to_square = (move >> 6) & 63
+        promotion = move >> PROMOTION_SHIFT
+        turn = self.turn
+        mailbox = self.mailbox
+
+        key = self.key ^ CASTLING_KEYS[self.castling] ^ TURN_KEY
+        if self.ep_square is not None:
+            key ^= EP_KEYS[self.ep_square]
+        self.key = key
+
+        code = self.remove(from_square)
+        piece_type = code & 7
+        if piece_type == PAWN and to_square == self.ep_square:
+            captured = self.remove(to_square ^ 8)
+        elif mailbox[to_square]:
+            captured = self.remove(to_square)
+        else:
+            captured = 0
+        self.undo_captured[ply] = captured
+        self.put(to_square, promotion | (code & WHITE_BIT) if promotion else code)
+
+        if piece_type == KING and abs(to_square - from_square) == 2:
+            rook_from, rook_to = CASTLING_ROOKS[to_square]
+            self.put(rook_to, self.remove(rook_from))
+
+        self.castling &= CASTLING_MASKS[from_square] & CASTLING_MASKS[to_square]
+        self.ep_square = None
+        if piece_type == PAWN:
+            self.halfmove_clock = 0
+            if abs(to_square - from_square) == 16:
+                # Only a capturable en passant square counts, as in the Polyglot key
+                ep_square = (from_square + to_square) >> 1
+                if BB_PAWN_ATTACKS[turn][ep_square] & self.pieces[PAWN] & self.colors[not turn]:
+                    self.ep_square = ep_square
+                    self.key ^= EP_KEYS[ep_square]
+        elif captured:
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        if not turn:
+            self.fullmove_number += 1
+        self.turn = not turn
+        self.key ^= CASTLING_KEYS[self.castling]
+
+    def unmake(self):
+        ply = self.ply - 1
+        self.ply = ply
+        move = self.undo_move[ply]
+        from_square = move & 63
+        to_square = (move >> 6) & 63
+        self.turn = turn = not self.turn
+        if not turn:
+            self.fullmove_number -= 1
+        ep_square = self.undo_ep[ply]
+
+        code = self.remove(to_square)
+        if move >> PROMOTION_SHIFT:
+            code = PAWN | (code & WHITE_BIT)
+        self.put(from_square, code)
+        if code & 7 == KING and abs(to_square - from_square) == 2:
+            rook_from, rook_to = CASTLING_ROOKS[to_square]
+            self.put(rook_from, self.remove(rook_to))
+        captured = self.undo_captured[ply]
+        if captured:
+            if code & 7 == PAWN and to_square == ep_square:
+                self.put(to_square ^ 8, captured)
+            else:
+                self.put(to_square, captured)
+
+        self.castling = self.undo_castling[ply]
+        self.ep_square = ep_square
+        self.halfmove_clock = self.undo_halfmove[ply]
+        self.key = self.undo_key[ply]
+
+    def make_null(self):
+        # Passes the move, as python-chess pushes chess.Move.null()
+        ply = self.ply
+        self.undo_move[ply] = 0
+        self.undo_castling[ply] = self.castling
+        self.undo_ep[ply] = self.ep_square
+        self.undo_halfmove[ply] = self.halfmove_clock
+        self.undo_key[ply] = self.key
+        self.ply = ply + 1
+        key = self.key ^ TURN_KEY
+        if self.ep_square is not None:
+            key ^= EP_KEYS[self.ep_square]
+            self.ep_square = None
+        self.key = key
+        self.halfmove_clock += 1
+        if not self.turn:
+            self.fullmove_number += 1
+        self.turn = not self.turn
+
+    def unmake_null(self):
+        ply = self.ply - 1
+        self.ply = ply
+        self.turn = not self.turn
+        if not self.turn:
+            self.fullmove_number -= 1
+        self.ep_square = self.undo_ep[ply]
+        self.halfmove_clock = self.undo_halfmove[ply]
+        self.key = self.undo_key[ply]
+
+    def push(self, move):
+        self.make(encode_move(move))
+
+    def pop(self):
+        self.unmake()
+
+    def perft(self, depth, buffers=None):
+        # One move list per remaining depth, reused at every node of that depth
+        if buffers is None:
+            buffers = [[] for _ in range(depth + 1)]
+        moves = buffers[depth]
+        del moves[:]
+        self.generate_legal(moves)
+        if depth <= 1:
+            return len(moves) if depth == 1 else 1
+        nodes = 0
+        for move in moves:
+            self.make(move)
+            nodes += self.perft(depth - 1, buffers)
+            self.unmake()
+        return nodes
+
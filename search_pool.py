@@ -0,0 +1,97 @@
+import importlib
+import multiprocessing
+import os
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+
+from transposition import DEFAULT_SIZE_MB, TranspositionTable, SharedTranspositionTable
+
+# Best root score found so far in the current iteration, shared by every search process
+best_score = None
+
+# Transposition table of the pool this process searches for
+transposition_table = None
+
+# Set to make every search process abort its current task
+stop_event = None
+
+
+# Engine modules every search process imports when it starts, rather than on its first task
+PRELOAD_MODULES = ('algorithm1',)
+
+
+def init_worker(shared_best_score, shared_stop_event, table_name, table_size_mb, preload=PRELOAD_MODULES):
+    global best_score, stop_event, transposition_table
+    best_score = shared_best_score
+    stop_event = shared_stop_event
+    transposition_table = SharedTranspositionTable(table_size_mb, name=table_name)
+    for module in preload:
+        importlib.import_module(module)
+
+
+def warm_up():
+    return True
+
+
+def raise_best_score(score):
+    with best_score.get_lock():
+        if score > best_score.value:
+            best_score.value = score
+
+
+class SearchPool():
+    # Long-lived pool of search processes, created once per game. With workers=0 the
+    # tasks run in the calling process, which keeps the same interface for serial search.
+    def __init__(self, workers=None, hash_mb=DEFAULT_SIZE_MB, preload=PRELOAD_MODULES):
+        self.best_score = multiprocessing.Value('d', float('-inf'))
+        self.stop_event = multiprocessing.Event()
+        if workers == 0:
+            self.workers = 0
+            self.executor = None
+            self.transposition_table = TranspositionTable(hash_mb)
+        else:
+            # Every worker attaches to one table that outlives each individual search
+            self.transposition_table = SharedTranspositionTable(hash_mb)
+            self.workers = workers or os.cpu_count() or 1
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker,
+                                                initargs=(self.best_score, self.stop_event,
+                                                          self.transposition_table.name, hash_mb, preload))
+            # Start every process now, with the engine imported, instead of during the first move
+            wait([self.executor.submit(warm_up) for _ in range(self.workers)])
+        self.activate()
+
+    def activate(self):
+        # The calling process orders the root moves and may search them itself. With several
+        # pools in one process, the last one activated is the one searches run on.
+        global best_score, stop_event, transposition_table
+        best_score = self.best_score
+        stop_event = self.stop_event
+        transposition_table = self.transposition_table
+
+    def new_search(self):
+        self.stop_event.clear()
+        self.transposition_table.new_search()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def reset_best_score(self, value=float('-inf')):
+        with self.best_score.get_lock():
+            self.best_score.value = value
+
+    def submit(self, fn, *args):
+        if self.executor is not None:
+            return self.executor.submit(fn, *args)
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.transposition_table.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
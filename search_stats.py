@@ -0,0 +1,94 @@
+import cProfile
+import io
+import os
+import pstats
+import time
+
+# Counters every searcher keeps, in the order Search.counters() reports them
+COUNTERS = ('nodes', 'evaluations', 'cutoffs', 'first_move_cutoffs', 'tt_probes', 'tt_hits', 'pawn_probes',
+            'pawn_hits', 'eval_time', 'movegen_time')
+
+
+def counter_delta(after, before):
+    return tuple(new - old for new, old in zip(after, before))
+
+
+class SearchStats():
+    # What one search did, summed over every process that took part, with the depth, score,
+    # PV and node count of each completed iteration
+    def __init__(self):
+        for name in COUNTERS:
+            setattr(self, name, 0)
+        self.start_time = time.perf_counter()
+        self.elapsed = 0.0
+        self.iterations = []
+        self.best_move = None
+        self.score = None
+        self.depth = 0
+        self.profile = None
+
+    def add(self, counters):
+        for name, value in zip(COUNTERS, counters):
+            setattr(self, name, getattr(self, name) + value)
+
+    def record_iteration(self, depth, score, pv):
+        self.elapsed = time.perf_counter() - self.start_time
+        self.iterations.append({'depth': depth, 'score': score, 'pv': [move.uci() for move in pv],
+                                'nodes': self.nodes, 'time': self.elapsed})
+
+    def finish(self, best_move, score, depth):
+        self.elapsed = time.perf_counter() - self.start_time
+        self.best_move = best_move
+        self.score = score
+        self.depth = depth
+
+    def first_move_cutoff_rate(self):
+        return self.first_move_cutoffs / self.cutoffs if self.cutoffs else 0.0
+
+    def tt_hit_rate(self):
+        return self.tt_hits / self.tt_probes if self.tt_probes else 0.0
+
+    def pawn_hit_rate(self):
+        return self.pawn_hits / self.pawn_probes if self.pawn_probes else 0.0
+
+    def nps(self):
+        return self.nodes / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self):
+        stats = {name: getattr(self, name) for name in COUNTERS}
+        stats.update(best_move=self.best_move.uci() if self.best_move else None, score=self.score,
+                     depth=self.depth, elapsed=self.elapsed, nps=self.nps(), iterations=self.iterations)
+        return stats
+
+    def summary(self):
+        score = self.score / 100 if self.score is not None else 0.0
+        pv = ' '.join(self.iterations[-1]['pv']) if self.iterations else ''
+        return (f"Depth: {self.depth}, Best Move: {self.best_move}, Score: {score: .3f}, Nodes: {self.nodes}, "
+                f"NPS: {self.nps():.0f}, Evaluations: {self.evaluations}, "
+                f"First-move cutoffs: {self.first_move_cutoff_rate():.1%}, TT hits: {self.tt_hit_rate():.1%}, "
+                f"Pawn hash hits: {self.pawn_hit_rate():.1%}, "
+                f"Eval time: {self.eval_time:.3f}s, Movegen time: {self.movegen_time:.3f}s, PV: {pv}")
+
+
+class Profiler():
+    # Opt-in cProfile hook. Entering and leaving it again keeps adding to the same profile,
+    # which is written to directory/name.prof every time it is left.
+    def __init__(self, directory, name):
+        self.directory = directory
+        self.name = name
+        self.profile = cProfile.Profile()
+
+    def __enter__(self):
+        self.profile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profile.disable()
+        os.makedirs(self.directory, exist_ok=True)
+        self.profile.dump_stats(os.path.join(self.directory, f'{self.name}.prof'))
+
+    def summary(self, limit=20):
+        # The hottest functions by cumulative time, as printed by pstats
+        output = io.StringIO()
+        pstats.Stats(self.profile, stream=output).sort_stats('cumulative').print_stats(limit)
+        return output.getvalue()
@@ -0,0 +1,52 @@
+import chess
+import pytest
+import bitbases
+from bitbases import KNOWN_WIN_SCORE
+from search_board import SearchBoard
+
+
+@pytest.fixture(scope='module')
+def tables(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('bitbases')
+    bitbases.build(directory)
+    saved = dict(bitbases._tables)
+    bitbases._tables.clear()
+    for name in bitbases.TABLE_PIECES:
+        bitbases.load(name, directory)
+    yield
+    bitbases._tables.clear()
+    bitbases._tables.update(saved)
+
+
+def probe(fen):
+    return bitbases.probe(SearchBoard(chess.Board(fen)))
+
+
+def test_kpk(tables):
+    # The defending king in front of a rook pawn holds the draw whoever moves
+    assert probe('k7/8/8/K7/P7/8/8/8 w - - 0 1') == 0
+    assert probe('k7/8/8/K7/P7/8/8/8 b - - 0 1') == 0
+    assert probe('1k6/8/8/8/P1K5/8/8/8 w - - 0 1') == 0
+    # The king on the sixth rank in front of its pawn wins whoever moves
+    assert probe('4k3/8/4K3/4P3/8/8/8/8 w - - 0 1') >= KNOWN_WIN_SCORE
+    assert probe('4k3/8/4K3/4P3/8/8/8/8 b - - 0 1') <= -KNOWN_WIN_SCORE
+    # The same for black, with the board mirrored
+    assert probe('8/8/8/8/4p3/4k3/8/4K3 b - - 0 1') >= KNOWN_WIN_SCORE
+    # Only the side to move decides whether the pawn falls
+    assert probe('8/8/8/8/4P3/3k4/8/K7 w - - 0 1') >= KNOWN_WIN_SCORE
+    assert probe('8/8/8/8/4P3/3k4/8/K7 b - - 0 1') == 0
+
+
+def test_kqk_and_krk_are_won_unless_the_piece_hangs(tables):
+    assert probe('4k3/8/8/8/3Q4/8/8/4K3 w - - 0 1') >= KNOWN_WIN_SCORE
+    assert probe('4k3/8/8/8/3Q4/8/8/4K3 b - - 0 1') <= -KNOWN_WIN_SCORE
+    assert probe('4k3/8/8/8/8/8/8/R3K3 b - - 0 1') <= -KNOWN_WIN_SCORE
+    assert probe('4K3/8/8/8/8/8/8/r3k3 w - - 0 1') <= -KNOWN_WIN_SCORE
+    assert probe('4K3/8/8/8/8/8/8/r3k3 b - - 0 1') >= KNOWN_WIN_SCORE
+    assert probe('8/8/8/8/8/8/r7/1K5k w - - 0 1') == 0
+    assert probe('8/8/8/8/8/8/r7/1K5k b - - 0 1') >= KNOWN_WIN_SCORE
+
+
+def test_other_material_is_not_covered(tables):
+    assert probe('4k3/8/8/8/8/8/8/2N1K3 w - - 0 1') is None
+    assert probe('4k3/8/8/8/8/8/4P3/2N1K3 w - - 0 1') is None
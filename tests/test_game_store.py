@@ -0,0 +1,66 @@
+import multiprocessing
+
+import chess
+from game_store import GameStore, import_csv_games
+
+MOVES = ['e4', 'e5', 'Nf3', 'Nc6', 'Bc4', 'Bc5', 'O-O', 'Nf6', 'd4', 'exd4', 'e5', 'd5']
+
+
+def san_to_moves(sans):
+    board = chess.Board()
+    return [board.push_san(san) for san in sans]
+
+
+def test_round_trip(tmp_path):
+    promotion = [chess.Move.from_uci(uci) for uci in ('a2a4', 'h7h5', 'a4a5', 'h5h4', 'a5a6', 'h4h3',
+                                                        'a6b7', 'h3g2', 'b7a8q', 'g2h1n')]
+    with GameStore(tmp_path) as store:
+        first = store.append(san_to_moves(MOVES), white='algorithm1', black='human', result='*', saved=1.0)
+        second = store.append(promotion, result='1-0')
+        empty = store.append([])
+    assert (first, second, empty) == (0, 1, 2)
+
+    with GameStore(tmp_path) as store:
+        assert len(store) == 3
+        game = store.get(0)
+        assert game.moves == san_to_moves(MOVES)
+        assert game.metadata == {'white': 'algorithm1', 'black': 'human', 'result': '*', 'saved': 1.0}
+        assert store[1].moves == promotion
+        assert store[2].moves == []
+        assert [game.game_id for game in store.games(1)] == [1, 2]
+        assert [game.moves for game in store] == [san_to_moves(MOVES), promotion, []]
+
+
+def test_import_csv_games_once(tmp_path):
+    legacy = tmp_path / 'pastGames'
+    legacy.mkdir()
+    for name in ('game1.csv', 'game2.csv'):
+        (legacy / name).write_text('\n'.join(MOVES) + '\n')
+    with GameStore(tmp_path / 'games') as store:
+        assert import_csv_games(store, legacy) == 2
+        assert import_csv_games(store, legacy) == 0
+        assert len(store) == 2
+        assert {game.metadata['source'] for game in store} == {'game1.csv', 'game2.csv'}
+        assert store[0].moves == san_to_moves(MOVES)
+
+
+def append_games(directory, worker, count):
+    with GameStore(directory) as store:
+        for number in range(count):
+            store.append(san_to_moves(MOVES[:number % len(MOVES) + 1]), worker=worker, number=number)
+
+
+def test_concurrent_appends(tmp_path):
+    processes = [multiprocessing.Process(target=append_games, args=(str(tmp_path), worker, 50))
+                 for worker in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    with GameStore(tmp_path) as store:
+        games = list(store)
+    assert len(games) == 200
+    for game in games:
+        assert game.moves == san_to_moves(MOVES[:game.metadata['number'] % len(MOVES) + 1])
+    assert sorted((game.metadata['worker'], game.metadata['number']) for game in games) == \
+        [(worker, number) for worker in range(4) for number in range(50)]
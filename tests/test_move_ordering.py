@@ -0,0 +1,49 @@
+import chess
+from move_ordering import HISTORY_LIMIT, MoveOrderer
+from search_board import SearchBoard
+from transposition import encode_move
+
+# White's pawn and rook can both take the queen on d5, the knight can take the pawn on e5
+FEN = 'k7/8/8/3qp3/2P5/5N2/8/K2R4 w - - 0 1'
+
+
+def move(uci):
+    return encode_move(chess.Move.from_uci(uci))
+
+
+def test_hash_move_then_captures_then_killers_then_history():
+    board = SearchBoard(chess.Board(FEN))
+    orderer = MoveOrderer()
+    orderer.killers_at(2)[:] = [move('f3g5'), move('d1d2')]
+    orderer.history[move('a1b1') & 4095] = 500
+    orderer.history[move('a1a2') & 4095] = 100
+    moves = orderer.order(board, 2, move('a1b2'))
+    assert moves[:7] == [move(uci) for uci in ('a1b2', 'c4d5', 'd1d5', 'f3e5', 'f3g5', 'd1d2', 'a1b1')]
+    assert moves[7] == move('a1a2')
+    assert sorted(moves) == sorted(board.generate_legal([]))
+    # Killers belong to their ply
+    assert orderer.order(board, 3)[3] == move('a1b1')
+
+
+def test_cutoffs_update_killers_and_history_for_quiet_moves_only():
+    board = SearchBoard(chess.Board(FEN))
+    orderer = MoveOrderer()
+    orderer.record_cutoff(board, move('f3g5'), 1, 3, 0)
+    orderer.record_cutoff(board, move('d1d2'), 1, 2, 4)
+    orderer.record_cutoff(board, move('d1d2'), 1, 2, 1)
+    assert orderer.killers_at(1) == [move('d1d2'), move('f3g5')]
+    assert orderer.history[move('f3g5') & 4095] == 9
+    assert orderer.history[move('d1d2') & 4095] == 8
+
+    orderer.record_cutoff(board, move('c4d5'), 1, 5, 0)
+    assert orderer.killers_at(1) == [move('d1d2'), move('f3g5')]
+    assert orderer.history[move('c4d5') & 4095] == 0
+    assert (orderer.cutoffs, orderer.first_move_cutoff_rate()) == (4, 0.5)
+
+    orderer.history[move('f3g5') & 4095] = HISTORY_LIMIT
+    orderer.record_cutoff(board, move('f3g5'), 1, 10, 0)
+    assert orderer.history[move('f3g5') & 4095] == HISTORY_LIMIT
+    orderer.new_search()
+    assert orderer.killers_at(1) == [0, 0]
+    assert orderer.history[move('f3g5') & 4095] == HISTORY_LIMIT // 2
+    assert orderer.cutoffs == 0
@@ -0,0 +1,23 @@
+import chess
+from position_index import PositionIndex
+
+MOVES = ['e4', 'e5', 'Nf3', 'Nc6', 'Bc4', 'Bc5']
+
+
+def test_build_imports_legacy_games_and_update_needs_a_build(tmp_path):
+    legacy = tmp_path / 'pastGames'
+    legacy.mkdir()
+    (legacy / 'game1.csv').write_text('\n'.join(MOVES) + '\n')
+    empty_eco = tmp_path / 'eco.pgn'
+    empty_eco.write_text('')
+    index = PositionIndex(tmp_path / 'index')
+
+    assert index.update(tmp_path / 'games') == 0
+    assert not index.built()
+
+    assert index.build(tmp_path / 'games', empty_eco, legacy) == 1
+    assert index.built()
+    assert index.opening_stats(chess.Board()) == {chess.Move.from_uci('e2e4'): (1, 0, 0, 0)}
+    # The CSV game is only imported into the store once, however often the index is rebuilt
+    assert index.build(tmp_path / 'games', empty_eco, legacy) == 1
+    assert len(index) == len(MOVES) + 1
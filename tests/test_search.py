@@ -0,0 +1,100 @@
+import random
+
+import chess
+import chess.polyglot
+import algorithm1
+import Algorithm2
+from evaluator import HAND_SET_TABLES, Evaluator, history_keys
+from search import INFINITY, MATE_SCORE, Search
+from search_board import SearchBoard
+from search_pool import SearchPool
+from transposition import TranspositionTable, decode_move, encode_move
+
+SHUFFLE = ['g1f3', 'g8f6', 'f3g1', 'f6g8']
+
+
+def searcher_at(board):
+    searcher = Search(Algorithm2.leaf_evaluation, TranspositionTable(1), tables=HAND_SET_TABLES)
+    root = SearchBoard(board)
+    searcher.evaluator = Evaluator(root, keys=history_keys(board), tables=HAND_SET_TABLES)
+    return searcher, root
+
+
+def test_keys_match_polyglot_over_random_games_and_null_moves():
+    generator = random.Random(11)
+    for _ in range(30):
+        reference = chess.Board()
+        board = SearchBoard(reference)
+        evaluator = Evaluator(board)
+        while not reference.is_game_over() and reference.ply() < 100:
+            if not reference.is_check() and generator.random() < 0.1:
+                move = 0
+                reference.push(chess.Move.null())
+            else:
+                move = generator.choice(board.generate_legal([]))
+                reference.push(decode_move(move))
+            evaluator.push(board, move)
+            assert board.key == evaluator.keys[-1] == chess.polyglot.zobrist_hash(reference)
+        while reference.move_stack:
+            evaluator.pop(board)
+            reference.pop()
+            assert board.key == evaluator.keys[-1] == chess.polyglot.zobrist_hash(reference)
+        assert evaluator.keys == [chess.polyglot.zobrist_hash(chess.Board())]
+
+
+def test_repetition_is_found_since_the_last_irreversible_move():
+    board = chess.Board()
+    root = SearchBoard(board)
+    evaluator = Evaluator(root)
+    for uci in SHUFFLE[:3]:
+        evaluator.push(root, encode_move(chess.Move.from_uci(uci)))
+        assert not evaluator.is_repetition(root.halfmove_clock)
+    evaluator.push(root, encode_move(chess.Move.from_uci(SHUFFLE[3])))
+    assert evaluator.is_repetition(root.halfmove_clock)
+    # A pawn move resets the clock, so the earlier positions can no longer repeat
+    assert not evaluator.is_repetition(0)
+
+
+def test_repetition_scores_a_won_position_as_a_draw():
+    board = chess.Board('4k3/8/8/8/8/8/8/QN2K2n w - - 0 1')
+    for uci in ('b1c3', 'h1g3', 'c3b1', 'g3h1'):
+        board.push_uci(uci)
+    searcher, root = searcher_at(board)
+    assert searcher.negamax(root, 2, -INFINITY, INFINITY, 0) == 0
+
+
+def test_fifty_move_rule_scores_a_draw():
+    searcher, root = searcher_at(chess.Board('4k3/8/8/8/8/8/8/Q3K3 w - - 100 80'))
+    assert searcher.negamax(root, 2, -INFINITY, INFINITY, 0) == 0
+    searcher, root = searcher_at(chess.Board('4k3/8/8/8/8/8/8/Q3K3 w - - 98 80'))
+    assert searcher.negamax(root, 1, -INFINITY, INFINITY, 0) > 0
+
+
+def test_mate_and_stalemate_come_from_move_generation():
+    searcher, root = searcher_at(chess.Board('R5k1/5ppp/8/8/8/8/5PPP/6K1 b - - 1 1'))
+    assert searcher.negamax(root, 1, -INFINITY, INFINITY, 0) == -MATE_SCORE
+    searcher, root = searcher_at(chess.Board('7k/5Q2/6K1/8/8/8/8/8 b - - 0 1'))
+    assert searcher.negamax(root, 1, -INFINITY, INFINITY, 0) == 0
+    searcher = Search(Algorithm2.leaf_evaluation, TranspositionTable(1), tables=HAND_SET_TABLES)
+    assert searcher.search_root(chess.Board('6k1/5ppp/8/8/8/8/5PPP/R5K1 w - - 0 1'), 2, -INFINITY, INFINITY) \
+        == (MATE_SCORE - 1, chess.Move.from_uci('a1a8'))
+
+
+def test_root_tasks_get_the_game_keys():
+    # Black's knight returning to g8 repeats the position, which only the handed-over keys show
+    board = chess.Board()
+    for uci in SHUFFLE + SHUFFLE[:3]:
+        board.push_uci(uci)
+    move = encode_move(chess.Move.from_uci('f6g8'))
+    pool = SearchPool(workers=0)
+    try:
+        pool.activate()
+        with_history = algorithm1.search_root_move(board.fen(), move, history_keys(board), 1, -INFINITY, INFINITY,
+                                                   INFINITY, None, None, None, True)
+        pool.reset_best_score()
+        without = algorithm1.search_root_move(board.fen(), move, [chess.polyglot.zobrist_hash(board)], 1,
+                                              -INFINITY, INFINITY, INFINITY, None, None, None, True)
+    finally:
+        pool.close()
+    assert with_history[0] == 0
+    assert without[0] != 0
@@ -0,0 +1,31 @@
+import random
+
+import chess
+import pytest
+from benchmark import PERFT_POSITIONS
+from search_board import SearchBoard
+from transposition import decode_move
+
+PERFT_DEPTH = 3
+
+
+@pytest.mark.parametrize('fen', list(PERFT_POSITIONS))
+def test_perft_matches_known_counts(fen):
+    assert SearchBoard(chess.Board(fen)).perft(PERFT_DEPTH) == PERFT_POSITIONS[fen][PERFT_DEPTH - 1]
+
+
+def test_legal_moves_match_python_chess_over_random_games():
+    generator = random.Random(7)
+    for _ in range(50):
+        reference = chess.Board()
+        board = SearchBoard(reference)
+        while not reference.is_game_over() and reference.ply() < 120:
+            moves = board.generate_legal([])
+            assert set(map(decode_move, moves)) == set(reference.legal_moves)
+            move = generator.choice(moves)
+            board.make(move)
+            reference.push(decode_move(move))
+        while reference.move_stack:
+            board.unmake()
+            reference.pop()
+        assert board.to_board().fen() == chess.STARTING_FEN
@@ -0,0 +1,72 @@
+import time
+
+import chess
+import pytest
+import Algorithm2
+from time_manager import (CHECK_INTERVAL, MAX_CLOCK_FRACTION, MIN_BUDGET, SAFETY_MARGIN, SOFT_LIMIT_FRACTION,
+                          TimeManager, move_budget)
+
+
+class FakeClock():
+    # Every read of the clock moves it on by step seconds
+    def __init__(self, step, now=1000.0):
+        self.step = step
+        self.now = now
+        self.reads = 0
+
+    def __call__(self):
+        now = self.now
+        self.now += self.step
+        self.reads += 1
+        return now
+
+
+def test_from_clock_spreads_the_remaining_time():
+    manager = TimeManager.from_clock(60.0, 1.0, start_time=100.0)
+    assert manager.budget == pytest.approx(60.0 / 30 + 0.8)
+    assert manager.deadline == pytest.approx(100.0 + manager.budget)
+    assert move_budget(60.0, moves_to_go=10) == pytest.approx(6.0)
+    # A short clock caps the move at a fraction of it, and there is always some time to search
+    assert move_budget(2.0, 10.0) == pytest.approx(MAX_CLOCK_FRACTION * 2.0 - SAFETY_MARGIN)
+    assert move_budget(0.05) == MIN_BUDGET
+
+
+def test_soft_limit_is_half_the_budget(monkeypatch):
+    clock = FakeClock(0.0)
+    monkeypatch.setattr(time, 'time', clock)
+    manager = TimeManager(budget=2.0)
+    clock.now += SOFT_LIMIT_FRACTION * 2.0 - 0.01
+    assert not manager.soft_limit_reached()
+    clock.now += 0.01
+    assert manager.soft_limit_reached() and not manager.expired()
+    clock.now += 1.0
+    assert manager.expired()
+    assert not TimeManager(budget=None).soft_limit_reached()
+
+
+def test_search_stops_within_its_budget(monkeypatch):
+    # The clock only moves when it is read, which the search does once every CHECK_INTERVAL
+    # nodes, so the budget is a number of clock reads
+    budget = 0.5
+    clock = FakeClock(0.01)
+    monkeypatch.setattr(time, 'time', clock)
+    manager = TimeManager(budget=budget)
+    search = Algorithm2.new_searcher(1)
+    move, stats = Algorithm2.best_move(chess.Board(), 64, time_manager=manager, search=search)
+    assert move is not None and 1 <= stats.depth < 64
+    assert clock.now - manager.start_time <= budget + 2 * clock.step
+    assert search.nodes <= clock.reads * CHECK_INTERVAL
+
+
+def test_no_iteration_starts_past_the_soft_limit(monkeypatch):
+    clock = FakeClock(0.0)
+    monkeypatch.setattr(time, 'time', clock)
+    manager = TimeManager(budget=10.0)
+
+    def spend_half(stats):
+        clock.now += SOFT_LIMIT_FRACTION * 10.0
+
+    move, stats = Algorithm2.best_move(chess.Board(), 64, time_manager=manager, on_iteration=spend_half,
+                                       search=Algorithm2.new_searcher(1))
+    assert move is not None and stats.depth == 1
+    assert not manager.expired()
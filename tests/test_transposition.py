@@ -0,0 +1,20 @@
+import chess
+from search import MATE_SCORE
+from transposition import EXACT, LOWERBOUND, TranspositionTable, encode_move, quantize
+
+
+def test_scores_read_back_exactly():
+    table = TranspositionTable(1)
+    move = chess.Move.from_uci('e7e8q')
+    for key, score in enumerate((quantize(12.3456), quantize(-0.1 * 37 + 0.05 * 11), -MATE_SCORE + 7, 0), 1):
+        table.store(key, 5, EXACT, score, encode_move(move))
+        assert table.probe(key) == (5, EXACT, score, encode_move(move))
+
+
+def test_rounded_score_keeps_its_side_of_a_bound():
+    # A fractional evaluation just above beta must still read back as a cutoff
+    table = TranspositionTable(1)
+    beta = quantize(100.1)
+    score = quantize(100.1049)
+    table.store(1, 3, LOWERBOUND, score)
+    assert table.probe(1)[2] >= beta
@@ -0,0 +1,33 @@
+import io
+import re
+
+import chess
+from uci import UCIEngine, format_score, parse_go
+
+MATE_FEN = '2k5/8/8/8/8/8/R7/1R5K w - - 0 1'
+
+
+def run(engine, *lines):
+    for line in lines:
+        assert engine.handle(line)
+    if engine.thread is not None:
+        engine.thread.join()
+
+
+def test_mate_scores_from_a_shared_table_are_whole_moves():
+    output = io.StringIO()
+    engine = UCIEngine('Algorithm2', output=output)
+    # The second search reads its mate scores back from the first one's table
+    for _ in range(2):
+        run(engine, f'position fen {MATE_FEN}', 'go depth 4')
+    mates = re.findall(r'score mate (\S+)', output.getvalue())
+    assert mates and all(mate == '2' for mate in mates)
+    assert format_score(9999997.0) == 'mate 2'
+
+
+def test_unparsable_commands_are_ignored():
+    engine = UCIEngine('Algorithm2', output=io.StringIO())
+    assert parse_go(['wtime', 'abc', 'depth', '2']) == {'depth': 2}
+    run(engine, 'position startpos moves e2e4', 'position startpos moves e7e5', 'setoption name Hash value x')
+    assert engine.board.move_stack == [chess.Move.from_uci('e2e4')]
+    assert engine.hash_mb > 0
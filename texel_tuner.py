@@ -0,0 +1,182 @@
+import argparse
+import sys
+import time
+
+import chess
+import numpy as np
+from AI import AI, TUNED_PATH
+from evaluator import PIECE_VALUES, evaluate_mobility
+from training_data import TRAINING_DIR, board_from_record, load_shards
+
+# Order of the table entries in the parameter vector: PIECE_ORDER[i] owns entries i*64 to i*64+63
+PIECE_ORDER = 'PNBRQK'
+TABLE_SIZE = 6 * 64
+MAX_PIECES = 32
+
+# Scalar terms tuned next to the tables, in algorithm1.evaluation's names
+TERMS = ('mobility', 'center', 'pawns', 'king_safety')
+
+CENTER_SQUARES = [chess.D4, chess.E4, chess.D5, chess.E5]
+BLOCK_SIZE = 65536
+
+DEFAULT_EPOCHS = 300
+DEFAULT_LEARNING_RATE = 0.1
+
+
+def block_features(records):
+    # Features of algorithm1.evaluation for a block of training records, all from the side to
+    # move's view like the evaluation itself. The piece-square term is kept as up to 32 table
+    # indices per position, TABLE_SIZE being a padding entry that is always zero.
+    count = len(records)
+    bits = np.unpackbits(records['pieces'].astype('<u8').view(np.uint8).reshape(count, 12, 8), axis=2,
+                         bitorder='little').reshape(count, 12, 64).astype(bool)
+    turn = records['turn'].astype(bool)
+    sign = np.where(turn, 1.0, -1.0)
+
+    piece_counts = bits.sum(axis=2)
+    values = np.array([PIECE_VALUES.get(piece_type, 0) for piece_type in chess.PIECE_TYPES], dtype=np.float64)
+    material = sign * (piece_counts[:, :6] @ values - piece_counts[:, 6:] @ values)
+
+    # Both colours read the same table; with black to move every square is read at 63 - square
+    occupancy = bits[:, :6] | bits[:, 6:]
+    occupancy[~turn] = occupancy[~turn, :, ::-1]
+    rows, columns = np.nonzero(occupancy.reshape(count, TABLE_SIZE))
+    starts = np.searchsorted(rows, np.arange(count))
+    indices = np.full((count, MAX_PIECES), TABLE_SIZE, dtype=np.int16)
+    indices[rows, np.arange(len(rows)) - starts[rows]] = columns
+
+    occupied = bits.any(axis=1)
+    center = occupied[:, CENTER_SQUARES].sum(axis=1)
+
+    pawns = (bits[:, chess.PAWN - 1] | bits[:, 6 + chess.PAWN - 1]).reshape(count, 8, 8)
+    isolated = pawns[:, :, 1:7] & ~pawns[:, :, :6] & ~pawns[:, :, 2:]
+    doubled = pawns.sum(axis=(1, 2)) - pawns.any(axis=1).sum(axis=1)
+    pawn_structure = -30 * isolated.sum(axis=(1, 2)) - 40 * doubled
+
+    king_safety = np.where(records['in_check'].astype(bool), -500.0, 500.0)
+
+    mobility = np.array([evaluate_mobility(board_from_record(record)) for record in records], dtype=np.float64)
+
+    # Terms other than the king safety are negated with black to move, as in the evaluation
+    terms = np.stack([sign * mobility, sign * center, sign * pawn_structure, king_safety], axis=1)
+    return sign, material, indices, terms
+
+
+class Dataset():
+    # Feature matrices for every position, built once; each epoch only runs array operations
+    def __init__(self, shards):
+        blocks = []
+        results = []
+        for shard in shards:
+            for start in range(0, len(shard), BLOCK_SIZE):
+                records = np.asarray(shard[start:start + BLOCK_SIZE])
+                blocks.append(block_features(records))
+                results.append(records['result'].astype(np.float64))
+        if not blocks:
+            raise ValueError("No training positions; build them with training_data.py first")
+        self.sign = np.concatenate([block[0] for block in blocks])
+        self.material = np.concatenate([block[1] for block in blocks])
+        self.indices = np.concatenate([block[2] for block in blocks])
+        self.terms = np.concatenate([block[3] for block in blocks])
+        self.results = np.concatenate(results)
+
+    def __len__(self):
+        return len(self.results)
+
+    def evaluate(self, table, weights):
+        # Scores from white's view; table holds the activity weight times each table entry
+        padded = np.append(table, 0.0)
+        side_to_move = self.material + padded[self.indices].sum(axis=1) + self.terms @ weights
+        return self.sign * side_to_move
+
+
+def win_probability(scores, k):
+    return 1 / (1 + 10 ** (-k * scores / 400))
+
+
+def loss(dataset, table, weights, k):
+    return np.mean((dataset.results - win_probability(dataset.evaluate(table, weights), k)) ** 2)
+
+
+def fit_scale(dataset, table, weights):
+    # The K that best maps the current evaluation onto results, by golden-section search
+    low, high = 0.0, 10.0
+    ratio = (5 ** 0.5 - 1) / 2
+    for _ in range(40):
+        a = high - ratio * (high - low)
+        b = low + ratio * (high - low)
+        if loss(dataset, table, weights, a) < loss(dataset, table, weights, b):
+            high = b
+        else:
+            low = a
+    return (low + high) / 2
+
+
+def tune(dataset, table, weights, epochs=DEFAULT_EPOCHS, learning_rate=DEFAULT_LEARNING_RATE, log=None):
+    # Full-batch Adam on the mean squared error between results and win probabilities.
+    # Material stays fixed as the unit the other terms are measured in.
+    k = fit_scale(dataset, table, weights)
+    params = np.concatenate([table, weights])
+    moments = np.zeros_like(params)
+    velocities = np.zeros_like(params)
+    # Every step moves a score by about the learning rate: a table entry adds itself, a weight
+    # adds itself times its term, so weights move slower in proportion to their terms' size
+    rates = np.concatenate([np.full(TABLE_SIZE, learning_rate), learning_rate / np.abs(dataset.terms).mean(axis=0)
+                            .clip(min=1.0)])
+    for epoch in range(1, epochs + 1):
+        table, weights = params[:TABLE_SIZE], params[TABLE_SIZE:]
+        scores = dataset.evaluate(table, weights)
+        probability = win_probability(scores, k)
+        # d loss / d side-to-move score, per position
+        error = (-2 / len(dataset) * (dataset.results - probability) * probability * (1 - probability)
+                 * k * np.log(10) / 400 * dataset.sign)
+        table_gradient = np.bincount(dataset.indices.ravel(), weights=np.repeat(error, MAX_PIECES),
+                                     minlength=TABLE_SIZE + 1)[:TABLE_SIZE]
+        gradient = np.concatenate([table_gradient, dataset.terms.T @ error])
+
+        moments = 0.9 * moments + 0.1 * gradient
+        velocities = 0.999 * velocities + 0.001 * gradient ** 2
+        step = (moments / (1 - 0.9 ** epoch)) / (np.sqrt(velocities / (1 - 0.999 ** epoch)) + 1e-12)
+        params = params - rates * step
+        if log is not None and (epoch % 50 == 0 or epoch == epochs):
+            log(f"Epoch {epoch}: loss {loss(dataset, params[:TABLE_SIZE], params[TABLE_SIZE:], k):.6f}")
+    return params[:TABLE_SIZE], params[TABLE_SIZE:], k
+
+
+def initial_params(ai):
+    # The activity weight scales every table entry, so the tables are tuned with it folded in
+    weights = ai.getWeights()
+    table = np.array([value for symbol in PIECE_ORDER for value in ai.getTable()[symbol]], dtype=np.float64)
+    return table * weights['activity'], np.array([weights[term] for term in TERMS], dtype=np.float64)
+
+
+def apply_params(ai, table, weights):
+    activity = ai.getWeights()['activity']
+    entries = np.round(table / activity).astype(int).tolist()
+    ai.setTable({symbol: entries[index * 64:(index + 1) * 64] for index, symbol in enumerate(PIECE_ORDER)})
+    ai.setWeights({term: round(float(weight), 4) for term, weight in zip(TERMS, weights)})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Texel-tune algorithm1's evaluation on training shards")
+    parser.add_argument('--data', default=TRAINING_DIR)
+    parser.add_argument('--epochs', type=int, default=DEFAULT_EPOCHS)
+    parser.add_argument('--learning-rate', type=float, default=DEFAULT_LEARNING_RATE)
+    parser.add_argument('--output', default=TUNED_PATH)
+    args = parser.parse_args()
+
+    start = time.time()
+    dataset = Dataset(load_shards(args.data))
+    print(f"Loaded {len(dataset)} positions in {time.time() - start:.1f}s", file=sys.stderr)
+
+    ai = AI()
+    ai.loadTable(args.output)
+    table, weights = initial_params(ai)
+    before = loss(dataset, table, weights, fit_scale(dataset, table, weights))
+    table, weights, k = tune(dataset, table, weights, args.epochs, args.learning_rate,
+                             lambda line: print(line, file=sys.stderr))
+    print(f"Loss {before:.6f} -> {loss(dataset, table, weights, k):.6f} (K={k:.3f}) "
+          f"in {time.time() - start:.1f}s", file=sys.stderr)
+    apply_params(ai, table, weights)
+    ai.saveTable(args.output)
+    print(f"Wrote tuned tables to {args.output}", file=sys.stderr)
@@ -0,0 +1,54 @@
+import time
+
+# The clock is read once every CHECK_INTERVAL nodes, a few milliseconds of search
+CHECK_INTERVAL = 64
+
+DEFAULT_MOVE_TIME = 40.0
+DEFAULT_MOVES_TO_GO = 30
+MAX_CLOCK_FRACTION = 0.4
+SAFETY_MARGIN = 0.05
+MIN_BUDGET = 0.01
+
+# A new iteration usually takes several times longer than the last one, so none is started
+# once this fraction of the budget is gone
+SOFT_LIMIT_FRACTION = 0.5
+
+
+class SearchAborted(Exception):
+    pass
+
+
+def move_budget(remaining, increment=0.0, moves_to_go=None):
+    # Spread the remaining time over the moves still to play, spend most of the increment,
+    # and never risk more than a fraction of the clock on one move
+    moves_to_go = moves_to_go or DEFAULT_MOVES_TO_GO
+    budget = remaining / moves_to_go + 0.8 * increment
+    return max(MIN_BUDGET, min(budget, MAX_CLOCK_FRACTION * remaining - SAFETY_MARGIN))
+
+
+class TimeManager():
+    def __init__(self, budget=DEFAULT_MOVE_TIME, start_time=None, max_nodes=None):
+        self.start_time = time.time() if start_time is None else start_time
+        self.budget = budget
+        self.deadline = float('inf') if budget is None else self.start_time + budget
+        # Optional node limit, for searches that must be reproducible regardless of machine speed
+        self.max_nodes = max_nodes
+
+    @classmethod
+    def from_clock(cls, remaining, increment=0.0, moves_to_go=None, start_time=None):
+        return cls(move_budget(remaining, increment, moves_to_go), start_time)
+
+    def set_budget(self, budget, start_time=None):
+        # Turns an open-ended search, such as pondering, into a timed one
+        self.start_time = time.time() if start_time is None else start_time
+        self.budget = budget
+        self.deadline = float('inf') if budget is None else self.start_time + budget
+
+    def elapsed(self):
+        return time.time() - self.start_time
+
+    def soft_limit_reached(self):
+        return self.budget is not None and self.elapsed() >= SOFT_LIMIT_FRACTION * self.budget
+
+    def expired(self):
+        return time.time() >= self.deadline
@@ -0,0 +1,285 @@
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import chess
+import algorithm1 as algor
+import Algorithm2 as algor2
+from game_store import STORE_DIR, GameStore
+from opening_book import ECO_PATH, iter_pgn_games
+from search import DEFAULT_OPTIONS
+from search_pool import SearchPool
+from time_manager import TimeManager
+
+ENGINES = ('algorithm1', 'Algorithm2')
+
+DEFAULT_GAMES = 200
+DEFAULT_MOVE_TIME = 0.5
+MAX_DEPTH = 64
+
+# Games that run this long are adjudicated as draws
+MAX_PLIES = 300
+
+# Every game starts from an ECO line cut to this many plies, played once with each colour
+OPENING_PLIES = 8
+
+# SPRT: H0 says engine A is no stronger than ELO0, H1 that it is ELO1 stronger
+ELO0 = 0.0
+ELO1 = 10.0
+SPRT_ALPHA = 0.05
+SPRT_BETA = 0.05
+
+
+def parse_engine(spec):
+    # 'algorithm1' or 'Algorithm2:lmr=0,null_move=0' for one engine with search options changed
+    engine, _, rest = spec.partition(':')
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine {engine!r}, expected one of {', '.join(ENGINES)}")
+    options = {}
+    for item in filter(None, rest.split(',')):
+        key, _, value = item.partition('=')
+        if key not in DEFAULT_OPTIONS:
+            raise ValueError(f"Unknown search option {key!r}")
+        options[key] = value.lower() not in ('0', 'false', 'off', 'no')
+    return {'name': spec, 'engine': engine, 'options': options}
+
+
+def load_openings(count, plies=OPENING_PLIES, path=ECO_PATH):
+    # Distinct ECO lines, spread evenly over the whole file rather than all from A00
+    lines = {}
+    for moves in iter_pgn_games(path):
+        if len(moves) >= plies:
+            line = tuple(move.uci() for move in moves[:plies])
+            lines.setdefault(line, None)
+    lines = list(lines) or [()]
+    return [list(lines[index * len(lines) // count % len(lines)]) for index in range(count)]
+
+
+def expected_score(elo):
+    return 1 / (1 + 10 ** (-elo / 400))
+
+
+class SPRT():
+    # Sequential probability ratio test on win/draw/loss counts, with the normal approximation
+    # of the log-likelihood ratio
+    def __init__(self, elo0=ELO0, elo1=ELO1, alpha=SPRT_ALPHA, beta=SPRT_BETA):
+        self.elo0 = elo0
+        self.elo1 = elo1
+        self.lower = math.log(beta / (1 - alpha))
+        self.upper = math.log((1 - beta) / alpha)
+        self.wins = 0
+        self.draws = 0
+        self.losses = 0
+
+    def add(self, score):
+        if score == 1:
+            self.wins += 1
+        elif score == 0:
+            self.losses += 1
+        else:
+            self.draws += 1
+
+    def games(self):
+        return self.wins + self.draws + self.losses
+
+    def score(self):
+        games = self.games()
+        return (self.wins + 0.5 * self.draws) / games if games else 0.5
+
+    def variance(self):
+        games = self.games()
+        if not games:
+            return 0.0
+        score = self.score()
+        return (self.wins * (1 - score) ** 2 + self.draws * (0.5 - score) ** 2 + self.losses * score ** 2) / games
+
+    def llr(self):
+        variance = self.variance()
+        if not variance:
+            return 0.0
+        s0, s1 = expected_score(self.elo0), expected_score(self.elo1)
+        return self.games() * (s1 - s0) * (2 * self.score() - s0 - s1) / (2 * variance)
+
+    def status(self):
+        llr = self.llr()
+        if llr >= self.upper:
+            return 'H1'
+        if llr <= self.lower:
+            return 'H0'
+        return None
+
+    def elo(self):
+        # Elo difference and its 95% error margin
+        games = self.games()
+        score = min(max(self.score(), 1e-6), 1 - 1e-6)
+        elo = -400 * math.log10(1 / score - 1)
+        if not games:
+            return elo, float('inf')
+        margin = 1.96 * math.sqrt(self.variance() / games)
+        high = min(score + margin, 1 - 1e-6)
+        low = max(score - margin, 1e-6)
+        return elo, (-400 * math.log10(1 / high - 1) + 400 * math.log10(1 / low - 1)) / 2
+
+
+class Player():
+    # One side of a game, with tables of its own so the two sides never share search state
+    def __init__(self, spec):
+        self.spec = spec
+        self.pool = None
+        self.search = None
+        if spec['engine'] == 'algorithm1':
+            self.pool = SearchPool(workers=0)
+        else:
+            self.search = algor2.new_searcher()
+
+    def best_move(self, board, time_manager):
+        with contextlib.redirect_stdout(io.StringIO()):
+            if self.pool is not None:
+                self.pool.activate()
+                return algor.iterative_deepening_best_move(board, time_manager.start_time, MAX_DEPTH, pool=self.pool,
+                                                           options=self.spec['options'], time_manager=time_manager)
+            return algor2.best_move(board, MAX_DEPTH, self.spec['options'], time_manager, search=self.search)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+
+
+def play_game(opening, white, black, move_time=DEFAULT_MOVE_TIME, max_nodes=None):
+    # Runs in a tournament process; each game searches serially so games use one core each
+    board = chess.Board()
+    for move in opening:
+        board.push_uci(move)
+    players = {chess.WHITE: Player(white), chess.BLACK: Player(black)}
+    nodes = {chess.WHITE: 0, chess.BLACK: 0}
+    elapsed = {chess.WHITE: 0.0, chess.BLACK: 0.0}
+    termination = 'max_plies'
+    try:
+        while board.outcome(claim_draw=True) is None and board.ply() < MAX_PLIES:
+            color = board.turn
+            time_manager = TimeManager(budget=move_time, max_nodes=max_nodes)
+            move, stats = players[color].best_move(board, time_manager)
+            elapsed[color] += time_manager.elapsed()
+            nodes[color] += stats.nodes
+            if move is None:
+                termination = 'no_move'
+                break
+            board.push(move)
+    finally:
+        for player in players.values():
+            player.close()
+
+    outcome = board.outcome(claim_draw=True)
+    return {
+        'white': white['name'],
+        'black': black['name'],
+        'result': outcome.result() if outcome else '1/2-1/2',
+        'termination': outcome.termination.name.lower() if outcome else termination,
+        'opening_plies': len(opening),
+        'moves': [move.uci() for move in board.move_stack],
+        'nodes': {'white': nodes[chess.WHITE], 'black': nodes[chess.BLACK]},
+        'time': {'white': elapsed[chess.WHITE], 'black': elapsed[chess.BLACK]},
+    }
+
+
+def score_for(game, name):
+    if game['result'] == '1/2-1/2':
+        return 0.5
+    white_won = game['result'] == '1-0'
+    return 1 if white_won == (game['white'] == name) else 0
+
+
+def run_tournament(engine_a, engine_b, games=DEFAULT_GAMES, workers=None, move_time=DEFAULT_MOVE_TIME,
+                   max_nodes=None, store_dir=STORE_DIR, sprt=None):
+    # Games are scored from engine A's side. The SPRT stops the match as soon as it decides,
+    # and games that have not started by then are cancelled. Games already running are played
+    # out and stored, but no longer scored. Only this process writes to the game store.
+    if engine_a['name'] == engine_b['name']:
+        engine_b = dict(engine_b, name=engine_b['name'] + ' (B)')
+    sprt = sprt or SPRT()
+    openings = load_openings((games + 1) // 2)
+    start = time.time()
+    store = GameStore(store_dir) if store_dir else None
+
+    def save(game):
+        if store is not None:
+            moves = [chess.Move.from_uci(move) for move in game['moves']]
+            store.append(moves, **{key: value for key, value in game.items() if key != 'moves'},
+                         move_time=move_time, max_nodes=max_nodes)
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = []
+        for index in range(games):
+            white, black = (engine_a, engine_b) if index % 2 == 0 else (engine_b, engine_a)
+            futures.append(executor.submit(play_game, openings[index // 2], white, black, move_time, max_nodes))
+        saved = set()
+        for future in as_completed(futures):
+            game = future.result()
+            save(game)
+            saved.add(future)
+            sprt.add(score_for(game, engine_a['name']))
+            elo, margin = sprt.elo()
+            print(f"Game {sprt.games()}: {game['white']} vs {game['black']} {game['result']} "
+                  f"({game['termination']}), W/D/L {sprt.wins}/{sprt.draws}/{sprt.losses}, "
+                  f"Elo {elo:+.1f} +/- {margin:.1f}, LLR {sprt.llr():.2f} [{sprt.lower:.2f}, {sprt.upper:.2f}]",
+                  file=sys.stderr)
+            if sprt.status() is not None:
+                for pending in futures:
+                    pending.cancel()
+                break
+        for future in futures:
+            if future not in saved and not future.cancelled():
+                save(future.result())
+                saved.add(future)
+    if store is not None:
+        store.close()
+
+    elo, margin = sprt.elo()
+    return {
+        'engine_a': engine_a['name'],
+        'engine_b': engine_b['name'],
+        'games': sprt.games(),
+        'played': len(saved),
+        'wins': sprt.wins,
+        'draws': sprt.draws,
+        'losses': sprt.losses,
+        'score': sprt.score(),
+        'elo': elo,
+        'elo_margin': margin,
+        'llr': sprt.llr(),
+        'bounds': [sprt.lower, sprt.upper],
+        'sprt': sprt.status(),
+        'elapsed': time.time() - start,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless engine-vs-engine match with an SPRT stop")
+    parser.add_argument('engine_a', nargs='?', default='algorithm1')
+    parser.add_argument('engine_b', nargs='?', default='Algorithm2')
+    parser.add_argument('--games', type=int, default=DEFAULT_GAMES)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--move-time', type=float, default=DEFAULT_MOVE_TIME)
+    parser.add_argument('--nodes', type=int, default=None, help="node budget per move instead of a time budget")
+    parser.add_argument('--elo0', type=float, default=ELO0)
+    parser.add_argument('--elo1', type=float, default=ELO1)
+    parser.add_argument('--alpha', type=float, default=SPRT_ALPHA)
+    parser.add_argument('--beta', type=float, default=SPRT_BETA)
+    parser.add_argument('--store-dir', default=STORE_DIR)
+    args = parser.parse_args(argv)
+
+    move_time = None if args.nodes else args.move_time
+    result = run_tournament(parse_engine(args.engine_a), parse_engine(args.engine_b), args.games, args.workers,
+                            move_time, args.nodes, args.store_dir, SPRT(args.elo0, args.elo1, args.alpha, args.beta))
+    json.dump(result, sys.stdout, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
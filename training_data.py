@@ -0,0 +1,294 @@
+import argparse
+import glob
+import io
+import os
+import sys
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+
+import chess
+import chess.pgn
+import chess.polyglot
+import numpy as np
+from game_store import STORE_DIR, GameStore
+from opening_book import ECO_PATH
+from paths import ROOT
+
+PGN_DIR = os.path.join(ROOT, 'pgn-extract', 'test', 'infiles')
+TRAINING_DIR = os.path.join(ROOT, 'training')
+
+# One record per distinct position: the twelve piece bitboards (white pawn to king, then
+# black), the side to move, whether it is in check, its legal move count, the en passant square
+# (NO_EP_SQUARE when there is none) and the mean result of the games it occurred in from
+# white's side (1 win, 0.5 draw, 0 loss)
+RECORD_DTYPE = np.dtype([('key', '<u8'), ('pieces', '<u8', (12,)), ('turn', 'u1'), ('in_check', 'u1'),
+                         ('mobility', 'u1'), ('ep_square', 'u1'), ('result', '<f4')])
+NO_EP_SQUARE = 64
+
+RESULTS = {'1-0': 1.0, '0-1': 0.0, '1/2-1/2': 0.5}
+
+GAMES_PER_CHUNK = 256
+
+# Positions are spread over partitions by key, so duplicates always meet in the same partition
+# and each one can be deduplicated on its own. A partition is spilled to disk whenever it holds
+# this many records, which bounds the memory of the whole run.
+PARTITIONS = 64
+SPILL_RECORDS = 8192
+
+# Spills are sorted by key, so a partition's shard is built by merging them a block at a time;
+# this many records are read over all of a partition's spills at once
+MERGE_RECORDS = 1 << 16
+
+
+def iter_pgn_chunks(path, games_per_chunk=GAMES_PER_CHUNK):
+    # Raw game texts, a chunk at a time; a header line after movetext starts the next game
+    chunk = []
+    lines = []
+    in_moves = False
+    with open(path, encoding='utf-8', errors='replace') as handle:
+        for line in handle:
+            if line.startswith('[') and in_moves:
+                chunk.append(''.join(lines))
+                lines = []
+                in_moves = False
+                if len(chunk) >= games_per_chunk:
+                    yield 'pgn', chunk
+                    chunk = []
+            elif line.strip() and not line.startswith('['):
+                in_moves = True
+            lines.append(line)
+    if in_moves:
+        chunk.append(''.join(lines))
+    if chunk:
+        yield 'pgn', chunk
+
+
+def iter_store_chunks(directory=STORE_DIR, games_per_chunk=GAMES_PER_CHUNK):
+    # Archived games travel to the workers as UCI moves and their result
+    if not os.path.exists(directory):
+        return
+    chunk = []
+    with GameStore(directory) as store:
+        for game in store.games():
+            chunk.append(([move.uci() for move in game.moves], game.metadata.get('result')))
+            if len(chunk) >= games_per_chunk:
+                yield 'moves', chunk
+                chunk = []
+    if chunk:
+        yield 'moves', chunk
+
+
+def iter_games(kind, items):
+    if kind == 'pgn':
+        for text in items:
+            game = chess.pgn.read_game(io.StringIO(text))
+            if game is not None:
+                yield list(game.mainline_moves()), game.headers.get('Result')
+    else:
+        for moves, result in items:
+            yield [chess.Move.from_uci(move) for move in moves], result
+
+
+def position_record(board):
+    pieces = [board.pieces_mask(piece_type, color) for color in chess.COLORS for piece_type in chess.PIECE_TYPES]
+    return (chess.polyglot.zobrist_hash(board), pieces, board.turn, board.is_check(),
+            min(board.legal_moves.count(), 255), NO_EP_SQUARE if board.ep_square is None else board.ep_square)
+
+
+def process_chunk(kind, items):
+    # Replays a chunk of games into records, deduplicated within the chunk. Games without a
+    # result, such as the ECO lines, have nothing to learn from and are skipped.
+    positions = {}
+    for moves, result in iter_games(kind, items):
+        if result not in RESULTS:
+            continue
+        board = chess.Board()
+        for move in moves:
+            if not board.is_legal(move):
+                break
+            board.push(move)
+            record = position_record(board)
+            entry = positions.get(record[0])
+            if entry is None:
+                positions[record[0]] = [record, RESULTS[result], 1]
+            else:
+                entry[1] += RESULTS[result]
+                entry[2] += 1
+
+    records = np.zeros(len(positions), dtype=RECORD_DTYPE)
+    counts = np.zeros(len(positions), dtype=np.uint32)
+    for index, ((key, pieces, turn, in_check, mobility, ep_square), total, count) in enumerate(positions.values()):
+        records[index] = (key, pieces, turn, in_check, mobility, ep_square, total / count)
+        counts[index] = count
+    return records, counts
+
+
+def deduplicate(records, counts):
+    # Sorts records by key and merges duplicates, averaging their results weighted by how many
+    # games each came from
+    keys, first, inverse = np.unique(records['key'], return_index=True, return_inverse=True)
+    weights = np.bincount(inverse, weights=counts)
+    merged = records[first]
+    merged['result'] = np.bincount(inverse, weights=records['result'] * counts) / weights
+    return merged, weights.astype(np.uint32)
+
+
+def merge_spills(names, path, merge_records=MERGE_RECORDS):
+    # Streams sorted spills into one deduplicated shard. Each round reads a block from every
+    # spill and takes the records up to the smallest last key among the blocks: all copies of
+    # those keys are in the blocks, so they merge in this round and never meet again.
+    spills = [(np.load(f'{name}.npy', mmap_mode='r'), np.load(f'{name}.counts.npy', mmap_mode='r'))
+              for name in names]
+    positions = [0] * len(spills)
+    block = max(1, merge_records // max(1, len(spills)))
+    temporary = f'{path}.tmp'
+    total = 0
+    with open(temporary, 'wb') as output:
+        while True:
+            active = [number for number, (records, _) in enumerate(spills) if positions[number] < len(records)]
+            if not active:
+                break
+            ends = {number: min(positions[number] + block, len(spills[number][0])) for number in active}
+            bound = min(spills[number][0]['key'][ends[number] - 1] for number in active)
+            parts = []
+            part_counts = []
+            for number in active:
+                records, counts = spills[number]
+                start = positions[number]
+                end = start + int(np.searchsorted(records['key'][start:ends[number]], bound, side='right'))
+                parts.append(records[start:end])
+                part_counts.append(counts[start:end])
+                positions[number] = end
+            merged, _ = deduplicate(np.concatenate(parts), np.concatenate(part_counts))
+            output.write(merged.tobytes())
+            total += len(merged)
+    del spills
+
+    # The shard gets its .npy header once its length is known, and is copied in a block at a time
+    shard = np.lib.format.open_memmap(path, mode='w+', dtype=RECORD_DTYPE, shape=(total,))
+    if total:
+        merged = np.memmap(temporary, dtype=RECORD_DTYPE, mode='r', shape=(total,))
+        for start in range(0, total, merge_records):
+            shard[start:start + merge_records] = merged[start:start + merge_records]
+        del merged
+    shard.flush()
+    del shard
+    os.remove(temporary)
+    return total
+
+
+class PartitionWriter():
+    # Buffers records per key partition and spills full buffers to .npy files, sorted by key
+    # and deduplicated
+    def __init__(self, directory, partitions=PARTITIONS, spill_records=SPILL_RECORDS):
+        self.directory = directory
+        self.partitions = partitions
+        self.spill_records = spill_records
+        self.buffers = defaultdict(list)
+        self.sizes = defaultdict(int)
+        self.spills = defaultdict(int)
+        os.makedirs(directory, exist_ok=True)
+        # Shards of an earlier run would be mixed in with this one
+        for pattern in ('shard-*.npy', 'spill-*.npy'):
+            for path in glob.glob(os.path.join(directory, pattern)):
+                os.remove(path)
+
+    def add(self, records, counts):
+        partition = records['key'] % self.partitions
+        for number in np.unique(partition):
+            mask = partition == number
+            self.buffers[number].append((records[mask], counts[mask]))
+            self.sizes[number] += int(mask.sum())
+            if self.sizes[number] >= self.spill_records:
+                self.spill(number)
+
+    def spill(self, number):
+        records, counts = deduplicate(np.concatenate([records for records, _ in self.buffers[number]]),
+                                      np.concatenate([counts for _, counts in self.buffers[number]]))
+        name = f'spill-{number:03d}-{self.spills[number]:05d}'
+        np.save(os.path.join(self.directory, f'{name}.npy'), records)
+        np.save(os.path.join(self.directory, f'{name}.counts.npy'), counts)
+        self.spills[number] += 1
+        self.buffers[number] = []
+        self.sizes[number] = 0
+
+    def finish(self):
+        # Merges each partition's spills into one deduplicated, memory-mappable shard, never
+        # holding more than a block of any of them in memory
+        for number in list(self.buffers):
+            if self.sizes[number]:
+                self.spill(number)
+        total = 0
+        for number in sorted(self.spills):
+            names = [os.path.join(self.directory, f'spill-{number:03d}-{spill:05d}')
+                     for spill in range(self.spills[number])]
+            total += merge_spills(names, os.path.join(self.directory, f'shard-{number:03d}.npy'))
+            for name in names:
+                os.remove(f'{name}.npy')
+                os.remove(f'{name}.counts.npy')
+        return total
+
+
+def build(sources, output=TRAINING_DIR, workers=None, partitions=PARTITIONS):
+    # sources yield (kind, items) chunks. Only a few chunks per worker are in flight at once,
+    # so the inputs are never read further ahead than the workers can keep up with.
+    workers = workers or os.cpu_count()
+    writer = PartitionWriter(output, partitions)
+    games = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for source in sources:
+            for kind, items in source:
+                games += len(items)
+                pending.append(executor.submit(process_chunk, kind, items))
+                while len(pending) >= 2 * workers:
+                    writer.add(*pending.popleft().result())
+        while pending:
+            writer.add(*pending.popleft().result())
+    return games, writer.finish()
+
+
+def default_sources(pgn_paths=None, store_dir=STORE_DIR):
+    if pgn_paths is None:
+        pgn_paths = [ECO_PATH] + sorted(glob.glob(os.path.join(PGN_DIR, '*.pgn')))
+    sources = [iter_pgn_chunks(path) for path in pgn_paths]
+    if store_dir:
+        sources.append(iter_store_chunks(store_dir))
+    return sources
+
+
+def board_from_record(record):
+    # The position of a record, without castling rights or move counters
+    board = chess.Board.empty()
+    pieces = [int(mask) for mask in record['pieces']]
+    for piece_type in chess.PIECE_TYPES:
+        setattr(board, chess.PIECE_NAMES[piece_type] + 's', pieces[piece_type - 1] | pieces[5 + piece_type])
+    board.occupied_co[chess.WHITE] = 0
+    board.occupied_co[chess.BLACK] = 0
+    for piece_type in chess.PIECE_TYPES:
+        board.occupied_co[chess.WHITE] |= pieces[piece_type - 1]
+        board.occupied_co[chess.BLACK] |= pieces[5 + piece_type]
+    board.occupied = board.occupied_co[chess.WHITE] | board.occupied_co[chess.BLACK]
+    board.turn = bool(record['turn'])
+    if record['ep_square'] != NO_EP_SQUARE:
+        board.ep_square = int(record['ep_square'])
+    return board
+
+
+def load_shards(directory=TRAINING_DIR):
+    # Memory-mapped shards, so readers only page in the records they touch
+    for path in sorted(glob.glob(os.path.join(directory, 'shard-*.npy'))):
+        yield np.load(path, mmap_mode='r')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay PGN files and the game store into training shards")
+    parser.add_argument('pgn', nargs='*', help="PGN files; defaults to eco.pgn and the pgn-extract test games")
+    parser.add_argument('--output', default=TRAINING_DIR)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--partitions', type=int, default=PARTITIONS)
+    parser.add_argument('--no-store', action='store_true', help="leave out the game store")
+    args = parser.parse_args()
+    games, positions = build(default_sources(args.pgn or None, None if args.no_store else STORE_DIR),
+                             args.output, args.workers, args.partitions)
+    print(f"Replayed {games} games into {positions} positions in {args.output}", file=sys.stderr)
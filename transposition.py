@@ -0,0 +1,165 @@
+from array import array
+from multiprocessing import shared_memory
+
+import chess
+
+EXACT = 1
+LOWERBOUND = 2
+UPPERBOUND = 3
+
+DEFAULT_SIZE_MB = 16
+ENTRY_BYTES = 16
+
+# Scores are stored as signed 32-bit counts of hundredths of an evaluation unit. The search
+# rounds its evaluations to the same steps, so a stored score reads back exactly as it was
+# searched and compares with alpha and beta the same way.
+SCORE_STEPS = 100
+SCORE_LIMIT = (1 << 31) - 1
+
+
+def quantize(score):
+    return round(score * SCORE_STEPS) / SCORE_STEPS
+
+
+def encode_move(move):
+    if move is None:
+        return 0
+    return move.from_square | (move.to_square << 6) | ((move.promotion or 0) << 12)
+
+
+def decode_move(code):
+    if not code:
+        return None
+    return chess.Move(code & 63, (code >> 6) & 63, (code >> 12) or None)
+
+
+def pack(depth, flag, score, move, age):
+    # score (32 bits) | depth (8 bits) | flag (2 bits) | age (6 bits) | move (16 bits), the move
+    # already encoded by encode_move
+    steps = max(-SCORE_LIMIT, min(SCORE_LIMIT, round(score * SCORE_STEPS)))
+    return (steps & 0xFFFFFFFF) | (depth & 255) << 32 | flag << 40 | age << 42 | move << 48
+
+
+def unpack(data):
+    steps = data & 0xFFFFFFFF
+    if steps >> 31:
+        steps -= 1 << 32
+    return (data >> 32) & 255, (data >> 40) & 3, steps / SCORE_STEPS, data >> 48
+
+
+def entry_count(size_mb):
+    # Largest power of two number of entries that fits in the budget
+    entries = max(2, size_mb * 1024 * 1024 // ENTRY_BYTES)
+    return 1 << (entries.bit_length() - 1)
+
+
+class TranspositionTable():
+    # Fixed-size table of two-slot buckets. Every entry is two 64-bit words: the key XORed
+    # with the data, then the data, so a torn or foreign entry never verifies. Moves go in and
+    # come out in encode_move's form, 0 for none, as the search plays them on a SearchBoard.
+    def __init__(self, size_mb=DEFAULT_SIZE_MB):
+        self.resize(size_mb)
+
+    def allocate(self, entries):
+        return array('Q', bytes(entries * ENTRY_BYTES))
+
+    def resize(self, size_mb):
+        self.size_mb = size_mb
+        self.entries = entry_count(size_mb)
+        self.mask = self.entries - 2
+        self.slots = self.allocate(self.entries)
+        self.age = 0
+
+    def clear(self):
+        self.slots = self.allocate(self.entries)
+
+    def new_search(self):
+        # Entries from earlier searches stay usable but are the first to be replaced
+        self.age = (self.age + 1) & 63
+
+    def probe(self, key):
+        slots = self.slots
+        index = (key & self.mask) << 1
+        for slot in (index, index + 2):
+            data = slots[slot + 1]
+            if data and slots[slot] ^ data == key:
+                return unpack(data)
+        return None
+
+    def store(self, key, depth, flag, score, move=0):
+        slots = self.slots
+        index = (key & self.mask) << 1
+        data = pack(depth, flag, score, move, self.age)
+
+        replace = None
+        replace_value = None
+        for slot in (index, index + 2):
+            old = slots[slot + 1]
+            if not old or slots[slot] ^ old == key:
+                if old and not move and (old >> 48):
+                    # Keep the best move we already know for this position
+                    data |= (old >> 48) << 48
+                replace = slot
+                break
+            # Prefer replacing entries from older searches, then the shallowest one
+            value = (((old >> 42) & 63) == self.age, (old >> 32) & 255)
+            if replace is None or value < replace_value:
+                replace, replace_value = slot, value
+
+        slots[replace] = key ^ data
+        slots[replace + 1] = data
+
+    def hashfull(self):
+        # Permille of the first thousand entries written during the current search
+        sample = min(1000, self.entries)
+        used = sum(1 for i in range(sample)
+                   if self.slots[2 * i + 1] and ((self.slots[2 * i + 1] >> 42) & 63) == self.age)
+        return used * 1000 // sample
+
+
+class SharedTranspositionTable(TranspositionTable):
+    # The same packed table in a multiprocessing.shared_memory block, so every search
+    # process reads and writes one table. Writes take no lock: a slot torn by two
+    # processes writing at once fails the key XOR check and reads as a miss.
+    # The first word of the block holds the current age.
+    def __init__(self, size_mb=DEFAULT_SIZE_MB, name=None):
+        self.name = name
+        self.owner = name is None
+        self.shm = None
+        self.resize(size_mb)
+
+    def resize(self, size_mb):
+        self.close()
+        self.size_mb = size_mb
+        self.entries = entry_count(size_mb)
+        self.mask = self.entries - 2
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=8 + self.entries * ENTRY_BYTES)
+            self.name = self.shm.name
+        else:
+            self.shm = shared_memory.SharedMemory(name=self.name)
+        self.words = self.shm.buf.cast('Q')
+        self.header = self.words[:1]
+        self.slots = self.words[1:1 + 2 * self.entries]
+
+    @property
+    def age(self):
+        return self.header[0]
+
+    @age.setter
+    def age(self, value):
+        self.header[0] = value
+
+    def clear(self):
+        self.shm.buf[8:8 + self.entries * ENTRY_BYTES] = bytes(self.entries * ENTRY_BYTES)
+
+    def close(self):
+        if self.shm is None:
+            return
+        self.slots.release()
+        self.header.release()
+        self.words.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+        self.shm = None
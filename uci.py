@@ -0,0 +1,280 @@
+import argparse
+import contextlib
+import os
+import sys
+import threading
+
+import chess
+import algorithm1 as algor
+import Algorithm2 as algor2
+from search import MATE_BOUND, MATE_SCORE
+from search_pool import SearchPool
+from time_manager import TimeManager, move_budget
+from transposition import DEFAULT_SIZE_MB
+
+ENGINE_NAME = 'ChessAI'
+ENGINE_AUTHOR = 'Coopsims'
+ENGINES = ('algorithm1', 'Algorithm2')
+MAX_DEPTH = 64
+MAX_THREADS = 256
+MAX_HASH_MB = 4096
+
+# A search asked to stop checks for it every few thousand nodes; until it has, it is told again
+STOP_POLL_INTERVAL = 0.05
+
+
+def format_score(score):
+    # Mate scores count plies from the root; UCI wants moves, negative when the engine is mated.
+    # Scores read back from the transposition table are floats, so they are rounded first.
+    score = round(score)
+    if abs(score) >= MATE_BOUND:
+        moves = (MATE_SCORE - abs(score) + 1) // 2
+        return f'mate {moves if score > 0 else -moves}'
+    return f'cp {score}'
+
+
+def parse_go(tokens):
+    # 'go wtime 60000 btime 60000 winc 1000 ponder' -> {'wtime': 60000, ..., 'ponder': True}
+    limits = {}
+    index = 0
+    while index < len(tokens):
+        token = tokens[index]
+        if token in ('infinite', 'ponder'):
+            limits[token] = True
+            index += 1
+        elif token == 'searchmoves':
+            break
+        else:
+            # A value that is not a number is ignored, as GUIs expect of an engine
+            if index + 1 < len(tokens) and tokens[index + 1].lstrip('-').isdigit():
+                limits[token] = int(tokens[index + 1])
+            index += 2
+    return limits
+
+
+def search_budget(limits, turn):
+    # Seconds for this move, or None for a search that only ends on a depth or node limit or stop
+    if limits.get('infinite'):
+        return None
+    if 'movetime' in limits:
+        return limits['movetime'] / 1000
+    remaining = limits.get('wtime' if turn == chess.WHITE else 'btime')
+    if remaining is None:
+        return None
+    increment = limits.get('winc' if turn == chess.WHITE else 'binc', 0)
+    return move_budget(remaining / 1000, increment / 1000, limits.get('movestogo'))
+
+
+def parse_position(tokens):
+    # 'position startpos moves e2e4 e7e5' or 'position fen <six fields> moves ...'
+    if tokens and tokens[0] == 'fen':
+        end = tokens.index('moves') if 'moves' in tokens else len(tokens)
+        board = chess.Board(' '.join(tokens[1:end]))
+    else:
+        board = chess.Board()
+    if 'moves' in tokens:
+        for move in tokens[tokens.index('moves') + 1:]:
+            board.push_uci(move)
+    return board
+
+
+class UCIEngine():
+    # Either engine behind the UCI protocol. The search runs in a thread of its own, so
+    # commands keep being read and answered while it thinks: stop and ponderhit reach it
+    # through the same stop flag and TimeManager the engines already check.
+    def __init__(self, engine='algorithm1', threads=None, hash_mb=DEFAULT_SIZE_MB, output=None):
+        self.output = output or sys.stdout
+        self.output_lock = threading.Lock()
+        self.engine = engine
+        self.threads = threads or os.cpu_count() or 1
+        self.hash_mb = hash_mb
+        self.pool = None
+        self.search = None
+        self.stop_event = threading.Event()
+        self.board = chess.Board()
+        self.thread = None
+        self.timer = None
+        self.time_manager = None
+        self.ponder_budget = None
+        # Set once bestmove may be sent; pondering and infinite searches hold it back until
+        # ponderhit or stop even when they finish early
+        self.release = threading.Event()
+
+    def send(self, line):
+        with self.output_lock:
+            self.output.write(line + '\n')
+            self.output.flush()
+
+    def prepare(self):
+        # Pool processes and tables are built once, ahead of the first go if the GUI sends isready
+        if self.engine == 'algorithm1' and self.pool is None:
+            self.pool = SearchPool(workers=0 if self.threads == 1 else self.threads, hash_mb=self.hash_mb)
+        elif self.engine == 'Algorithm2' and self.search is None:
+            self.search = algor2.new_searcher(self.hash_mb)
+            self.search.stop_event = self.stop_event
+
+    def close_engine(self):
+        self.stop_search()
+        if self.pool is not None:
+            self.pool.close()
+        self.pool = None
+        self.search = None
+
+    def handle(self, line):
+        # Returns False once the GUI quits. A command that cannot be parsed, such as a position
+        # with an illegal move, is ignored rather than ending the engine.
+        tokens = line.split()
+        if not tokens:
+            return True
+        try:
+            return self.dispatch(tokens[0], tokens[1:])
+        except ValueError:
+            return True
+
+    def dispatch(self, command, arguments):
+        if command == 'uci':
+            self.send(f'id name {ENGINE_NAME}')
+            self.send(f'id author {ENGINE_AUTHOR}')
+            self.send(f"option name Engine type combo default {self.engine} "
+                      + ' '.join(f'var {engine}' for engine in ENGINES))
+            self.send(f'option name Threads type spin default {self.threads} min 1 max {MAX_THREADS}')
+            self.send(f'option name Hash type spin default {self.hash_mb} min 1 max {MAX_HASH_MB}')
+            self.send('option name Ponder type check default false')
+            self.send('uciok')
+        elif command == 'isready':
+            self.prepare()
+            self.send('readyok')
+        elif command == 'setoption':
+            self.set_option(arguments)
+        elif command == 'ucinewgame':
+            # The pool's processes are kept; its table ages its entries out on its own
+            self.stop_search()
+            self.search = None
+            self.board = chess.Board()
+        elif command == 'position':
+            board = parse_position(arguments)
+            self.stop_search()
+            self.board = board
+        elif command == 'go':
+            self.go(parse_go(arguments))
+        elif command == 'stop':
+            self.stop_search()
+        elif command == 'ponderhit':
+            self.ponderhit()
+        elif command == 'quit':
+            self.close_engine()
+            return False
+        return True
+
+    def set_option(self, tokens):
+        if 'name' not in tokens:
+            return
+        end = tokens.index('value') if 'value' in tokens else len(tokens)
+        name = ' '.join(tokens[tokens.index('name') + 1:end]).lower()
+        value = ' '.join(tokens[end + 1:])
+        if name == 'engine' and value in ENGINES:
+            self.close_engine()
+            self.engine = value
+        elif name == 'threads':
+            self.close_engine()
+            self.threads = min(max(int(value), 1), MAX_THREADS)
+        elif name == 'hash':
+            self.close_engine()
+            self.hash_mb = min(max(int(value), 1), MAX_HASH_MB)
+
+    def go(self, limits):
+        self.stop_search()
+        self.prepare()
+        budget = search_budget(limits, self.board.turn)
+        if limits.get('ponder'):
+            # The clock only starts on ponderhit; until then the search is open-ended
+            self.ponder_budget = budget
+            budget = None
+        self.time_manager = TimeManager(budget=budget, max_nodes=limits.get('nodes'))
+        self.stop_event.clear()
+        self.release.clear()
+        if not (limits.get('ponder') or limits.get('infinite')):
+            self.release.set()
+        self.thread = threading.Thread(target=self.run_search, args=(self.board.copy(), self.time_manager,
+                                                                      limits.get('depth', MAX_DEPTH)), daemon=True)
+        self.thread.start()
+
+    def run_search(self, board, time_manager, max_depth):
+        # The engines print their search summaries, which are not UCI, so they go to stderr
+        with contextlib.redirect_stdout(sys.stderr):
+            if self.engine == 'algorithm1':
+                self.pool.activate()
+                move, stats = algor.iterative_deepening_best_move(board, time_manager.start_time, max_depth,
+                                                                  pool=self.pool, time_manager=time_manager,
+                                                                  on_iteration=self.report)
+            else:
+                move, stats = algor2.best_move(board, max_depth, time_manager=time_manager,
+                                               on_iteration=self.report, search=self.search)
+        self.release.wait()
+        if move is None:
+            self.send('bestmove 0000')
+            return
+        pv = stats.iterations[-1]['pv'] if stats.iterations else []
+        if len(pv) > 1 and pv[0] == move.uci():
+            self.send(f'bestmove {move.uci()} ponder {pv[1]}')
+        else:
+            self.send(f'bestmove {move.uci()}')
+
+    def report(self, stats):
+        iteration = stats.iterations[-1]
+        if not iteration['pv']:
+            return
+        elapsed = iteration['time']
+        nps = round(iteration['nodes'] / elapsed) if elapsed else 0
+        self.send(f"info depth {iteration['depth']} score {format_score(iteration['score'])} "
+                  f"nodes {iteration['nodes']} nps {nps} time {round(elapsed * 1000)} pv {' '.join(iteration['pv'])}")
+
+    def halt(self):
+        if self.pool is not None:
+            self.pool.stop()
+        self.stop_event.set()
+
+    def ponderhit(self):
+        # The expected move was played: the ponder search goes on under the move's real budget.
+        # Root tasks already running were handed an open deadline, so a timer stops them.
+        if self.thread is None or self.time_manager is None:
+            return
+        self.time_manager.set_budget(self.ponder_budget)
+        if self.ponder_budget is not None:
+            self.timer = threading.Timer(self.ponder_budget, self.halt)
+            self.timer.start()
+        self.release.set()
+
+    def stop_search(self):
+        if self.thread is None:
+            return
+        self.release.set()
+        while self.thread.is_alive():
+            self.halt()
+            self.thread.join(STOP_POLL_INTERVAL)
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.thread = None
+        self.time_manager = None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="UCI front end for algorithm1 and Algorithm2")
+    parser.add_argument('--engine', choices=ENGINES, default='algorithm1')
+    parser.add_argument('--threads', type=int, default=None, help="search processes; 1 searches serially")
+    parser.add_argument('--hash', type=int, default=DEFAULT_SIZE_MB, help="transposition table size in MB")
+    args = parser.parse_args(argv)
+
+    engine = UCIEngine(args.engine, args.threads, args.hash)
+    # Commands are read here while searches run in their own thread
+    for line in sys.stdin:
+        if not engine.handle(line):
+            break
+    else:
+        engine.close_engine()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())